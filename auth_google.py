@@ -1,16 +1,25 @@
 # coding: utf-8
 """auth_google.py
 Google 認証関連の処理を提供するモジュール
+サービスはプロセスで1つを共有し（get_service）、API呼び出しはスレッドごとの接続で行う
 """
+import json
 import logging
 import pickle
+import threading
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+import google_auth_httplib2
+from google.auth.credentials import AnonymousCredentials
 from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import BatchHttpRequest, build_http
 
+from file_class import write_text_atomic
 from parameter import config
 
 logger = logging.getLogger(__name__)
@@ -19,6 +28,23 @@ logger = logging.getLogger(__name__)
 scopes = config["auth_google"]["scopes"]
 credentials_file = config["auth_google"]["credentials_file"]
 token_file = config["auth_google"]["token_file"]
+# APIの接続先（空欄ならGoogle。テスト用の偽サーバーを指定できる）
+api_endpoint = config["auth_google"].get("api_endpoint", "")
+# Blogger APIのdiscovery文書の保存先（起動時にネットワークを使わない）
+discovery_file = config["auth_google"].get(
+    "discovery_file", "./data/blogger_v3_discovery.json"
+)
+
+# 有効期限のこの時間前にトークンを更新する（API呼び出しの途中で切れないように）
+REFRESH_MARGIN = timedelta(minutes=5)
+
+# 認証なしで接続する接続先（ローカルのテスト用サーバー）
+LOCAL_ENDPOINTS = ("http://localhost", "http://127.0.0.1")
+
+
+def _utcnow():
+    """タイムゾーンなしの現在時刻（UTC）。google-authの有効期限と比べるため"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 class BloggerService:
@@ -29,6 +55,14 @@ class BloggerService:
 
     def __init__(self):
         """Google Blogger API サービスオブジェクトを取得"""
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if api_endpoint.startswith(LOCAL_ENDPOINTS):
+            logger.warning("テスト用の接続先を使用します（認証なし）: %s", api_endpoint)
+            self.creds = AnonymousCredentials()
+            self.resource_object = self._build()
+            return
+
         if not Path(credentials_file).exists():
             raise FileNotFoundError(
                 "credentials.json が見つかりません。Google Cloud Console から OAuth2 認証情報をダウンロードしてください。"
@@ -61,10 +95,124 @@ class BloggerService:
                     logger.error("Google 認証エラー: %s", e, exc_info=True)
                     raise RefreshError(e) from e
 
-            with open(str(token_file), "wb") as token:
-                pickle.dump(self.creds, token)
-        self.resource_object = build("blogger", "v3", credentials=self.creds)
+            self._save_token()
+        self.resource_object = self._build()
+
+    def _save_token(self):
+        with open(str(token_file), "wb") as token:
+            pickle.dump(self.creds, token)
+
+    def _build(self, http=None):
+        # discovery文書は共有し、接続（http）ごとにリソースを作る
+        options = {"api_endpoint": api_endpoint} if api_endpoint else None
+        if http is None:
+            return build_from_document(
+                service_factory.discovery_document(),
+                credentials=self.creds,
+                client_options=options,
+            )
+        return build_from_document(
+            service_factory.discovery_document(), http=http, client_options=options
+        )
+
+    def refresh_if_needed(self):
+        """有効期限が近いトークンを前もって更新する"""
+        expiry = getattr(self.creds, "expiry", None)
+        if not expiry or not getattr(self.creds, "refresh_token", None):
+            return
+        # google-authの有効期限はタイムゾーンなしのUTC
+        if expiry - _utcnow() > REFRESH_MARGIN:
+            return
+        with self._lock:
+            if self.creds.expiry - _utcnow() > REFRESH_MARGIN:
+                return  # 別のスレッドが更新済み
+            try:
+                self.creds.refresh(Request())
+                self._save_token()
+                logger.info("トークンをリフレッシュしました。")
+            except (RefreshError, OSError) as e:
+                # 期限切れ後はAuthorizedHttpが401を受けて更新を再試行する
+                logger.warning("トークンリフレッシュエラー: %s", e)
 
     def posts(self):
-        """Blogger API の posts() メソッドを呼び出すためのラッパー"""
-        return self.resource_object.posts()  # pylint: disable=no-member
+        """Blogger API の posts() メソッドを呼び出すためのラッパー
+        呼び出したスレッド専用の接続で作ったリソースを使う
+        """
+        self.refresh_if_needed()
+        resource = getattr(self._local, "resource", None)
+        if resource is None:
+            resource = self._local.resource = self._build(self.thread_http())
+        return resource.posts()  # pylint: disable=no-member
+
+    def new_http(self):
+        """認証付きの新しいHTTP接続を作成する
+        httplib2の接続はスレッド間で共有できないため、並行して呼び出すスレッドごとに作る
+        """
+        return google_auth_httplib2.AuthorizedHttp(self.creds, http=build_http())
+
+    def thread_http(self):
+        """呼び出したスレッド専用の認証付きHTTP接続を返す（スレッドごとに1つを使い回す）"""
+        self.refresh_if_needed()
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = self.new_http()
+        return http
+
+    def new_batch_http_request(self, callback=None):
+        """複数のAPI呼び出しを1回のHTTPリクエストにまとめるバッチを作成する"""
+        if api_endpoint:
+            # discovery文書のrootUrlではなく、指定した接続先のバッチ用URLに送る
+            return BatchHttpRequest(
+                callback=callback, batch_uri=api_endpoint.rstrip("/") + "/batch"
+            )
+        return self.resource_object.new_batch_http_request(  # pylint: disable=no-member
+            callback=callback
+        )
+
+
+class BloggerServiceFactory:
+    """discovery文書とBloggerServiceをプロセスで共有する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._document = None
+        self._service = None
+
+    def discovery_document(self):
+        """Blogger API v3のdiscovery文書を返す
+        保存したファイル（なければライブラリ同梱の文書を保存して）から1回だけ読み込む
+        """
+        with self._lock:
+            if self._document is None:
+                self._document = self._load_document()
+            return self._document
+
+    def _load_document(self):
+        try:
+            with open(discovery_file, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            pass
+        document = json.loads(get_static_doc("blogger", "v3"))
+        try:
+            Path(discovery_file).parent.mkdir(parents=True, exist_ok=True)
+            write_text_atomic(discovery_file, json.dumps(document))
+        except OSError as e:
+            logger.warning("discovery文書の保存に失敗しました: %s", e)
+        return document
+
+    def get_service(self):
+        """共有のBloggerServiceを返す（初回のみ認証する）"""
+        with self._lock:
+            service = self._service
+        if service is None:
+            # 初回の認証はブラウザを待つことがあるため、ロックの外で行う
+            service = BloggerService()
+            with self._lock:
+                if self._service is None:
+                    self._service = service
+                service = self._service
+        return service
+
+
+service_factory = BloggerServiceFactory()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""fake_blogger.py
+テスト・ベンチマーク用のBlogger API v3（記事の投稿）の代用サーバー
+upload_artの api_endpoint に http://127.0.0.1:ポート/ を設定すると、認証なしでこのサーバーに投稿する
+  posts の insert / list / get / patch / delete と、HTTPバッチ（/batch）に応答する
+  latency:    HTTPリクエストごとの応答の遅れ（秒）。回線の往復時間を再現する
+  fail_every: n件目ごとに429（Retry-After: 1）を返す（0で返さない）
+
+例:
+  python bench/fake_blogger.py 8080 --latency 0.3
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 記事のAPI（/blogger/v3/blogs/ブログID/posts[/投稿ID]）
+POSTS_PATH = re.compile(r"(?:/blogger)?/v3/blogs/(\w+)/posts(?:/(\w+))?(?:\?.*)?$")
+
+
+class FakeBlogger:
+    """別スレッドで応答する代用サーバー（投稿した記事はメモリに保持する）"""
+
+    def __init__(self, port=0, latency=0.0, fail_every=0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.posts = {}
+        # http: HTTPリクエスト数 / calls: API呼び出し数（バッチ内の1件ずつ）
+        self.counts = {"http": 0, "calls": 0, "inserts": 0, "lists": 0, "patches": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """upload_artのapi_endpointに設定するURL"""
+        return f"http://127.0.0.1:{self._server.server_port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        """リクエスト数と投稿された記事の数"""
+        with self._lock:
+            return dict(self.counts, posts=len(self.posts))
+
+    def call(self, method, path, body):
+        """1件のAPI呼び出しに応答する。戻り値: (ステータス, ヘッダー, JSON)"""
+        with self._lock:
+            self.counts["calls"] += 1
+            if self.fail_every and self.counts["calls"] % self.fail_every == 0:
+                return 429, {"Retry-After": "1"}, _error(429, "rate limit")
+        match = POSTS_PATH.match(path)
+        if not match:
+            return 404, {}, _error(404, path)
+        post_id = match.group(2)
+        if method == "POST" and not post_id:
+            post = json.loads(body or "{}")
+            with self._lock:
+                self.counts["inserts"] += 1
+                post_id = str(1000 + len(self.posts))
+                post.update(
+                    id=post_id,
+                    status="DRAFT",
+                    updated=time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime()),
+                )
+                self.posts[post_id] = post
+            return 200, {}, post
+        if method == "GET" and not post_id:
+            with self._lock:
+                self.counts["lists"] += 1
+                items = list(self.posts.values())
+            return 200, {}, {"kind": "blogger#postList", "items": items}
+        with self._lock:
+            post = self.posts.get(post_id)
+            if post is None:
+                return 404, {}, _error(404, "not found")
+            if method in ("PATCH", "PUT"):
+                self.counts["patches"] += 1
+                post.update(json.loads(body or "{}"))
+            elif method == "DELETE":
+                del self.posts[post_id]
+                return 204, {}, None
+            return 200, {}, post
+
+
+def _error(code, message):
+    return {"error": {"code": code, "message": message}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _respond(self):
+        fake = self.server.fake
+        time.sleep(fake.latency)
+        with fake._lock:
+            fake.counts["http"] += 1
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.startswith("/batch"):
+            content_type, payload = self._batch(fake, raw)
+            self._send(200, {}, content_type, payload)
+            return
+        code, headers, data = fake.call(self.command, self.path, raw.decode("utf-8"))
+        payload = json.dumps(data).encode("utf-8") if data is not None else b""
+        self._send(code, headers, "application/json", payload)
+
+    def _batch(self, fake, raw):
+        """multipart/mixedのバッチの各API呼び出しに応答する"""
+        message = BytesParser().parsebytes(
+            b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + raw
+        )
+        boundary = "response" + uuid.uuid4().hex
+        parts = []
+        for part in message.get_payload():
+            content_id = part["Content-ID"].strip("<>")
+            inner = part.get_payload()
+            separator = "\r\n\r\n" if "\r\n\r\n" in inner else "\n\n"
+            head, _, body = inner.partition(separator)
+            method, path, _ = head.splitlines()[0].split(" ", 2)
+            code, headers, data = fake.call(method, path, body)
+            extra = "".join(f"{key}: {value}\r\n" for key, value in headers.items())
+            text = json.dumps(data) if data is not None else ""
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {code} X\r\nContent-Type: application/json\r\n{extra}\r\n"
+                f"{text}\r\n"
+            )
+        payload = ("".join(parts) + f"--{boundary}--\r\n").encode("utf-8")
+        return f"multipart/mixed; boundary={boundary}", payload
+
+    def _send(self, code, headers, content_type, payload):
+        self.send_response(code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _respond
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Blogger APIの代用サーバー")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--latency", type=float, default=0.0, help="応答の遅れ（秒）")
+    parser.add_argument(
+        "--fail-every", type=int, default=0, help="n件目ごとに429を返す"
+    )
+    args = parser.parse_args(argv)
+    fake = FakeBlogger(args.port, args.latency, args.fail_every).start()
+    print(f"{fake.url} で待ち受けています（Ctrl+Cで終了）")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""import_time.py
+起動時の読み込み時間を測るベンチマーク（python -X importtime）
+main_processは各処理のモジュールを最初に使うときに読み込む（LazyModule）ため、
+起動時にBeautifulSoup・Pillow・geopy・janome・Google APIのライブラリが読み込まれていないことも確認する
+
+例:
+  python bench/import_time.py                 # 既定のモジュールを測る
+  python bench/import_time.py --top 20 main_process
+  python bench/import_time.py --dir /path/to/作業フォルダ   # data/ のあるフォルダで実行する
+戻り値: 予算（ミリ秒）を超えたか、起動時に読み込まないはずのモジュールがあれば1
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+# リポジトリのフォルダ（モジュールの読み込み元）
+ROOT = Path(__file__).resolve().parent.parent
+
+# 測るモジュールと読み込み時間の予算（ミリ秒）
+BUDGETS = {
+    "main_process": 250,
+    "html_tobrogger_cli": 300,
+}
+
+# 起動時に読み込まない（その処理を実行するときに読み込む）モジュール
+DEFERRED = (
+    "PIL",
+    "upload_image",
+    "image_index",
+    "bs4",
+    "lxml",
+    "geopy",
+    "janome",
+    "googleapiclient.discovery",
+    "google_auth_oauthlib",
+    "google_auth_httplib2",
+)
+
+
+def measure(module, work_dir):
+    """moduleを新しいプロセスで読み込み、{モジュール名: (自身の時間, 累積時間)} をマイクロ秒で返す"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        path for path in (str(ROOT), env.get("PYTHONPATH")) if path
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=work_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: 自身 | 累積 | モジュール名（字下げは読み込みの深さ）
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:") :].split("|")
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+        except ValueError:
+            continue  # 見出しの行
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="起動時の読み込み時間を測る")
+    parser.add_argument(
+        "modules", nargs="*", default=list(BUDGETS), help="測るモジュール"
+    )
+    parser.add_argument(
+        "--dir",
+        default=str(ROOT),
+        help="実行するフォルダ（data/log_config.json5 と data/log/ が必要）",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="測る回数（最速を使う）")
+    parser.add_argument(
+        "--top", type=int, default=10, help="表示する時間のかかるモジュールの数"
+    )
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in args.modules:
+        try:
+            runs = [measure(module, args.dir) for _ in range(max(1, args.repeat))]
+        except RuntimeError as e:
+            print(f"{module}: 読み込みに失敗しました: {e}")
+            failed = True
+            continue
+        times = min(runs, key=lambda each: each[module][1])
+        total_ms = times[module][1] / 1000
+        budget = BUDGETS.get(module)
+        over = budget is not None and total_ms > budget
+        print(
+            f"{module}: {total_ms:.1f} ms"
+            + (f" (予算 {budget} ms{' 超過' if over else ''})" if budget else "")
+        )
+        for name, (self_us, cumulative_us) in sorted(
+            times.items(), key=lambda item: item[1][0], reverse=True
+        )[: args.top]:
+            print(f"  {self_us / 1000:8.1f} ms {cumulative_us / 1000:8.1f} ms  {name}")
+        loaded = [name for name in DEFERRED if name in times]
+        if loaded:
+            print(f"  起動時に読み込まれています: {', '.join(loaded)}")
+        failed = failed or over or bool(loaded)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""upload_engines.py
+upload_art の投稿方式（sequential / batch / async）を代用サーバー（fake_blogger）に対して実行する
+作業フォルダ（workspace）に記事を作り、別のプロセスで upload_art.run を実行して
+投稿された記事の数・履歴に移動した記事の数・時間を返す
+投稿間隔の設定（delay_seconds）は小さくし、通信の往復時間の差だけを比べる
+
+例:
+  python bench/upload_engines.py --posts 20 --latency 0.3
+"""
+import argparse
+import sys
+
+from fake_blogger import FakeBlogger
+from workspace import RESULT_PREFIX, make_workspace, remove_workspace, run_in_workspace
+
+ENGINES = ("sequential", "batch", "async")
+
+# 作業フォルダで upload_art.run を実行するコード
+DRIVER = f"""
+import json, os, queue, time
+import upload_art
+start = time.perf_counter()
+result = upload_art.run(queue.Queue())
+seconds = time.perf_counter() - start
+history_dir = upload_art.history_dir
+history = [
+    name for name in os.listdir(history_dir) if name.endswith(".html")
+] if os.path.isdir(history_dir) else []
+print({RESULT_PREFIX!r} + json.dumps(
+    {{"ok": result is not False, "seconds": seconds, "history": len(history)}}
+))
+"""
+
+ARTICLE = (
+    "<html><head><title>記事{i}</title><search>旅</search>"
+    '<time datetime="2024-01-0{day}"></time><location_name>函館</location_name>'
+    "<latitude>41.7</latitude><longitude>140.7</longitude></head>"
+    "<body><p>本文 {i}</p></body></html>"
+)
+
+
+def run_upload(engine, posts=8, latency=0.0, fail_every=0, concurrency=4):
+    """投稿方式engineでposts件の記事を代用サーバーに投稿する
+    戻り値: {ok, seconds, history, http, calls, inserts, posts, ...}
+    """
+    fake = FakeBlogger(latency=latency, fail_every=fail_every).start()
+    work_dir = make_workspace(
+        {
+            "common": {"test_mode": "false"},
+            "auth_google": {"api_endpoint": fake.url},
+            "upload_art": {
+                "engine": engine,
+                "concurrency": concurrency,
+                "delay_seconds": 0.05,
+                "min_delay_seconds": 0.01,
+            },
+        }
+    )
+    try:
+        input_dir = work_dir / "data" / "work"
+        input_dir.mkdir(parents=True)
+        for i in range(posts):
+            (input_dir / f"{i:03d}art.html").write_text(
+                ARTICLE.format(i=i, day=1 + i % 9), encoding="utf-8"
+            )
+        result = run_in_workspace(work_dir, DRIVER)
+        result.update(fake.stats(), engine=engine)
+        return result
+    finally:
+        fake.stop()
+        remove_workspace(work_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="投稿方式ごとの投稿時間の計測")
+    parser.add_argument("--posts", type=int, default=20, help="投稿する記事数")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.3,
+        help="HTTPリクエストごとの応答の遅れ（秒）",
+    )
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    args = parser.parse_args(argv)
+
+    results = [run_upload(engine, args.posts, args.latency) for engine in args.engines]
+    base = next((r["seconds"] for r in results if r["engine"] == "sequential"), None)
+    print(f"{'engine':<12}{'seconds':>9}{'http':>6}{'inserts':>9}{'speedup':>9}")
+    mismatch = False
+    for result in results:
+        speedup = f"{base / result['seconds']:.2f}x" if base else "-"
+        print(
+            f"{result['engine']:<12}{result['seconds']:>9.2f}{result['http']:>6}"
+            f"{result['inserts']:>9}{speedup:>9}"
+        )
+        if not result["ok"] or result["posts"] != args.posts:
+            mismatch = True
+    if mismatch:
+        print("投稿された記事の数が一致しません", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
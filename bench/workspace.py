@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""workspace.py
+テスト・ベンチマーク用の作業フォルダ
+設定（parameter）はモジュールと同じフォルダの data/config.json5 を読むため、
+モジュールと data/ の設定ファイルを一時フォルダに写して設定を書き換え、別のプロセスで実行する
+"""
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import json5
+
+# リポジトリのフォルダ（モジュールの読み込み元）
+ROOT = Path(__file__).resolve().parent.parent
+# 実行結果の行の目印
+RESULT_PREFIX = "RESULT "
+
+
+def make_workspace(overrides=None):
+    """モジュールとdata/ の設定ファイルを写した作業フォルダを作る
+    overrides: {セクション: {キー: 値}} config.json5に上書きする設定
+    """
+    work_dir = Path(tempfile.mkdtemp(prefix="html_blogger_"))
+    for path in ROOT.glob("*.py"):
+        shutil.copy2(path, work_dir / path.name)
+    data_dir = work_dir / "data"
+    (data_dir / "log").mkdir(parents=True)
+    for path in (ROOT / "data").iterdir():
+        # 実行時に作られるファイル（設定のキャッシュ・台帳等）は写さない
+        if path.is_file() and path.suffix in (".json5", ".xml"):
+            shutil.copy2(path, data_dir / path.name)
+    with open(data_dir / "config.json5", "r", encoding="utf-8") as file:
+        config = json5.load(file)
+    for section, values in (overrides or {}).items():
+        config.setdefault(section, {}).update(values)
+    (data_dir / "config.json5").write_text(
+        json.dumps(config, ensure_ascii=False, indent=1), encoding="utf-8"
+    )
+    return work_dir
+
+
+def run_in_workspace(work_dir, code, timeout=300):
+    """作業フォルダでPythonのコードを実行し、RESULT_PREFIXの行のJSONを返す"""
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=work_dir,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+        check=False,
+    )
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX) :])
+    raise RuntimeError(
+        f"結果がありません (終了コード {result.returncode}):\n{result.stderr[-2000:]}"
+    )
+
+
+def remove_workspace(work_dir):
+    shutil.rmtree(work_dir, ignore_errors=True)
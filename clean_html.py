@@ -5,12 +5,26 @@ HTMLファイルをブログ用にクリーンアップするモジュール
 import logging
 import queue
 import re
+from collections import deque
+from html import escape
 from pathlib import Path
 
-from bs4 import BeautifulSoup, Comment
+import json5
+from bs4 import BeautifulSoup, Comment, Doctype, NavigableString, Tag
+from bs4.builder import HTMLTreeBuilder
+from bs4.dammit import EntitySubstitution
+from bs4.formatter import HTMLFormatter
 
-from file_class import SmartFile
-from parameter import config
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:  # lxmlは任意。未インストールの場合はhtml.parserで処理する
+    etree = lxml_html = None
+
+from dir_index import get_index
+from file_class import FileKind
+from parameter import config, to_bool
+from stage_journal import StageJournal, stage_control
 
 logger = logging.getLogger(__name__)
 # --- 設定 ---
@@ -18,8 +32,248 @@ logger = logging.getLogger(__name__)
 input_dir = config["clean_html"]["input_dir"].lstrip("./")
 # 出力先フォルダ
 output_dir = config["clean_html"]["output_dir"].lstrip("./")
+# 解析エンジン (html.parser / lxml)
+engine = config["clean_html"].get("engine", "html.parser")
+
+# クリーンアップルールファイル
+rules_file = config["clean_html"].get("rules_file", "./data/clean_rules.json5")
+
+# ルールファイルがない場合の既定のルール
+DEFAULT_RULES = {
+    # 中身ごと削除するタグ
+    "remove_tags": ["script", "style", "meta"],
+    # タグのみ削除して中身を残すフォーマットタグ
+    "unwrap_tags": [
+        "font",
+        "span",
+        "strong",
+        "b",
+        "em",
+        "i",
+        "u",
+        "strike",
+        "s",
+        "center",
+    ],
+    # すべてのタグから削除する属性
+    "remove_attrs": [
+        "bgcolor",
+        "style",
+        "class",
+        "id",
+        "width",
+        "height",
+        "border",
+        "align",
+        "valign",
+        "cellspacing",
+        "cellpadding",
+        "lang",
+        "http-equiv",
+        "content",
+        "font-family",
+        "font-color",
+        "color",
+    ],
+    # 残す属性を限定するタグ
+    "keep_attrs": {"img": ["src", "alt", "width", "height"]},
+    # 属性をすべて削除するタグ
+    "clear_attrs": ["body", "head"],
+    "remove_comments": "true",
+    # 画像ラップ（Bloggerでの表示互換性のため、figureではなくdivを使用する）
+    "image_wrap": {
+        "enabled": "true",
+        "wrapper_style": "text-align:center; margin-bottom:1em;",
+        "caption_style": "font-size:small; color:#666;",
+        "default_caption": "Image",
+    },
+}
+
 
-html_extensions = config["common"]["html_extensions"]
+class TagAction:
+    """1つのタグに対する処理内容（ルールをコンパイルした結果）"""
+
+    __slots__ = ("remove", "unwrap", "keep_attrs", "drop_attrs", "wrap")
+
+    def __init__(
+        self,
+        remove=False,
+        unwrap=False,
+        keep_attrs=None,
+        drop_attrs=frozenset(),
+        wrap=False,
+    ):
+        self.remove = remove
+        self.unwrap = unwrap
+        self.keep_attrs = keep_attrs  # Noneでなければこれ以外の属性を削除
+        self.drop_attrs = drop_attrs
+        self.wrap = wrap
+
+    def attrs_to_remove(self, attrs):
+        """削除する属性名のリストを返す"""
+        if self.keep_attrs is not None:
+            return [attr for attr in attrs if attr not in self.keep_attrs]
+        return [attr for attr in attrs if attr in self.drop_attrs]
+
+
+class CleanRules:
+    """ルールをタグ名→処理内容のディスパッチテーブルにコンパイルしたもの
+    ルールを増やしても文書の走査は1回のまま
+    """
+
+    def __init__(self, rules):
+        remove_tags = set(rules.get("remove_tags", []))
+        unwrap_tags = set(rules.get("unwrap_tags", []))
+        keep_attrs = rules.get("keep_attrs", {})
+        clear_attrs = set(rules.get("clear_attrs", []))
+        drop_attrs = frozenset(rules.get("remove_attrs", []))
+        image_wrap = rules.get("image_wrap", {})
+
+        self.remove_comments = to_bool(rules.get("remove_comments", "true"))
+        self.wrap_images = to_bool(image_wrap.get("enabled", "true"))
+        self.wrapper_style = image_wrap.get("wrapper_style", "")
+        self.caption_style = image_wrap.get("caption_style", "")
+        self.default_caption = image_wrap.get("default_caption", "Image")
+
+        # 表にないタグは共通の属性削除のみ
+        self.default_action = TagAction(drop_attrs=drop_attrs)
+        self.actions = {}
+        tags = remove_tags | unwrap_tags | set(keep_attrs) | clear_attrs
+        if self.wrap_images:
+            tags.add("img")
+        for tag in tags:
+            if tag in remove_tags:
+                self.actions[tag] = TagAction(remove=True)
+                continue
+            if tag in clear_attrs:
+                keep = frozenset()
+            elif tag in keep_attrs:
+                keep = frozenset(keep_attrs[tag])
+            else:
+                keep = None
+            unwrap = tag in unwrap_tags
+            self.actions[tag] = TagAction(
+                unwrap=unwrap,
+                keep_attrs=keep,
+                drop_attrs=drop_attrs,
+                wrap=tag == "img" and self.wrap_images and not unwrap,
+            )
+
+    def action(self, tag):
+        """タグ名に対応する処理内容を返す"""
+        return self.actions.get(tag, self.default_action)
+
+
+def _merge_rules(base, site):
+    """サイト別ルールを既定のルールに追加する（リストは追加、辞書は上書き）"""
+    merged = dict(base)
+    for key, value in site.items():
+        if key == "match":
+            continue
+        if isinstance(value, list):
+            merged[key] = list(base.get(key, [])) + [
+                item for item in value if item not in base.get(key, [])
+            ]
+        elif isinstance(value, dict):
+            merged[key] = {**base.get(key, {}), **value}
+        else:
+            merged[key] = value
+    return merged
+
+
+class CleanRuleManager:
+    """ルールファイルを読み込み、コンパイル済みのルールを保持するクラス"""
+
+    def __init__(self):
+        self.default_rules = CleanRules(DEFAULT_RULES)
+        self.site_rules = []  # [(正規表現, CleanRules)]
+        self.loaded_mtime = None
+
+    def load_rules(self):
+        """ルールファイルを読み込む。前回から変更がなければコンパイルし直さない"""
+        path = Path(rules_file)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            logger.warning(
+                "%s が見つかりません。既定のルールで処理します。", rules_file
+            )
+            self.default_rules = CleanRules(DEFAULT_RULES)
+            self.site_rules = []
+            self.loaded_mtime = None
+            return False
+        if mtime == self.loaded_mtime:
+            return True
+
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json5.load(file)
+            default = data.get("default", DEFAULT_RULES)
+            default_rules = CleanRules(default)
+            site_rules = [
+                (re.compile(site["match"]), CleanRules(_merge_rules(default, site)))
+                for site in data.get("sites", [])
+            ]
+        except (
+            OSError,
+            ValueError,
+            KeyError,
+            TypeError,
+            AttributeError,
+            re.error,
+        ) as e:
+            logger.error(
+                "ルールファイル読み込みエラー（前回のルールで処理します）: %s",
+                e,
+                exc_info=True,
+            )
+            return False
+
+        self.default_rules = default_rules
+        self.site_rules = site_rules
+        self.loaded_mtime = mtime
+        logger.info(
+            "クリーンアップルール読み込み: %s (サイト別 %d件)",
+            rules_file,
+            len(site_rules),
+        )
+        return True
+
+    def select(self, html_text):
+        """文書に適用するルールを選ぶ（最初に一致したサイト別ルール、なければ既定）"""
+        for pattern, rules in self.site_rules:
+            if pattern.search(html_text):
+                return rules
+        return self.default_rules
+
+
+rule_manager = CleanRuleManager()
+
+# 空白・改行をそのまま残すタグ
+PRESERVE_TAGS = HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS
+PRESERVE_BLOCK = re.compile(
+    r"<(pre|textarea)[\s>].*?</\1\s*>", re.IGNORECASE | re.DOTALL
+)
+NEWLINES = re.compile(r"[\r\n\t]+")
+WHITESPACE = re.compile(r"\s+")
+DOCTYPE = re.compile(r"<!DOCTYPE[^>]*>", re.IGNORECASE)
+# 元の文書の開始タグと属性（lxmlで値なしの属性を判別するため）
+SOURCE_IGNORED = re.compile(
+    r"<!--.*?-->|(<(script|style)\b[^>]*>).*?</\2\s*>", re.IGNORECASE | re.DOTALL
+)
+START_TAG = re.compile(
+    r"""<([a-zA-Z][^\s/>]*)((?:\s*[^\s/>"'=]+"""
+    r"""(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'>]+))?)*)\s*/?>"""
+)
+SOURCE_ATTR = re.compile(r"""([^\s/>"'=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?""")
+# 出力の後ろで改行するタグ（ソースを見やすくするため）
+NEWLINE_AFTER_TAGS = {"br", "td", "tr", "table", "h1", "h2", "h3", "li"}
+# 出力時にタグを書かず中身だけ残すタグ（ルールで残っていても念のため）
+SKIP_TAGS = {"font"}
+# 空要素のタグ（html.parserと同じ）
+VOID_TAGS = HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS
+# 中身をエスケープしないタグ
+CDATA_TAGS = {"script", "style"}
 
 # 画像基底サイズ
 IMAGE_BASIC_SIZE = {
@@ -62,28 +316,30 @@ def resize_logic(w, h):
 def run(queue_obj):
     """HTMLクリーンアップのメイン処理"""
     logger.info("HTMLクリーンアップ開始: %s -> %s", input_dir, output_dir)
-    all_files = list(Path(input_dir).rglob("*"))
+    if engine == "lxml" and lxml_html is None:
+        logger.warning("lxmlが見つからないため html.parser で処理します")
+    # 読み込めない場合は既定（または前回読み込んだ）ルールで続行する
+    rule_manager.load_rules()
+    work_index = get_index(input_dir)
+    html_files = work_index.files(FileKind.HTML)
+    journal = StageJournal("clean_html")
     count = 0
 
-    for path in all_files:
-        src_file = SmartFile(path)
-        if src_file.is_file():
-            if src_file.suffix.lower() in html_extensions:
-                src_file.status = "⏳"
-                src_file.extensions = "html"
-                src_file.disp_path = src_file.name
-                queue_obj.put(src_file)
-
-    for path in all_files:
-        src_file = SmartFile(path)
-        if src_file.is_file():
-            if src_file.suffix.lower() in html_extensions:
-                src_file = clean_html_for_blogger(src_file)
-                src_file.status = "✔"
-                src_file.extensions = "html"
-                src_file.disp_path = src_file.name
-                queue_obj.put(src_file)
-                count += 1
+    for src_file in html_files:
+        src_file.status = "⏳"
+        src_file.disp_path = src_file.name
+        queue_obj.put(src_file)
+
+    for src_file in html_files:
+        stage_control.checkpoint()
+        if not journal.is_committed(src_file):
+            src_file = clean_html_for_blogger(src_file)
+            journal.commit(src_file)
+            work_index.update(src_file)
+        src_file.status = "✔"
+        queue_obj.put(src_file)
+        count += 1
+    journal.finish()
     logger.info("HTMLクリーンアップ完了: %d件", count)
 
 
@@ -98,208 +354,467 @@ def clean_html_for_blogger(files):
         except UnicodeDecodeError:
             continue
 
-    # 1. 改行とタブを一旦削除（後で<br>に基づいて再整理するため）
-    html_text = re.sub(r"[\r\n\t]+", "", html_text)
+    # 取り込み元サイトに合ったルールを選ぶ
+    rules = rule_manager.select(html_text)
+
+    # 1. 改行とタブを一旦削除（後で<br>に基づいて再整理するため、pre/textareaの中は残す）
+    html_text = _strip_newlines(html_text)
+
+    # 2.～8. タイトル抽出、不要なタグ・属性の削除、画像のラップ
+    # 9.～11. 空白・改行を整えながら書き出し、<head>と<body>がない場合は補う
+    extracted_title = None
+    if engine == "lxml" and lxml_html is not None:
+        try:
+            extracted_title, root = _clean_with_lxml(html_text, rules)
+            html_text = _serialize_lxml(root, html_text, extracted_title)
+        except (etree.ParserError, ValueError) as e:
+            # 空文書などlxmlで解析できない場合は従来の処理に任せる
+            logger.warning("lxmlで解析できません: %s - %s", files.name, e)
+    if extracted_title is None:
+        extracted_title, soup = _clean_with_bs4(html_text, rules)
+        html_text = _serialize_bs4(soup, extracted_title)
+
+    if not extracted_title:
+        logger.warning("タイトルが見つかりません: %s", files.name)
+
+    files.write_text_atomic(html_text, encoding="utf-8")
+    logger.info("クリーンアップ完了: %s", files.name)
+    return files
+
+
+def _image_size(width, height, src):
+    """width/height属性をリサイズ後の値に変換する。数値にできない場合はNone"""
+    try:
+        return resize_logic(int(width), int(height))
+    except ValueError:
+        # リカバリ: 属性がつながっている場合 (例: 452src="...") 数字部分のみ抽出
+        w_match = re.match(r"^(\d+)", str(width))
+        h_match = re.match(r"^(\d+)", str(height))
+        if w_match and h_match:
+            return resize_logic(int(w_match.group(1)), int(h_match.group(1)))
+        logger.warning(
+            "画像サイズが数値でないためリサイズをスキップ: src=%s, w=%s, h=%s",
+            src,
+            width,
+            height,
+        )
+        return None
+
+
+def _clean_with_bs4(html_text, rules):
+    """html.parserで1回の走査により不要なタグと属性を削除し、(タイトル, soup)を返す"""
+    soup = BeautifulSoup(html_text, "html.parser")
 
     # 2. タイトルの抽出（安全な判定）
     # 正規表現ではなくBeautifulSoupを使ってテキストを抽出する（タグのネストに対応するため）
-    temp_soup = BeautifulSoup(html_text, "html.parser")
     extracted_title = ""
-
-    if temp_soup.title and temp_soup.title.get_text(strip=True):
-        extracted_title = temp_soup.title.get_text(strip=True)
+    if soup.title and soup.title.get_text(strip=True):
+        extracted_title = soup.title.get_text(strip=True)
     else:
         # 見出しを探す (h1 -> h6)
         for i in range(1, 7):
-            h_tag = temp_soup.find(f"h{i}")
+            h_tag = soup.find(f"h{i}")
             if h_tag:
                 extracted_title = h_tag.get_text(strip=True)
                 break
 
+    # 3.～8. ディスパッチテーブルに従い、文書順（親が先）に1回だけたどる
+    # 画像を処理する時点で親のunwrapは済んでいる
+    for node in list(soup.descendants):
+        if node.decomposed:
+            continue  # 削除済みの要素の子孫
+        if isinstance(node, Comment):
+            if rules.remove_comments:
+                node.extract()
+            continue
+        if not isinstance(node, Tag):
+            continue
+        action = rules.action(node.name)
+        if action.remove:
+            node.decompose()
+            continue
+        for attr in action.attrs_to_remove(node.attrs):
+            del node[attr]
+        if action.wrap:
+            _wrap_image_bs4(soup, node, rules)
+        if action.unwrap:
+            node.unwrap()
+
+    return extracted_title, soup
+
+
+def _wrap_image_bs4(soup, img, rules):
+    """imgをキャプション付きのdivでラップする（html.parser用）"""
+    if img.parent and img.parent.name == "div":
+        return  # すでにdivでラップされている場合はスキップ
+    div_wrapper = soup.new_tag("div", style=rules.wrapper_style)
+    # alt取得
+    alt_text = img.get("alt")
+    alt_text = alt_text.strip() if alt_text is not None else rules.default_caption
+    # caption作成
+    caption = soup.new_tag("div", style=rules.caption_style)
+    caption.string = alt_text
+    # 画像サイズ属性の整理
+    width = img.get("width")
+    height = img.get("height")
+    if width is not None and height is not None:
+        # 縦横がある場合調整
+        size = _image_size(width, height, img.get("src"))
+        if size:
+            img["width"], img["height"] = size
+    # imgをdivでラップし、captionを追加
+    img.wrap(div_wrapper)
+    div_wrapper.append(caption)
+
+
+def _strip_text(element):
+    """BeautifulSoupのget_text(strip=True)相当のテキストを返す"""
+    return "".join(text.strip() for text in element.itertext())
+
+
+def _strip_title_text(element):
+    """titleのテキストを返す。lxmlはtitle内のタグを文字列のまま残すため、
+    html.parserと同じくタグ部分で区切ってから連結する"""
+    return "".join(
+        part.strip()
+        for text in element.itertext()
+        for part in re.split(r"<[^>]*>", text)
+    )
+
+
+def _clean_with_lxml(html_text, rules):
+    """lxmlで1回の走査により不要なタグと属性を削除し、(タイトル, ルート要素)を返す"""
+    root = lxml_html.document_fromstring(html_text)
+    _restore_valueless_attrs(root, html_text)
+
+    # タイトルの抽出（titleがなければ最初の見出し）
+    extracted_title = ""
+    title_tag = root.find(".//title")
+    if title_tag is not None:
+        extracted_title = _strip_title_text(title_tag)
     if not extracted_title:
-        logger.warning("タイトルが見つかりません: %s", files.name)
+        for i in range(1, 7):
+            h_tag = root.find(f".//h{i}")
+            if h_tag is not None:
+                extracted_title = _strip_text(h_tag)
+                break
 
-    # 3. BeautifulSoupを使って不要なタグと属性を削除
-    soup = BeautifulSoup(html_text, "html.parser")
-    # 4. 不要なタグを完全に削除（タグとその中身）
-    # <script>, <style>, <meta>, は削除する
-    for tag in soup.find_all(["script", "style", "meta"]):
-        tag.decompose()
-    # 5. コメントを削除
-    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-        comment.extract()
-
-    # 6. フォーマットタグを削除（タグのみ削除、中身は保持）
-    unwrap_tags = [
-        "font",
-        "span",
-        "strong",
-        "b",
-        "em",
-        "i",
-        "u",
-        "strike",
-        "s",
-        "center",
-    ]
-    for tag_name in unwrap_tags:
-        for tag in soup.find_all(tag_name):
-            tag.unwrap()
+    # ディスパッチテーブルに従い、文書順（親が先）に1回だけたどる
+    # 画像を処理する時点で親のunwrapは済んでいる
+    for element in list(root.iter()):
+        if not isinstance(element.tag, str):
+            # コメント・処理命令
+            if rules.remove_comments:
+                element.drop_tree()
+            continue
+        action = rules.action(element.tag)
+        if action.remove:
+            element.drop_tree()
+            continue
+        for attr in action.attrs_to_remove(element.attrib):
+            del element.attrib[attr]
+        if action.wrap:
+            _wrap_image_lxml(element, rules)
+        if action.unwrap:
+            element.drop_tag()
 
-    # 7. すべてのタグから不要な属性を削除
-    unuse_attrs = [
-        "bgcolor",
-        "style",
-        "class",
-        "id",
-        "width",
-        "height",
-        "border",
-        "align",
-        "valign",
-        "cellspacing",
-        "cellpadding",
-        "lang",
-        "http-equiv",
-        "content",
-        "font-family",
-        "font-color",
-        "color",
+    return extracted_title, root
+
+
+def _restore_valueless_attrs(root, html_text):
+    """値なしで書かれていた属性を、html.parser（bs4）と同じく空の値にする
+    libxml2は<input disabled>をdisabled="disabled"として解析するため、
+    値=名前の属性を元の文書の開始タグと文書順に照らし合わせ、値がなかったものを戻す
+    """
+    targets = [
+        (element, key)
+        for element in root.iter()
+        if isinstance(element.tag, str)
+        for key, value in element.attrib.items()
+        if value == key
     ]
+    if not targets:
+        return
+    # {(タグ名, 属性名): 値なしだったか（文書順）}
+    forms = {}
+    source = SOURCE_IGNORED.sub(lambda match: match.group(1) or "", html_text)
+    for tag in START_TAG.finditer(source):
+        name = tag.group(1).lower()
+        for attr in SOURCE_ATTR.finditer(tag.group(2)):
+            key = attr.group(1).lower()
+            value = attr.group(2)
+            if value is None or value.strip("\"'") == key:
+                forms.setdefault((name, key), deque()).append(value is None)
+    for element, key in targets:
+        written = forms.get((element.tag, key))
+        if written and written.popleft():
+            element.set(key, "")
+
+
+def _wrap_image_lxml(img, rules):
+    """imgをキャプション付きのdivでラップする（lxml用）"""
+    parent = img.getparent()
+    if parent is not None and parent.tag == "div":
+        return  # すでにdivでラップされている場合はスキップ
+    alt_text = img.get("alt")
+    alt_text = alt_text.strip() if alt_text is not None else rules.default_caption
+    width = img.get("width")
+    height = img.get("height")
+    if width is not None and height is not None:
+        size = _image_size(width, height, img.get("src"))
+        if size:
+            img.set("width", str(size[0]))
+            img.set("height", str(size[1]))
+    div_wrapper = etree.Element("div", style=rules.wrapper_style)
+    # imgの後ろのテキストはラッパーの後ろに付け替える
+    div_wrapper.tail, img.tail = img.tail, None
+    img.addprevious(div_wrapper)
+    div_wrapper.append(img)
+    caption = etree.SubElement(div_wrapper, "div", style=rules.caption_style)
+    caption.text = alt_text
+
+
+def _strip_newlines(html_text):
+    """改行とタブを削除する。pre/textareaの中は改行コードのみそろえて残す"""
+    parts = []
+    pos = 0
+    for match in PRESERVE_BLOCK.finditer(html_text):
+        parts.append(NEWLINES.sub("", html_text[pos : match.start()]))
+        parts.append(match.group(0).replace("\r\n", "\n").replace("\r", "\n"))
+        pos = match.end()
+    parts.append(NEWLINES.sub("", html_text[pos:]))
+    return "".join(parts)
+
+
+def _format_attrs(attrs):
+    """属性をhtml.parser（bs4）の出力と同じ書式にする（名前順、最小限のエスケープ）"""
+    result = []
+    for key, value in sorted(attrs):
+        if value is None:
+            result.append(key)
+            continue
+        if isinstance(value, (list, tuple)):
+            value = " ".join(value)
+        value = EntitySubstitution.substitute_xml(str(value))
+        result.append(f"{key}={EntitySubstitution.quoted_attribute_value(value)}")
+    return "".join(" " + attr for attr in result)
 
-    for tag in soup.find_all(True):  # すべてのタグ
-        # imgタグはsrc, alt, width, heightのみ保持
-        if tag.name == "img":
-            attrs_to_remove = [
-                attr
-                for attr in tag.attrs
-                if attr not in ["src", "alt", "width", "height"]
-            ]
-        else:
-            attrs_to_remove = [attr for attr in tag.attrs if attr in unuse_attrs]
-
-        for attr in attrs_to_remove:
-            del tag[attr]
-
-    # 画像処理 (figure/figcaptionの追加)
-    # Bloggerでの表示互換性のため、figureではなくdivを使用する
-    for img in soup.find_all("img"):
-        if img.parent and img.parent.name == "div":
-            continue  # すでにdivでラップされている場合はスキップ
-        div_wrapper = soup.new_tag("div", style="text-align:center; margin-bottom:1em;")
-        # alt取得
-        alt_text = img.get("alt")
-        alt_text = alt_text.strip() if alt_text is not None else "Image"
-        # caption作成
-        caption = soup.new_tag("div", style="font-size:small; color:#666;")
-        caption.string = alt_text
-        # 画像サイズ属性の整理
-        width = img.get("width")
-        height = img.get("height")
-        if width is not None and height is not None:
-            # 縦横がある場合調整
-            try:
-                img["width"], img["height"] = resize_logic(int(width), int(height))
-            except ValueError:
-                # リカバリ: 属性がつながっている場合 (例: 452src="...") 数字部分のみ抽出
-                w_match = re.match(r"^(\d+)", str(width))
-                h_match = re.match(r"^(\d+)", str(height))
-                if w_match and h_match:
-                    img["width"], img["height"] = resize_logic(
-                        int(w_match.group(1)), int(h_match.group(1))
-                    )
-                else:
-                    logger.warning(
-                        "画像サイズが数値でないためリサイズをスキップ: src=%s, w=%s, h=%s",
-                        img.get("src"),
-                        width,
-                        height,
-                    )
-        # imgをdivでラップし、captionを追加
-        img.wrap(div_wrapper)
-        div_wrapper.append(caption)
-
-    # <body>と<head>の属性を削除（タグは保持）
-    for tag_name in ["body", "head"]:
-        tag = soup.find(tag_name)
-        if tag:
-            tag.attrs = {}
-
-    # HTML文字列に戻す（全体を保持）
-    html_text = str(soup)
-
-    # 念のため、残っているfontタグを正規表現でも削除
-    html_text = re.sub(r"<font[^>]*>", "", html_text, flags=re.IGNORECASE)
-    html_text = re.sub(r"</font>", "", html_text, flags=re.IGNORECASE)
-
-    # 6. 改行整理
-    # html_text = re.sub(r'[\r\n\t]+', '\n', html_text) # 連続改行をスペース1つに
-    html_text = re.sub(r"\s+", " ", html_text).strip()
-    # html_text = re.sub(r'<br.?*>', '<br />\n', html_text, flags=re.IGNORECASE)
-    html_text = re.sub(
-        r"(<br/>|</br>|<br>|<br\s*/>)", "<br/>\n", html_text, flags=re.IGNORECASE
-    )
 
-    # 7. テーブルやリストなどの構造タグの後にも改行を入れるとソースが見やすくなります
-    html_text = re.sub(
-        r"(</td>|</tr>|</table>|</h1>|</h2>|</h3>|</li>)",
-        r"\1\n",
-        html_text,
-        flags=re.IGNORECASE,
-    )
+class HtmlWriter:
+    """空白と改行を整えながらHTMLを書き出すクラス
+    連続する空白を1つにまとめ、<br>や表・見出し・リストの終わりで改行する
+    pre/textarea（と書き換えたtitle）の中はそのまま出力する
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.preserve = 0
+        # 直前の出力が空白か（文書先頭の空白を捨てるためTrueで始める）
+        self.space = True
+        # 末尾の空白を含む出力の位置（最後に取り除く）
+        self.trailing = None
+
+    def write(self, text):
+        """文字列を出力する"""
+        if self.preserve:
+            if text:
+                self.parts.append(text)
+                self.space = False
+                self.trailing = None
+            return
+        text = WHITESPACE.sub(" ", text)
+        if self.space and text.startswith(" "):
+            text = text[1:]
+        if not text:
+            return
+        self.parts.append(text)
+        self.space = text.endswith(" ")
+        self.trailing = len(self.parts) - 1 if self.space else None
+
+    def newline(self):
+        """ソースを見やすくするための改行（前後の空白の扱いには影響しない）"""
+        if not self.preserve:
+            self.parts.append("\n")
+
+    def doctype(self, text):
+        """DOCTYPEを出力する（従来の出力と同じく、改行と空白1つを続ける）"""
+        self.write(text)
+        self.newline()
+        self.write(" ")
+
+    def start(self, name, attrs, void=False, preserve=False):
+        """開始タグを出力する"""
+        self.write(f"<{name}{_format_attrs(attrs)}{'/>' if void else '>'}")
+        if void:
+            if name in NEWLINE_AFTER_TAGS:
+                self.newline()
+        elif preserve or name in PRESERVE_TAGS:
+            self.preserve += 1
+
+    def end(self, name, preserve=False):
+        """終了タグを出力する"""
+        if preserve or name in PRESERVE_TAGS:
+            self.preserve -= 1
+        self.write(f"</{name}>")
+        if name in NEWLINE_AFTER_TAGS:
+            self.newline()
+
+    def getvalue(self):
+        """出力したHTMLを返す（文書末尾の空白は除く）"""
+        if self.trailing is not None:
+            self.parts[self.trailing] = self.parts[self.trailing][:-1]
+            self.trailing = None
+        return "".join(self.parts)
+
+
+def _strip_edges(soup):
+    """文書の先頭・末尾にある空白だけの文字列を取り除く"""
+    for index in (0, -1):
+        while soup.contents and type(soup.contents[index]) is NavigableString:
+            node = soup.contents[index]
+            text = node.lstrip() if index == 0 else node.rstrip()
+            if text:
+                node.replace_with(text)
+                break
+            node.extract()
 
-    # 【重大エラーチェック】コンテンツ削除検出
-    # head/script/styleなどの削除で大きく減ることがあるため、本文テキスト同士で比較する
-    # original_plain = re.sub(r'<[^>]*>', '', original_html)
-    # cleaned_plain = re.sub(r'<[^>]*>', '', html_text)
-    # original_length = len(original_plain)
-    # cleaned_length = len(cleaned_plain)
 
-    # 11. HTML構造の正規化（<head>と<body>が存在しない場合は追加）
-    soup_final = BeautifulSoup(html_text, "html.parser")
+def _normalize_bs4(soup, extracted_title):
+    """<head>, <title>, <body>がない場合は追加する。抽出したタイトルを設定したtitleを返す"""
+    _strip_edges(soup)
 
     # <head>タグの存在確認と追加
-    head_tag = soup_final.find("head")
+    head_tag = soup.find("head")
     if not head_tag:
-        head_tag = soup_final.new_tag("head")
+        head_tag = soup.new_tag("head")
         # htmlタグがあればその先頭に、なければ全体の先頭に挿入
-        html_tag = soup_final.find("html")
+        html_tag = soup.find("html")
         if html_tag:
             html_tag.insert(0, head_tag)
         else:
-            soup_final.insert(0, head_tag)
+            soup.insert(0, head_tag)
 
     # タイトルの設定（抽出したタイトルを反映）
-    title_tag = soup_final.find("title")
+    title_tag = soup.find("title")
     if not title_tag:
-        title_tag = soup_final.new_tag("title")
+        title_tag = soup.new_tag("title")
         head_tag.append(title_tag)
-
-    # 抽出したタイトルがあり、かつ現在のタイトルタグが空または新規作成の場合に設定
     if extracted_title:
         title_tag.string = extracted_title
 
     # <body>タグの存在確認と追加
-    if not soup_final.find("body"):
-        body_tag = soup_final.new_tag("body")
+    if not soup.find("body"):
+        body_tag = soup.new_tag("body")
         # <head>以外の全要素をbodyに移動
-        head_tag = soup_final.find("head")
-        for element in list(soup_final.children):
-            if element != head_tag and element.name not in [None, "html"]:
+        for element in list(soup.children):
+            if element is not head_tag and element.name not in [None, "html"]:
                 element.extract()
                 body_tag.append(element)
         # htmlタグがあればその中に、なければ全体に追加
-        html_tag = soup_final.find("html")
+        html_tag = soup.find("html")
         if html_tag:
             html_tag.append(body_tag)
         else:
-            soup_final.append(body_tag)
-
-    html_text = str(soup_final)
-
-    files.write_text(html_text, encoding="utf-8")
-    logger.info("クリーンアップ完了: %s", files.name)
-    return files
+            soup.append(body_tag)
+
+    return title_tag if extracted_title else None
+
+
+def _serialize_bs4(soup, extracted_title):
+    """html.parserの解析結果を整形したHTML文字列にする（再解析しない）"""
+    title_tag = _normalize_bs4(soup, extracted_title)
+    formatter = HTMLFormatter.REGISTRY["minimal"]
+    writer = HtmlWriter()
+    stack = []
+
+    def close(tag):
+        if tag.name not in SKIP_TAGS:
+            writer.end(tag.name, tag is title_tag)
+
+    # 深いネストでも再帰しないよう、文書順の走査とタグのスタックで開始・終了を判定する
+    for node in soup.descendants:
+        while stack and node.parent is not stack[-1]:
+            close(stack.pop())
+        if isinstance(node, Doctype):
+            writer.doctype(node.output_ready(formatter).rstrip())
+        elif not isinstance(node, Tag):
+            writer.write(node.output_ready(formatter))
+        elif node.is_empty_element:
+            writer.start(node.name, formatter.attributes(node), void=True)
+        else:
+            if node.name not in SKIP_TAGS:
+                writer.start(
+                    node.name, formatter.attributes(node), preserve=node is title_tag
+                )
+            stack.append(node)
+    while stack:
+        close(stack.pop())
+    return writer.getvalue()
+
+
+def _normalize_lxml(root, extracted_title):
+    """<head>, <title>, <body>がない場合は追加する。抽出したタイトルを設定したtitleを返す"""
+    head_tag = root.find("head")
+    if head_tag is None:
+        head_tag = etree.Element("head")
+        root.insert(0, head_tag)
+    title_tag = root.find(".//title")
+    if title_tag is None:
+        title_tag = etree.SubElement(head_tag, "title")
+    if extracted_title:
+        for child in list(title_tag):
+            title_tag.remove(child)
+        title_tag.text = extracted_title
+    if root.find("body") is None:
+        etree.SubElement(root, "body")
+    return title_tag if extracted_title else None
+
+
+def _serialize_lxml(root, html_text, extracted_title):
+    """lxmlの解析結果をhtml.parserと同じ書式のHTML文字列にする"""
+    title_tag = _normalize_lxml(root, extracted_title)
+    writer = HtmlWriter()
+    # libxml2は既定のDOCTYPEを補うため、元の文書にある場合のみ出力する
+    doctype = DOCTYPE.search(html_text)
+    if doctype:
+        writer.doctype(doctype.group(0))
+    # html.parserと同様、元の文書に<html>がなければ<head>と<body>だけを出力する
+    if re.search(r"<html[\s>]", html_text, re.IGNORECASE):
+        _write_lxml(root, writer, title_tag)
+    else:
+        if root.text:
+            writer.write(escape(root.text, quote=False))
+        for child in root:
+            _write_lxml(child, writer, title_tag)
+    return writer.getvalue()
+
+
+def _write_lxml(element, writer, title_tag):
+    """lxmlの要素を後ろのテキストも含めて書き出す（深いネストでも再帰しない）"""
+    stack = [(element, False)]
+    while stack:
+        node, closing = stack.pop()
+        tag = node.tag
+        if closing:
+            if tag not in SKIP_TAGS:
+                writer.end(tag, node is title_tag)
+        elif not isinstance(tag, str):
+            # コメント・処理命令
+            writer.write(etree.tostring(node, encoding="unicode", with_tail=False))
+        elif tag in VOID_TAGS and len(node) == 0 and not node.text:
+            writer.start(tag, node.attrib.items(), void=True)
+        else:
+            if tag not in SKIP_TAGS:
+                writer.start(tag, node.attrib.items(), preserve=node is title_tag)
+            if node.text:
+                writer.write(
+                    node.text if tag in CDATA_TAGS else escape(node.text, quote=False)
+                )
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node))
+            continue
+        if node.tail:
+            writer.write(escape(node.tail, quote=False))
 
 
 # --- メイン処理 ---
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""dir_index.py
+フォルダ内のファイル一覧をos.scandirで一度だけ走査し、各ステージで共有するインデックス
+ステージはファイルを書き換え・移動したときにインデックスを更新する
+"""
+import logging
+import os
+import threading
+
+from file_class import FileKind, SmartFile
+from parameter import config
+
+logger = logging.getLogger(__name__)
+
+# --- 設定 ---
+image_extensions = config["common"]["image_extensions"]
+html_extensions = config["common"]["html_extensions"]
+
+
+def kind_of(path):
+    """拡張子からファイルの種類を判定する"""
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in html_extensions:
+        return FileKind.HTML
+    if suffix in image_extensions:
+        return FileKind.IMAGE
+    return FileKind.OTHER
+
+
+def _normalize(path):
+    """相対・絶対どちらで指定されても同じキーになるよう、カレントからの相対パスにそろえる"""
+    abs_path = os.path.abspath(str(path))
+    try:
+        return os.path.relpath(abs_path)
+    except ValueError:
+        # Windowsで別ドライブの場合
+        return abs_path
+
+
+class DirectoryIndex:
+    """フォルダ配下のファイルのパス・種類・stat結果を保持するインデックス"""
+
+    def __init__(self, root):
+        self.root = _normalize(root)
+        self._entries = None  # {パス: (FileKind, stat_result)}
+        self._lock = threading.RLock()
+
+    def _scan(self):
+        """フォルダを再帰的に走査する（DirEntryの種類情報を使いstatを最小限にする）"""
+        entries = {}
+        stack = [self.root]
+        while stack:
+            try:
+                iterator = os.scandir(stack.pop())
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with iterator:
+                for entry in iterator:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        entries[entry.path] = (kind_of(entry.name), entry.stat())
+        logger.debug("インデックス作成: %s (%d件)", self.root, len(entries))
+        return entries
+
+    def _ensure(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._scan()
+            return self._entries
+
+    def files(self, kind=None):
+        """指定した種類のファイルをパス順のSmartFileで返す"""
+        with self._lock:
+            entries = self._ensure()
+            items = sorted(
+                (path, stat_result)
+                for path, (file_kind, stat_result) in entries.items()
+                if kind is None or file_kind == kind
+            )
+        result = []
+        for path, stat_result in items:
+            smart_file = SmartFile(path, stat_result)
+            smart_file.kind = kind_of(path)
+            result.append(smart_file)
+        return result
+
+    def has(self, kind):
+        """指定した種類のファイルが1件以上あるか"""
+        with self._lock:
+            return any(file_kind == kind for file_kind, _ in self._ensure().values())
+
+    def update(self, path):
+        """書き込み・追加されたファイルのstatを取り直す"""
+        key = _normalize(path)
+        with self._lock:
+            if self._entries is None:
+                return
+            try:
+                self._entries[key] = (kind_of(key), os.stat(key))
+            except FileNotFoundError:
+                self._entries.pop(key, None)
+
+    def remove(self, path):
+        """移動・削除されたファイルをインデックスから外す"""
+        with self._lock:
+            if self._entries is not None:
+                self._entries.pop(_normalize(path), None)
+
+    def invalidate(self):
+        """フォルダを作り直したときに、次回問い合わせで再走査させる"""
+        with self._lock:
+            self._entries = None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(root):
+    """フォルダごとに共有されるインデックスを返す"""
+    key = _normalize(root)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = DirectoryIndex(key)
+        return _indexes[key]
@@ -2,27 +2,93 @@
 """file_class.py
 Pathクラスをラップし、処理状態や表示用の属性を追加したクラス
 """
+import hashlib
 import logging
 import os
+import stat
+import tempfile
+from enum import Enum
 from pathlib import Path
 
 import parameter
 
 logger = logging.getLogger(__name__)
 
+# 上書き保存時にディスクへ確実に書き出すか（遅くなるが電源断にも強い）
+fsync_enabled = parameter.to_bool(parameter.config["common"].get("fsync", "false"))
+
+
+def write_text_atomic(path, data, encoding="utf-8", fsync=None):
+    """一時ファイルに書き込んでから置き換える。途中で落ちても元のファイルは壊れない"""
+    path = Path(path)
+    if fsync is None:
+        fsync = fsync_enabled
+    # 同じフォルダに作らないとos.replaceがアトミックにならない
+    fd, tmp_name = tempfile.mkstemp(
+        prefix=f".{path.name}.", suffix=".tmp", dir=path.parent
+    )
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as file:
+            file.write(data)
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        try:
+            # mkstempは0600で作るため元ファイルのパーミッションを引き継ぐ
+            os.chmod(tmp_name, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+class FileKind(str, Enum):
+    """ファイルの種類（GUIの一覧振り分けに使う）"""
+
+    IMAGE = "image"
+    HTML = "html"
+    OTHER = "other"
+
 
 class SmartFile:
-    """Pathクラスをラップし、処理状態や表示用の属性を追加したクラス"""
+    """Pathに処理状態や表示用の属性を持たせた軽量レコード
+    ディレクトリ走査時のstat結果をキャッシュし、ファイルシステムへの問い合わせを減らす
+    """
+
+    __slots__ = (
+        "_path",
+        "_stat",
+        "status",
+        "kind",
+        "disp_path",
+        "old_name",
+        "hash",
+        "stage",
+    )
 
-    def __init__(self, path_str):
-        self._path = Path(path_str)
+    def __init__(self, path_str, stat_result=None):
+        self._path = path_str if isinstance(path_str, Path) else Path(path_str)
+        self._stat = stat_result
         self.status = "⌛"
-        self.extensions = ["image", "html", "other"]
+        self.kind = FileKind.OTHER
         self.disp_path = None
         self.old_name = None
+        self.hash = None
+        # 結果キューに送った処理（main_processが設定する）
+        self.stage = None
+
+    @classmethod
+    def from_entry(cls, entry):
+        """os.scandirのDirEntryから作成する（stat結果を引き継ぐ）"""
+        return cls(entry.path, entry.stat())
 
     def __getattr__(self, name):
-        # is_file, exists, name などをPathクラスから引き継ぐ
+        # relative_to, resolve など使用頻度の低いものはPathクラスから引き継ぐ
         return getattr(self._path, name)
 
     def __fspath__(self):
@@ -31,13 +97,86 @@ class SmartFile:
     def __str__(self):
         return str(self._path)
 
+    @property
+    def path(self):
+        """ラップしているPath"""
+        return self._path
+
+    @property
+    def name(self):
+        """ファイル名"""
+        return self._path.name
+
+    @property
+    def suffix(self):
+        """拡張子"""
+        return self._path.suffix
+
+    @property
+    def parent(self):
+        """親フォルダ"""
+        return self._path.parent
+
+    @property
+    def size(self):
+        """ファイルサイズ（キャッシュしたstatから）"""
+        return self.stat().st_size
+
+    @property
+    def mtime(self):
+        """更新日時（キャッシュしたstatから）"""
+        return self.stat().st_mtime
+
+    def stat(self):
+        """stat結果を返す。未取得の場合のみファイルシステムに問い合わせる"""
+        if self._stat is None:
+            self._stat = self._path.stat()
+        return self._stat
+
+    def refresh(self):
+        """書き込み・移動後にキャッシュを破棄する"""
+        self._stat = None
+        self.hash = None
+
+    def exists(self):
+        """ファイルが存在するか"""
+        try:
+            self.stat()
+        except OSError:
+            return False
+        return True
+
+    def is_file(self):
+        """通常ファイルか"""
+        try:
+            return stat.S_ISREG(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def content_hash(self):
+        """内容のSHA-256（一度計算したら保持する）"""
+        if self.hash is None:
+            digest = hashlib.sha256()
+            with open(self._path, "rb") as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            self.hash = digest.hexdigest()
+        return self.hash
+
     def read_text(self, *args, **kwargs):
         """Pathクラスのread_textを呼び出す"""
         return self._path.read_text(*args, **kwargs)
 
     def write_text(self, data, *args, **kwargs):
         """Pathクラスのwrite_textを呼び出す"""
-        return self._path.write_text(data, *args, **kwargs)
+        result = self._path.write_text(data, *args, **kwargs)
+        self.refresh()
+        return result
+
+    def write_text_atomic(self, data, encoding="utf-8", fsync=None):
+        """作業ファイルを上書きする（一時ファイル経由で置き換える）"""
+        write_text_atomic(self._path, data, encoding=encoding, fsync=fsync)
+        self.refresh()
 
     def iserror(self):
         """エラー状態かどうかを判定する"""
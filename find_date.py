@@ -2,14 +2,15 @@
 """HTMLファイルから日付を抽出し、<time datetime="YYYY-MM-DD"></time> タグを追加するモジュール"""
 import calendar
 import logging
-import os
 import queue
 import re
 import unicodedata
 from pathlib import Path
 
-import file_class
+from dir_index import get_index
+from file_class import FileKind
 from parameter import config
+from stage_journal import StageJournal, stage_control
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +20,6 @@ logger = logging.getLogger(__name__)
 input_dir = config["find_date"]["input_dir"].lstrip("./")
 # 出力先フォルダ
 output_dir = config["find_date"]["output_dir"].lstrip("./")
-html_extensions = config["common"]["html_extensions"]
 
 
 def extract_date_from_html(html_text):
@@ -216,8 +216,7 @@ def add_date_to_html(html_path):
                 content = time_tag + content
 
             # ファイル書き込み
-            with open(html_path, "w", encoding="utf-8") as file:
-                file.write(content)
+            html_path.write_text_atomic(content, encoding="utf-8")
 
             return html_path, False
         else:
@@ -237,42 +236,35 @@ def run(queue_obj):
 
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
-    for root, dirs, files in os.walk(str(input_dir)):
-        for filename in files:
-            if filename.lower().endswith(tuple(html_extensions)):
-                src_path = Path(root) / filename
-                if src_path:
-                    smart_file = file_class.SmartFile(src_path)
-                    smart_file.status = "⏳"
-                    smart_file.extensions = "html"
-                    smart_file.disp_path = smart_file.name
-                    queue_obj.put(smart_file)
-                else:
-                    # エラー時はスキップ（ログはadd_date_to_html内で出力済み）
-                    pass
+    work_index = get_index(input_dir)
+    html_files = work_index.files(FileKind.HTML)
+    for smart_file in html_files:
+        smart_file.status = "⏳"
+        smart_file.disp_path = smart_file.name
+        queue_obj.put(smart_file)
     processed_count = 0
+    journal = StageJournal("find_date")
     logger.info("--- 日付追加処理を開始します (対象フォルダ: %s) ---", input_dir)
 
-    for root, dirs, files in os.walk(str(input_dir)):
-        for filename in files:
-            if filename.lower().endswith(tuple(html_extensions)):
-                src_path = Path(root) / filename
-                processed_count += 1
+    for smart_file in html_files:
+        stage_control.checkpoint()
+        processed_count += 1
 
-                logger.info("[%d] %s", processed_count, src_path.relative_to(input_dir))
-                result_path, has_warning = add_date_to_html(
-                    file_class.SmartFile(src_path)
-                )
-                if result_path:
-                    smart_file = file_class.SmartFile(result_path)
-                    smart_file.status = "⚠" if has_warning else "✔"
-                    smart_file.extensions = "html"
-                    smart_file.disp_path = smart_file.name
-                    queue_obj.put(smart_file)
-                else:
-                    smart_file = file_class.SmartFile(src_path)
-                    smart_file.status = "✖"
-                    queue_obj.put(smart_file)
+        logger.info("[%d] %s", processed_count, smart_file.relative_to(input_dir))
+        if journal.is_committed(smart_file):
+            result_path = smart_file
+            has_warning = journal.info(smart_file)["warning"]
+        else:
+            result_path, has_warning = add_date_to_html(smart_file)
+            if result_path:
+                journal.commit(result_path, info={"warning": has_warning})
+                work_index.update(result_path)
+        if result_path:
+            smart_file.status = "⚠" if has_warning else "✔"
+        else:
+            smart_file.status = "✖"
+        queue_obj.put(smart_file)
+    journal.finish()
     logger.info("-" * 30)
     logger.info("【処理完了】")
     logger.info("処理したHTML: %d 本", processed_count)
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""find_duplicate.py
+記事本文の指紋（SimHash）を取り、投稿済みの記事や同じ取り込み内の記事と
+ほぼ同じ内容のHTMLに<duplicate_of>タグを追加するモジュール
+"""
+import hashlib
+import json
+import logging
+import queue
+import re
+import unicodedata
+from collections import Counter
+from html import escape, unescape
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from dir_index import get_index
+from file_class import FileKind, write_text_atomic
+from parameter import config
+from stage_journal import StageJournal, stage_control
+
+logger = logging.getLogger(__name__)
+
+# --- 設定 ---
+
+# 入力元フォルダ
+input_dir = config["find_duplicate"]["input_dir"].lstrip("./")
+# 投稿済み記事のフォルダ
+history_dir = config["find_duplicate"]["history_dir"].lstrip("./")
+# 指紋インデックスファイル
+index_file = config["find_duplicate"]["index_file"]
+# 近似重複とみなす指紋のハミング距離
+max_distance = int(config["find_duplicate"].get("max_distance", 6))
+# 指紋を取る本文の最小文字数（短い記事は誤検知が多いため対象外）
+min_length = int(config["find_duplicate"].get("min_length", 50))
+# 履歴フォルダにある記事以外のHTML（画像アップロードリスト）
+link_list_name = Path(config["link_html"]["link_list_file_html"]).name
+
+HASH_BITS = 64
+# 文字n-gramの長さ（日本語は単語区切りがないため文字単位）
+SHINGLE_SIZE = 3
+# 指紋の計算から除外するメタデータタグ
+META_TAGS = ["search", "time", "location_name", "latitude", "longitude"]
+DUPLICATE_TAG = re.compile(
+    r"<duplicate_of>(.*?)</duplicate_of>\n?", re.IGNORECASE | re.DOTALL
+)
+
+
+def duplicate_of(html_text):
+    """<duplicate_of>タグに記録された重複元のファイル名を返す（なければNone）"""
+    match = DUPLICATE_TAG.search(html_text)
+    return unescape(match.group(1)).strip() if match else None
+
+
+def body_text(html_text):
+    """指紋用に本文テキストを取り出し、表記ゆれと空白をならす"""
+    soup = BeautifulSoup(DUPLICATE_TAG.sub("", html_text), "html.parser")
+    for tag in soup.find_all(META_TAGS):
+        tag.decompose()
+    body = soup.body or soup
+    text = unicodedata.normalize("NFKC", body.get_text()).lower()
+    return re.sub(r"\s+", "", text)
+
+
+def simhash(text):
+    """文字n-gramのSimHashを返す。本文が短すぎる場合はNone"""
+    if len(text) < max(min_length, SHINGLE_SIZE):
+        return None
+    shingles = Counter(
+        text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)
+    )
+    total = sum(shingles.values())
+    weights = [0] * HASH_BITS
+    for shingle, count in shingles.items():
+        value = int.from_bytes(
+            hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        # 立っているビットだけ加算する（立っていないビットは最後にtotalとの差で判定）
+        while value:
+            low = value & -value
+            weights[low.bit_length() - 1] += count
+            value ^= low
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight * 2 > total:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def distance(a, b):
+    """2つの指紋のハミング距離"""
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    """指紋をビット帯ごとに引けるようにした索引
+    ハミング距離max_distance以内なら、max_distance+1に分けた帯のどれかが必ず一致する
+    """
+
+    def __init__(self):
+        bands = min(max_distance, HASH_BITS - 1) + 1
+        width = HASH_BITS // bands
+        self._bands = [
+            (i * width, (1 << (HASH_BITS - i * width if i == bands - 1 else width)) - 1)
+            for i in range(bands)
+        ]
+        self._tables = [{} for _ in self._bands]
+
+    def add(self, name, fingerprint):
+        """指紋を登録する"""
+        for (shift, mask), table in zip(self._bands, self._tables):
+            table.setdefault((fingerprint >> shift) & mask, []).append(
+                (name, fingerprint)
+            )
+
+    def find(self, fingerprint):
+        """最も近い登録済みの指紋を(名前, 距離)で返す（max_distanceを超える場合はNone）"""
+        best = None
+        for (shift, mask), table in zip(self._bands, self._tables):
+            for name, other in table.get((fingerprint >> shift) & mask, ()):
+                dist = distance(fingerprint, other)
+                if dist <= max_distance and (best is None or dist < best[1]):
+                    best = (name, dist)
+        return best
+
+
+class FingerprintManager:
+    """投稿済み記事の指紋インデックス（ファイルに保存し、履歴フォルダの差分だけ計算する）"""
+
+    def __init__(self):
+        self.entries = {}
+        self.index = SimHashIndex()
+
+    def load_index(self):
+        """インデックスを読み込み、履歴フォルダに増えた記事の指紋を追加する"""
+        self.entries = {}
+        self.index = SimHashIndex()
+        path = Path(index_file)
+        try:
+            if path.exists():
+                with open(path, "r", encoding="utf-8") as file:
+                    self.entries = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.error("指紋インデックス読み込みエラー: %s", e, exc_info=True)
+            return False
+
+        added = 0
+        # 別のプロセス（予約投稿等）が履歴に移動した記事も指紋に含めるよう走査し直す
+        history_index = get_index(history_dir)
+        history_index.invalidate()
+        for history_file in history_index.files(FileKind.HTML):
+            if history_file.name == link_list_name:
+                continue
+            entry = self.entries.get(history_file.name)
+            stat_result = history_file.stat()
+            if (
+                entry
+                and entry["size"] == stat_result.st_size
+                and entry["mtime_ns"] == stat_result.st_mtime_ns
+            ):
+                continue
+            try:
+                html_text = history_file.read_text(encoding="utf-8", errors="ignore")
+            except OSError as e:
+                logger.warning("履歴の読み込み失敗: %s - %s", history_file.name, e)
+                continue
+            fingerprint = simhash(body_text(html_text))
+            self.entries[history_file.name] = {
+                "simhash": None if fingerprint is None else f"{fingerprint:016x}",
+                "size": stat_result.st_size,
+                "mtime_ns": stat_result.st_mtime_ns,
+            }
+            added += 1
+
+        # 履歴から削除された記事も投稿済みなので、インデックスには残す
+        for name, entry in self.entries.items():
+            if entry["simhash"]:
+                self.index.add(name, int(entry["simhash"], 16))
+
+        if added:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                write_text_atomic(
+                    path, json.dumps(self.entries, ensure_ascii=False, indent=1)
+                )
+            except OSError as e:
+                logger.error("指紋インデックス保存エラー: %s", e, exc_info=True)
+                return False
+        logger.info("指紋インデックス: %d件 (追加 %d件)", len(self.entries), added)
+        return True
+
+
+fingerprint_manager = FingerprintManager()
+
+
+def check_duplicate(files, batch_index):
+    """HTMLの指紋を取り、重複していれば<duplicate_of>タグを追加する"""
+    html_text = files.read_text(encoding="utf-8")
+    # 再実行時は前回のタグを外してから判定する
+    cleaned_text = DUPLICATE_TAG.sub("", html_text)
+    fingerprint = simhash(body_text(cleaned_text))
+
+    match = None
+    if fingerprint is None:
+        logger.info("本文が短いため重複チェックをスキップ: %s", files.name)
+    else:
+        # 投稿済みの記事を優先し、なければ同じ取り込み内の先の記事と比べる
+        match = fingerprint_manager.index.find(fingerprint) or batch_index.find(
+            fingerprint
+        )
+
+    if match:
+        logger.warning(
+            "重複の可能性: %s ≒ %s (距離 %d) 投稿する場合は<duplicate_of>タグを削除してください",
+            files.name,
+            match[0],
+            match[1],
+        )
+        duplicate_tag = f"<duplicate_of>{escape(match[0])}</duplicate_of>\n"
+        # <title>タグの直後に挿入
+        if re.search(r"</title>", cleaned_text, re.IGNORECASE):
+            cleaned_text = re.sub(
+                r"(</title>)",
+                lambda m: m.group(1) + "\n" + duplicate_tag,
+                cleaned_text,
+                count=1,
+                flags=re.IGNORECASE,
+            )
+        else:
+            cleaned_text = duplicate_tag + cleaned_text
+
+    if cleaned_text != html_text:
+        files.write_text_atomic(cleaned_text, encoding="utf-8")
+    return fingerprint, match[0] if match else None
+
+
+def run(queue_obj):
+    """取り込んだHTMLの重複をチェックするメイン関数"""
+    logger.info("重複記事チェック開始: %s (履歴: %s)", input_dir, history_dir)
+    if not fingerprint_manager.load_index():
+        logger.warning(
+            "指紋インデックスの準備に失敗しました。重複チェックをスキップします。"
+        )
+        return
+
+    work_index = get_index(input_dir)
+    html_files = work_index.files(FileKind.HTML)
+    journal = StageJournal("find_duplicate")
+    batch_index = SimHashIndex()
+    count = 0
+
+    for src_file in html_files:
+        src_file.status = "⏳"
+        src_file.disp_path = src_file.name
+        queue_obj.put(src_file)
+
+    for src_file in html_files:
+        stage_control.checkpoint()
+        if journal.is_committed(src_file):
+            info = journal.info(src_file)
+            fingerprint = info["simhash"] and int(info["simhash"], 16)
+            original = info["duplicate_of"]
+        else:
+            fingerprint, original = check_duplicate(src_file, batch_index)
+            journal.commit(
+                src_file,
+                info={
+                    "simhash": None if fingerprint is None else f"{fingerprint:016x}",
+                    "duplicate_of": original,
+                },
+            )
+            work_index.update(src_file)
+        if original:
+            count += 1
+        elif fingerprint is not None:
+            batch_index.add(src_file.name, fingerprint)
+        src_file.status = "⚠" if original else "✔"
+        queue_obj.put(src_file)
+    journal.finish()
+    logger.info("重複記事チェック完了: 重複の可能性 %d件", count)
+
+
+# --- メイン処理 ---
+if __name__ == "__main__":
+
+    result_queue = queue.Queue()
+    try:
+        run(result_queue)
+    except KeyboardInterrupt:
+        logger.info("処理が中断されました。")
+    except (IOError, OSError, ValueError) as e:
+        logger.critical("予期せぬエラーが発生しました: %s", e, exc_info=True)
@@ -8,8 +8,10 @@ import re
 import xml.etree.ElementTree as ET
 from pathlib import Path
 
-from file_class import SmartFile
+from dir_index import get_index
+from file_class import FileKind
 from parameter import config
+from stage_journal import StageJournal, stage_control
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +19,6 @@ logger = logging.getLogger(__name__)
 input_dir = config["find_keyword"]["input_dir"].lstrip("./")
 # 出力先フォルダ
 output_dir = config["find_keyword"]["output_dir"].lstrip("./")
-html_extensions = config["common"]["html_extensions"]
 
 xml_file = config["find_keyword"]["keywords_xml_file"]
 
@@ -65,28 +66,26 @@ keyword_manager = KeywordManager()
 def run(queue_obj):
     """HTMLファイルにキーワードを注入するメイン関数"""
     logger.info("キーワード注入開始: %s -> %s", input_dir, output_dir)
-    all_files = list(Path(input_dir).rglob("*"))
+    work_index = get_index(input_dir)
+    html_files = work_index.files(FileKind.HTML)
+    journal = StageJournal("find_keyword")
     count = 0
 
-    for path in all_files:
-        src_file = SmartFile(path)
-        if src_file.is_file():
-            if src_file.suffix.lower() in html_extensions:
-                src_file.status = "⏳"
-                src_file.extensions = "html"
-                src_file.disp_path = src_file.name
-                queue_obj.put(src_file)
-
-    for path in all_files:
-        src_file = SmartFile(path)
-        if src_file.is_file():
-            if src_file.suffix.lower() in html_extensions:
-                src_file = add_keywords_to_content(src_file)
-                src_file.status = "✔"
-                src_file.extensions = "html"
-                src_file.disp_path = src_file.name
-                queue_obj.put(src_file)
-                count += 1
+    for src_file in html_files:
+        src_file.status = "⏳"
+        src_file.disp_path = src_file.name
+        queue_obj.put(src_file)
+
+    for src_file in html_files:
+        stage_control.checkpoint()
+        if not journal.is_committed(src_file):
+            src_file = add_keywords_to_content(src_file)
+            journal.commit(src_file)
+            work_index.update(src_file)
+        src_file.status = "✔"
+        queue_obj.put(src_file)
+        count += 1
+    journal.finish()
     logger.info("キーワード注入完了: %d件", count)
 
 
@@ -222,8 +221,7 @@ def add_keywords_to_content(files):
         else:
             html_content = search_tag + "\n" + html_content
 
-    with open(files, "w", encoding="utf-8") as file:
-        file.write(html_content)
+    files.write_text_atomic(html_content, encoding="utf-8")
     logger.info("キーワード追加: %s", files.name)
     return files
 
@@ -15,8 +15,11 @@ from geopy.geocoders import Nominatim
 from janome.tokenizer import Tokenizer
 
 from cons_progressber import ProgressBar
-from file_class import SmartFile
+from dir_index import get_index
+from file_class import FileKind
+from find_duplicate import duplicate_of
 from parameter import config, to_bool
+from stage_journal import StageJournal, stage_control
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +34,6 @@ geocode_retries = int(config["find_location"]["geocode_retries"])
 geocode_wait = float(config["find_location"]["geocode_wait"])
 geocode_timeout = int(config["find_location"]["geocode_timeout"])
 geocode_debug = to_bool(config["find_location"]["geocode_debug"])
-html_extensions = config["common"]["html_extensions"]
 location_cache = {}
 
 
@@ -127,6 +129,10 @@ def indent_xml(elem, level=0):
 def find_location_in_html(files):
     """HTML内で地域名を検索し、座標を返す"""
     html_text = files.read_text(encoding="utf-8", errors="ignore")
+    if duplicate_of(html_text):
+        # 投稿しない記事のためジオコーディングのAPIを使わない
+        logger.info("重複記事のため地点検索をスキップ: %s", files.name)
+        return files, False
 
     soup = BeautifulSoup(html_text, "html.parser")
 
@@ -309,8 +315,7 @@ def find_location_in_html(files):
             )
             html_text = georss_tag + html_text
             has_warning = True
-    with open(files, "w", encoding="utf-8") as file:
-        file.write(html_text)
+    files.write_text_atomic(html_text, encoding="utf-8")
     return files, has_warning
 
 
@@ -329,33 +334,35 @@ def run(queue_obj):
 
     logger.info("HTML地点追加処理を開始: %s", input_dir)
 
-    files_to_process = [
-        p
-        for p in Path(input_dir).rglob("*")
-        if p.is_file() and p.suffix.lower() in (html_extensions)
-    ]
+    work_index = get_index(input_dir)
+    files_to_process = work_index.files(FileKind.HTML)
 
     if not files_to_process:
         logger.warning("地点追加対象のHTMLファイルが見つかりません。")
         return
 
-    for src_path in files_to_process:
-        files = SmartFile(src_path)
+    for files in files_to_process:
         files.status = "⏳"
-        files.extensions = "html"
         files.disp_path = files.name
         queue_obj.put(files)
 
+    journal = StageJournal("find_location")
     pbar = ProgressBar(len(files_to_process), prefix="Add Locations")
     # ディレクトリ内のアイテムを走査
-    for src_path in files_to_process:
-        smart_file = SmartFile(src_path)
-        processed_file, has_warning = find_location_in_html(smart_file)
+    for smart_file in files_to_process:
+        stage_control.checkpoint()
+        if journal.is_committed(smart_file):
+            # 前回中断前に付与済み（ジオコーディングをやり直さない）
+            processed_file = smart_file
+            has_warning = journal.info(smart_file)["warning"]
+        else:
+            processed_file, has_warning = find_location_in_html(smart_file)
+            journal.commit(processed_file, info={"warning": has_warning})
+            work_index.update(processed_file)
         processed_file.status = "⚠" if has_warning else "✔"
-        processed_file.extensions = "html"
-        processed_file.disp_path = processed_file.name
         queue_obj.put(processed_file)
         pbar.update()
+    journal.finish()
     logger.info("完了: HTML地点追加")
 
 
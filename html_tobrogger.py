@@ -13,7 +13,7 @@ import webbrowser
 from tkinter import messagebox, scrolledtext, ttk
 
 import main_process
-from file_class import SmartFile
+from file_class import FileKind, SmartFile
 from parameter import (
     Path,
     config,
@@ -22,6 +22,8 @@ from parameter import (
     open_georss_file,
     open_keywords_app,
 )
+from quota_ledger import next_reset
+from stage_journal import stage_control
 
 # ロガーの設定
 logger = logging.getLogger(__name__)
@@ -86,6 +88,9 @@ class App(tk.Tk):
 
         # 手順初期化
         self.process = ""
+        # 中止を要求した／中止された（次の実行では中止した処理をやり直す）
+        self.stopping = False
+        self.cancelled = False
 
         # キューの初期化
         self.command_queue = queue.Queue()
@@ -136,7 +141,7 @@ class App(tk.Tk):
                 if isinstance(result, SmartFile):
                     fname = result
                     status = result.status
-                    if fname.extensions == "html":
+                    if fname.kind == FileKind.HTML:
                         # HTMLファイルのステータス更新
                         self._update_listbox(
                             self.html_listbox, status, self.html_status, fname
@@ -144,7 +149,7 @@ class App(tk.Tk):
                         if result.iserror():
                             self.error_file_list.add(fname)
                             logger.warning("エラーファイル: %s", fname)
-                    elif fname.extensions == "image":
+                    elif fname.kind == FileKind.IMAGE:
                         # 画像ファイルのステータス更新
                         self._update_listbox(
                             self.image_listbox, status, self.image_status, fname
@@ -167,6 +172,18 @@ class App(tk.Tk):
                 if msg_type == "check_resume":
                     if status_type == "♻":
                         logger.info("再開処理があります。")
+                if status_type == "🔁" and msg_type not in (
+                    "upload_image",
+                    "upload_art",
+                ):
+                    logger.info("中断された処理があります: %s", result["name"])
+                    if messagebox.askyesno(
+                        "処理再開",
+                        f"「{result['name']}」が途中で中断されています。\n続きから再開しますか？",
+                    ):
+                        self.process = msg_type
+                        self.command_queue.put(self.process)
+                    continue
                 if msg_type == "import_files" and status_type == "✔":
                     open_path = config["gui"]["reports_dir"]
                     self.open_folder_action(open_path)
@@ -240,7 +257,9 @@ class App(tk.Tk):
                         webbrowser.open(open_web)
                         messagebox.showwarning(
                             "投稿制限",
-                            "1回の投稿上限に達しました。\n日本時間17時以降に再度投稿してください。"
+                            "1回の投稿上限に達しました。\n日本時間"
+                            + next_reset().strftime("%m/%d %H:%M")
+                            + "以降に再度投稿してください。"
                             + "（BloggerのAPI使用時に投稿できる記事は実測値で45件でした） ",
                         )
                 if msg_type == "closing" and status_type == "✔":
@@ -256,6 +275,7 @@ class App(tk.Tk):
                     or msg_type == "check_files"
                     or msg_type == "serialize_files"
                     or msg_type == "clean_html"
+                    or msg_type == "find_duplicate"
                     or msg_type == "find_keyword"
                     or msg_type == "find_location"
                     or msg_type == "find_date"
@@ -297,10 +317,15 @@ class App(tk.Tk):
 
                     # process_defから自動遷移するかどうかを取得 (resultはプロセス定義の辞書)
                     should_autonext = result.get("autonext", False)
+                    # 中止の要求はこの処理の完了で終わる（次の実行には持ち越さない）
+                    stopping, self.stopping = self.stopping, False
 
                     if has_error_files:
                         # 警告/エラーファイルがあった場合、ユーザー確認のため停止
                         self.btn_check.configure(state="normal")
+                    elif stopping:
+                        # 中止を要求した後に完了した場合は次へ進まない
+                        self.btn_check.configure(state="normal")
                     elif should_autonext:
                         # エラーがなく、自動遷移が有効な場合は次へ
                         self.execute_common()
@@ -308,8 +333,17 @@ class App(tk.Tk):
                         # 手動ステップの場合は停止
                         self.btn_check.configure(state="normal")
 
+                elif status_type == main_process.CANCELLED:
+                    # 中止した処理は、次の実行で確定済みのファイルを除いてやり直す
+                    logger.info("%sを中止しました。", result["name"])
+                    self.stopping = False
+                    self.cancelled = True
+                    self.process = msg_type
+                    self.btn_check.configure(state="normal")
+
                 elif status_type in ["⚠", "⏸️", "🔁", "✖"]:
                     # 警告、一時停止、再開、エラー時はユーザー判断のためボタンを有効化
+                    self.stopping = False
                     self.btn_check.configure(state="normal")
 
         except queue.Empty:
@@ -457,6 +491,18 @@ class App(tk.Tk):
         )
         self.btn_check.pack(fill=tk.X, ipady=10)
 
+        # 実行中の処理の一時停止と中止（ファイルごとの区切りで止まる）
+        control_frame = ttk.Frame(actions_frame)
+        control_frame.pack(fill=tk.X, pady=(5, 0))
+        self.btn_pause = ttk.Button(
+            control_frame, text="一時停止", command=self.on_pause_click
+        )
+        self.btn_pause.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.btn_cancel = ttk.Button(
+            control_frame, text="中止", command=self.on_cancel_click
+        )
+        self.btn_cancel.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
     def setup_logging(self):
         """既存のハンドラをクリア"""
         root_logger = logging.getLogger()
@@ -526,9 +572,45 @@ class App(tk.Tk):
         # 処理中はボタンを無効化
         self.btn_check.configure(state="disabled")
         # 処理開始
-        self.execute_common()
+        if self.cancelled:
+            # 中止した処理を続きから実行する
+            self.cancelled = False
+            self.command_queue.put(self.process)
+        else:
+            self.execute_common()
         logger.info("処理を開始しました。")
 
+    def on_pause_click(self):
+        """一時停止ボタン（押すたびに一時停止と再開を切り替える）"""
+        if stage_control.is_paused():
+            stage_control.resume()
+            self.btn_pause.configure(text="一時停止")
+            logger.info("処理を再開しました。")
+        else:
+            stage_control.pause()
+            self.btn_pause.configure(text="再開")
+            logger.info("処理を一時停止しました（処理中のファイルの後で止まります）。")
+
+    def on_cancel_click(self):
+        """中止ボタン（処理中のファイルの後で中止する）"""
+        # 実行ボタンが有効なら処理は実行中でない（中止の要求を次の実行に残さない）
+        if str(self.btn_check["state"]) != "disabled":
+            logger.info("実行中の処理はありません。")
+            return
+        if not messagebox.askyesno(
+            "中止",
+            "実行中の処理を中止しますか？\n完了したファイルは次回そのまま使います。",
+        ):
+            return
+        if str(self.btn_check["state"]) != "disabled":
+            return  # 確認中に処理が終わった
+        self.stopping = True
+        stage_control.cancel()
+        # 一時停止中でも中止できるよう再開する
+        stage_control.resume()
+        self.btn_pause.configure(text="一時停止")
+        logger.info("処理を中止しています…")
+
     def error_file_message(self):
         """エラーファイルがある場合にメッセージを表示し、確認するかどうかをユーザーに尋ねる"""
         if self.error_file_list:
@@ -619,11 +701,13 @@ class App(tk.Tk):
             "HTML to Blogger\nVersion: 1.0.0\n\nMap Data © OpenStreetMap contributors",
         )
 
+
 def restart_program():
     """Pythonスクリプトを自身で再起動する"""
     python = sys.executable
     os.execl(python, python, *sys.argv)
 
+
 # --- mainエントリポイント ---
 if __name__ == "__main__":
     app = App()
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""html_tobrogger_cli.py
+GUIを使わずに、main_process の処理（process_def）を順に実行するコマンドラインツール
+確認ダイアログの代わりに再開方針をオプションで指定し、進捗は1行ずつ標準出力に出す
+（ログと進捗バーは標準エラー出力）。Tkinterは読み込まない
+Ctrl+Cで実行中の処理を次のファイルの前で中止する（確定済みのファイルは --resume continue で
+続きから実行する）。もう一度Ctrl+Cを押すと終了を待たずに止める
+
+例:
+  python html_tobrogger_cli.py                       # ファイルチェックから記事アップロードまで
+  python html_tobrogger_cli.py --from link_html --format json
+  python html_tobrogger_cli.py --resume restart --workers 8
+"""
+import argparse
+import json
+import logging
+import queue
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+
+import main_process
+import stage_journal
+from file_class import SmartFile
+from stage_journal import stage_control
+
+logger = logging.getLogger(__name__)
+
+# GUIの案内だけを行う処理（コマンドラインでは実行しない）
+# import_media_managerはメディアマネージャーフォルダを空にするため、
+# 置いてあるメディアマネージャーファイルを使えるように実行しない
+GUI_ONLY = ("initial_process", "check_resume", "import_files", "import_media_manager")
+
+# 実行を止める処理の状態
+FAILED = "✖"
+WARNING = "⚠"
+# 処理結果を待つ間隔（秒）
+POLL_SECONDS = 1
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_RESUME = 2
+
+
+def stage_order(first, last):
+    """process_defのnextprocessをたどり、firstからlastまでの処理を返す"""
+    stages = []
+    key = first
+    while key not in stages:
+        stages.append(key)
+        if key == last:
+            break
+        key = main_process.process_def[key]["nextprocess"]
+    else:
+        raise ValueError(f"{first} から {last} にたどり着けません")
+    return [stage for stage in stages if stage not in GUI_ONLY]
+
+
+class ProgressPrinter:
+    """処理とファイルの状態を1行ずつ出力する"""
+
+    def __init__(self, stream, output_format):
+        self.stream = stream
+        self.output_format = output_format
+        # 処理ごとのエラーファイル数
+        self.error_files = Counter()
+
+    def emit(self, event, **fields):
+        fields = dict(
+            time=datetime.now().isoformat(timespec="seconds"), event=event, **fields
+        )
+        if self.output_format == "json":
+            line = json.dumps(fields, ensure_ascii=False)
+        else:
+            line = "\t".join(str(value) for value in fields.values())
+        self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def file(self, stage, smart_file):
+        if smart_file.iserror():
+            self.error_files[stage] += 1
+        self.emit(
+            "file",
+            stage=stage,
+            kind=getattr(smart_file.kind, "value", smart_file.kind),
+            status=smart_file.status,
+            name=str(smart_file.disp_path or smart_file.name),
+            error=smart_file.iserror(),
+        )
+
+    def stage(self, stage, status, name=""):
+        self.emit(
+            "stage",
+            stage=stage,
+            kind="",
+            status=status,
+            name=name or main_process.process_def[stage]["name"],
+            error=status == FAILED,
+        )
+
+
+def run_stage(stage, command_queue, result_queue, worker, printer):
+    """1つの処理を実行し、終了時の状態を返す（スレッドが止まった場合はFAILED）"""
+    printer.stage(stage, "▶")
+    command_queue.put(stage)
+    while True:
+        try:
+            result = result_queue.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            if not worker.is_alive():
+                logger.error("処理スレッドが停止しました: %s", stage)
+                return FAILED
+            continue
+        if isinstance(result, SmartFile):
+            # 並行して実行中の後続の処理のファイルも届くため、ファイルの処理名で表示する
+            printer.file(result.stage or stage, result)
+        elif isinstance(result, dict) and result.get("status") == main_process.RUNNING:
+            # 並行して始まった後続の処理（結果はその処理のコマンドで受け取る）
+            printer.stage(result["key"], result["status"])
+        elif isinstance(result, dict) and result.get("key") == stage:
+            return result.get("status", "✔")
+        elif isinstance(result, str):
+            # main_processの処理中の例外
+            logger.error("%s: %s", stage, result)
+            return FAILED
+
+
+def _log_to_stderr():
+    """ログの画面出力を標準エラー出力に切り替える（標準出力は進捗の行だけにする）"""
+    loggers = [logging.getLogger()] + [
+        logging.getLogger(name) for name in logging.root.manager.loggerDict
+    ]
+    for each in loggers:
+        for handler in getattr(each, "handlers", []):
+            if (
+                isinstance(handler, logging.StreamHandler)
+                and getattr(handler, "stream", None) is sys.stdout
+            ):
+                handler.setStream(sys.stderr)
+
+
+def main(argv=None):
+    """コマンドラインから処理を実行し、終了コードを返す"""
+    stage_keys = list(main_process.process_def)
+    parser = argparse.ArgumentParser(
+        description="GUIを使わずにHTMLの記事の取り込みからBloggerへの投稿までを実行する"
+    )
+    parser.add_argument(
+        "--from",
+        dest="first",
+        default="check_files",
+        choices=stage_keys,
+        help="最初に実行する処理（既定: check_files）",
+    )
+    parser.add_argument(
+        "--to",
+        dest="last",
+        default="upload_art",
+        choices=stage_keys,
+        help="最後に実行する処理（既定: upload_art）",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="並行して実行する数（画像アップロードと記事アップロード(async)の設定を上書き）",
+    )
+    parser.add_argument(
+        "--resume",
+        choices=("continue", "restart", "abort"),
+        default="continue",
+        help="中断された処理があるとき: continue=続きから / restart=--fromからやり直す"
+        " / abort=何もせず終了コード2で終わる（既定: continue）",
+    )
+    parser.add_argument(
+        "--continue-on-warning",
+        action="store_true",
+        help="警告（リンク切れ画像・エラーファイル等）があっても次の処理に進む"
+        "（既定: 警告があれば止める）",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("text", "json"),
+        default="text",
+        help="進捗の出力形式（text: タブ区切り / json: 1行1件のJSON）",
+    )
+    parser.add_argument("--list", action="store_true", help="処理の一覧を表示する")
+    args = parser.parse_args(argv)
+
+    # 進捗の行以外（ログ・進捗バー）は標準エラー出力へ
+    printer = ProgressPrinter(sys.stdout, args.format)
+    sys.stdout = sys.stderr
+    _log_to_stderr()
+
+    if args.list:
+        for key, value in main_process.process_def.items():
+            printer.emit(
+                "list", stage=key, name=value["name"], gui_only=key in GUI_ONLY
+            )
+        return EXIT_OK
+
+    if args.workers:
+        # 処理のモジュールは最初に使うときに読み込まれる（main_process.LazyModule）
+        main_process.upload_image.workers = max(1, args.workers)
+        main_process.upload_art.concurrency = max(1, args.workers)
+
+    first = args.first
+    resume = main_process.check_resume()
+    if resume:
+        printer.stage(resume["key"], resume["status"], resume["name"])
+        if args.resume == "abort":
+            logger.warning("中断された処理があるため終了します: %s", resume["name"])
+            return EXIT_RESUME
+        if args.resume == "continue":
+            logger.info("中断された処理から再開します: %s", resume["name"])
+            first = resume["key"]
+        else:
+            logger.info("中断された処理を破棄してやり直します")
+            stage_journal.reset_all()
+
+    try:
+        stages = stage_order(first, args.last)
+    except ValueError as e:
+        logger.error("%s", e)
+        return EXIT_FAILED
+
+    command_queue = queue.Queue()
+    result_queue = queue.Queue()
+    worker = threading.Thread(
+        target=main_process.main_process,
+        args=(command_queue, result_queue),
+        daemon=True,
+    )
+    worker.start()
+    exit_code = EXIT_OK
+    try:
+        for stage in stages:
+            status = run_stage(stage, command_queue, result_queue, worker, printer)
+            printer.stage(stage, status)
+            if status in (FAILED, main_process.CANCELLED):
+                exit_code = EXIT_FAILED
+                break
+            if not args.continue_on_warning and (
+                status == WARNING or printer.error_files[stage]
+            ):
+                logger.warning("警告があるため停止します: %s", stage)
+                exit_code = EXIT_FAILED
+                break
+    except KeyboardInterrupt:
+        logger.info("処理を中止しています（もう一度Ctrl+Cで強制終了）")
+        stage_control.cancel()
+        exit_code = EXIT_FAILED
+    finally:
+        command_queue.put(None)
+    try:
+        # 処理中のファイルを書き終えてから止まるのを待つ
+        worker.join()
+    except KeyboardInterrupt:
+        logger.warning("処理の終了を待たずに終了します")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""image_host.py
+画像のアップロード先（ホスト）
+upload_imageはここで選んだホストに画像を送り、返ってきたURLを画像URL台帳に登録する
+  manual  アップロードは手動（Bloggerのメディアマネージャー）。URLは保存したページから取り込む
+  local   フォルダにコピーし、base_url + パスをURLとする（自前のWebサーバー・テスト用）
+  http    HTTPで画像を送り、応答のJSONの"url"をURLとする
+"""
+import json
+import logging
+import mimetypes
+import shutil
+from abc import ABC, abstractmethod
+from pathlib import Path
+from urllib.parse import quote
+
+from parameter import config
+
+logger = logging.getLogger(__name__)
+
+# --- 設定 ---
+
+# 画像のアップロード先 (manual / local / http)
+host_name = config["upload_image"].get("host", "manual")
+# local: 画像のコピー先フォルダと公開URL（空欄ならfile:のURL）
+host_dir = config["upload_image"].get("host_dir", "./data/image_host")
+host_base_url = config["upload_image"].get("host_base_url", "")
+# http: 画像を送るURLと認証トークン
+host_endpoint = config["upload_image"].get("host_endpoint", "")
+host_token = config["upload_image"].get("host_token", "")
+# 応答を待つ秒数
+host_timeout = float(config["upload_image"].get("host_timeout", 60))
+
+
+def _resolve_host_name():
+    """使えるアップロード先の名前（不明・設定不足の場合は手動）"""
+    if host_name == "http" and not host_endpoint:
+        logger.warning(
+            "画像のアップロード先のURL (host_endpoint) が未設定です（手動にします）"
+        )
+        return "manual"
+    if host_name not in ("manual", "local", "http"):
+        logger.warning("不明な画像のアップロード先です: %s（手動にします）", host_name)
+        return "manual"
+    return host_name
+
+
+# 実際に使うアップロード先（upload_imageとmain_processの処理の流れはこれで決める）
+resolved_host_name = _resolve_host_name()
+
+
+def direct_upload():
+    """画像を直接アップロードするか（手動のメディアマネージャー操作が不要か）"""
+    return resolved_host_name != "manual"
+
+
+class ImageHostError(Exception):
+    """画像のアップロードに失敗した"""
+
+
+class ImageHost(ABC):
+    """画像のアップロード先"""
+
+    name = None
+
+    @abstractmethod
+    def upload(self, path, sha256=None):
+        """画像をアップロードしてURLを返す（失敗時はImageHostError）"""
+
+
+class LocalImageHost(ImageHost):
+    """フォルダにコピーする（同じ内容の画像は同じパスになる）"""
+
+    name = "local"
+
+    def __init__(self, dest_dir, base_url=""):
+        self.dest_dir = Path(dest_dir)
+        self.base_url = base_url
+
+    def upload(self, path, sha256=None):
+        # Pillowを読み込むため使うときに読み込む（main_processの起動時に読み込まない）
+        from image_index import file_sha256
+
+        sha256 = sha256 or file_sha256(path)
+        relative = f"{sha256[:16]}/{Path(path).name}"
+        dest_path = self.dest_dir / relative
+        try:
+            if not dest_path.exists():
+                dest_path.parent.mkdir(parents=True, exist_ok=True)
+                # 途中で止まっても壊れたファイルを残さないよう、コピーしてから名前を変える
+                temp_path = dest_path.with_name(dest_path.name + ".tmp")
+                shutil.copy2(path, temp_path)
+                temp_path.replace(dest_path)
+        except OSError as e:
+            raise ImageHostError(e) from e
+        if self.base_url:
+            return self.base_url.rstrip("/") + "/" + quote(relative)
+        return dest_path.resolve().as_uri()
+
+
+class HttpImageHost(ImageHost):
+    """HTTPのPOSTで画像を送る（応答: {"url": "..."}）"""
+
+    name = "http"
+
+    def __init__(self, endpoint, token="", timeout=60):
+        self.endpoint = endpoint
+        self.token = token
+        self.timeout = timeout
+
+    def upload(self, path, sha256=None):
+        import urllib.request  # httpのホストを使うときだけ読み込む
+
+        path = Path(path)
+        headers = {
+            "Content-Type": mimetypes.guess_type(path.name)[0]
+            or "application/octet-stream",
+            "Slug": quote(path.name),
+        }
+        if sha256:
+            headers["X-Content-SHA256"] = sha256
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        try:
+            request = urllib.request.Request(
+                self.endpoint, data=path.read_bytes(), headers=headers, method="POST"
+            )
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                url = json.load(response).get("url")
+        except (OSError, ValueError, AttributeError) as e:
+            # urllib.error.URLError/HTTPError、タイムアウトはOSErrorの一種
+            raise ImageHostError(e) from e
+        if not url:
+            raise ImageHostError(f"応答にURLがありません: {path.name}")
+        return url
+
+
+def get_host():
+    """設定の画像アップロード先を返す（手動の場合はNone）"""
+    if resolved_host_name == "local":
+        return LocalImageHost(host_dir, host_base_url)
+    if resolved_host_name == "http":
+        return HttpImageHost(host_endpoint, host_token, host_timeout)
+    return None
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""image_index.py
+Bloggerにアップロード済みの画像のURLとハッシュを記録するインデックス
+・メディアマネージャーの画像URL（実行をまたいで蓄積し、ファイル名と内容のハッシュで引く）
+・履歴フォルダに移動した画像のハッシュ（同じ画像を再度アップロードせずにURLを使い回す）
+完全一致はSHA-256、再保存などで少し変わった画像は差分ハッシュ(dHash)で判定する
+"""
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+from dir_index import get_index
+from file_class import FileKind
+from parameter import config
+
+logger = logging.getLogger(__name__)
+
+# --- 設定 ---
+
+# インデックスファイル
+index_file = config["image_index"]["index_file"]
+# 投稿済み画像のフォルダ
+history_dir = config["image_index"]["history_dir"].lstrip("./")
+# 同じ画像とみなす差分ハッシュのハミング距離（0で完全一致のみ）
+# 連写・トリミングした別の写真に既存のURLを使わないよう、既定は完全一致のみ
+max_distance = int(config["image_index"].get("max_distance", 0))
+
+# 差分ハッシュの縮小サイズ（横は1ピクセル多く取り、隣との明暗差を64ビットにする）
+HASH_SIZE = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    dhash TEXT,
+    url TEXT,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_sha256 ON images (sha256);
+CREATE TABLE IF NOT EXISTS media_urls (
+    url TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    sha256 TEXT,
+    imported INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_urls_name ON media_urls (name, sha256);
+CREATE TABLE IF NOT EXISTS media_dumps (
+    sha256 TEXT PRIMARY KEY,
+    name TEXT,
+    count INTEGER,
+    imported INTEGER NOT NULL
+);
+"""
+
+
+def file_sha256(path):
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dhash(path):
+    """画像の差分ハッシュ（64ビット）を返す。読み込めない場合はNone"""
+    try:
+        with Image.open(path) as image:
+            # アニメーションGIFは1フレーム目で判定する
+            small = image.convert("L").resize(
+                (HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS
+            )
+    except (IOError, OSError, ValueError) as e:
+        logger.warning("画像ハッシュ計算エラー: %s - %s", path, e)
+        return None
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value <<= 1
+            if pixels[offset + col] > pixels[offset + col + 1]:
+                value |= 1
+    return value
+
+
+def distance(a, b):
+    """2つのハッシュのハミング距離"""
+    return bin(a ^ b).count("1")
+
+
+class IndexDatabase:
+    """インデックスファイル（SQLite）への接続を共有する"""
+
+    def __init__(self):
+        self._conn = None
+        self.lock = threading.RLock()
+
+    def connect(self):
+        """接続を返す（初回はテーブルを作成する）"""
+        with self.lock:
+            if self._conn is None:
+                path = Path(index_file)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # ステージは別スレッドから呼ばれるため、接続の共有はロックで守る
+                self._conn = sqlite3.connect(str(path), check_same_thread=False)
+                self._conn.executescript(SCHEMA)
+            return self._conn
+
+    def connected(self):
+        """接続済みかどうか"""
+        return self._conn is not None
+
+    def close(self):
+        """インデックスを閉じる"""
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+database = IndexDatabase()
+
+
+class MediaUrlRegistry:
+    """メディアマネージャーから取り込んだ画像URLの台帳
+    同じファイル名のURLが複数ある場合は、リンクした画像の内容ハッシュで区別する
+    """
+
+    def import_urls(self, dump_path, pairs):
+        """メディアマネージャーのファイルから抽出した (ファイル名, URL) を追加する
+        取り込み済みのファイル（内容が同じもの）はpairsを読まずにスキップする
+        戻り値: 追加したURLの数（エラー時はNone）
+        """
+        try:
+            dump_sha256 = file_sha256(dump_path)
+            with database.lock:
+                conn = database.connect()
+                if conn.execute(
+                    "SELECT 1 FROM media_dumps WHERE sha256 = ?", (dump_sha256,)
+                ).fetchone():
+                    logger.info("取り込み済みのためスキップ: %s", Path(dump_path).name)
+                    return 0
+                imported = conn.execute(
+                    "SELECT COALESCE(MAX(imported), 0) + 1 FROM media_dumps"
+                ).fetchone()[0]
+                before = conn.total_changes
+                conn.executemany(
+                    "INSERT OR IGNORE INTO media_urls (url, name, imported)"
+                    " VALUES (?, ?, ?)",
+                    ((url, name, imported) for name, url in pairs),
+                )
+                added = conn.total_changes - before
+                conn.execute(
+                    "INSERT INTO media_dumps (sha256, name, count, imported)"
+                    " VALUES (?, ?, ?, ?)",
+                    (dump_sha256, Path(dump_path).name, added, imported),
+                )
+                conn.commit()
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logger.error(
+                "画像URLの取り込みエラー: %s - %s", dump_path, e, exc_info=True
+            )
+            # 途中まで追加したURLは取り消し、次回に取り込み直す
+            with database.lock:
+                if database.connected():
+                    database.connect().rollback()
+            return None
+        logger.info(
+            "画像URLを取り込みました: %s (追加 %d件)", Path(dump_path).name, added
+        )
+        return added
+
+    def lookup(self, name, path=None):
+        """ファイル名（とローカル画像の内容）からURLを返す（なければNone）
+        pathを指定した場合、内容ハッシュが一致するURLを優先し、
+        なければ未使用のURLのうち最後に取り込んだものを選んでハッシュを記録する
+        """
+        try:
+            sha256 = file_sha256(path) if path and Path(path).exists() else None
+            with database.lock:
+                conn = database.connect()
+                if sha256:
+                    row = conn.execute(
+                        "SELECT url FROM media_urls WHERE name = ? AND sha256 = ?",
+                        (name, sha256),
+                    ).fetchone()
+                    if row:
+                        return row[0]
+                    row = conn.execute(
+                        "SELECT url FROM media_urls WHERE name = ? AND sha256 IS NULL"
+                        " ORDER BY imported DESC LIMIT 1",
+                        (name,),
+                    ).fetchone()
+                    if row:
+                        conn.execute(
+                            "UPDATE media_urls SET sha256 = ? WHERE url = ?",
+                            (sha256, row[0]),
+                        )
+                        conn.commit()
+                        return row[0]
+                    return None
+                row = conn.execute(
+                    "SELECT url FROM media_urls WHERE name = ?"
+                    " ORDER BY imported DESC LIMIT 1",
+                    (name,),
+                ).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            logger.error("画像URLの検索エラー: %s - %s", name, e)
+            return None
+        return row[0] if row else None
+
+    def add(self, name, url, sha256):
+        """アップロードした画像のURLを内容ハッシュとともに登録する"""
+        try:
+            with database.lock:
+                conn = database.connect()
+                imported = conn.execute(
+                    "SELECT COALESCE(MAX(imported), 0) FROM media_urls"
+                ).fetchone()[0]
+                conn.execute(
+                    "INSERT OR REPLACE INTO media_urls (url, name, sha256, imported)"
+                    " VALUES (?, ?, ?, ?)",
+                    (url, name, sha256, imported),
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error("画像URLの登録エラー: %s - %s", name, e)
+            return False
+        return True
+
+    def find(self, name, sha256):
+        """ファイル名と内容ハッシュが一致するURLを返す（なければNone）"""
+        try:
+            with database.lock:
+                conn = database.connect()
+                row = conn.execute(
+                    "SELECT url FROM media_urls WHERE name = ? AND sha256 = ?",
+                    (name, sha256),
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error("画像URLの検索エラー: %s - %s", name, e)
+            return None
+        return row[0] if row else None
+
+    def items(self):
+        """登録されている (ファイル名, URL) を取り込み順に返す"""
+        try:
+            with database.lock:
+                conn = database.connect()
+                return conn.execute(
+                    "SELECT name, url FROM media_urls ORDER BY imported, name"
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error("画像URLの検索エラー: %s", e)
+            return []
+
+    def count(self):
+        """登録されているURLの数"""
+        try:
+            with database.lock:
+                conn = database.connect()
+                return conn.execute("SELECT COUNT(*) FROM media_urls").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error("画像URLの検索エラー: %s", e)
+            return 0
+
+
+media_url_registry = MediaUrlRegistry()
+
+
+class ImageIndexManager:
+    """投稿済み画像のハッシュとURLのインデックス"""
+
+    def __init__(self):
+        self._dhashes = None  # [(dhash, name, url)] URLがわかっている画像のみ
+
+    def load_index(self, url_list=None):
+        """履歴フォルダに増えた画像のハッシュを追加し、URLがわかれば記録する
+        url_list: {ファイル名: URL} （この実行でリンクしたもの）
+        """
+        url_list = url_list or {}
+        try:
+            with database.lock:
+                conn = database.connect()
+                known = {
+                    name: (size, mtime_ns, url)
+                    for name, size, mtime_ns, url in conn.execute(
+                        "SELECT name, size, mtime_ns, url FROM images"
+                    )
+                }
+                added = 0
+                # 直前に履歴へ移動した画像も登録するよう走査し直す
+                history_index = get_index(history_dir)
+                history_index.invalidate()
+                for history_file in history_index.files(FileKind.IMAGE):
+                    stat_result = history_file.stat()
+                    url = url_list.get(history_file.name)
+                    entry = known.get(history_file.name)
+                    if (
+                        entry
+                        and entry[0] == stat_result.st_size
+                        and entry[1] == stat_result.st_mtime_ns
+                    ):
+                        if url and entry[2] != url:
+                            conn.execute(
+                                "UPDATE images SET url = ? WHERE name = ?",
+                                (url, history_file.name),
+                            )
+                        continue
+                    self._add(conn, history_file, url or (entry and entry[2]))
+                    added += 1
+                # URLが不明な画像は、取り込み済みの画像URLからファイル名と内容で補う
+                conn.execute(
+                    "UPDATE images SET url = (SELECT m.url FROM media_urls m"
+                    " WHERE m.name = images.name"
+                    " AND (m.sha256 IS NULL OR m.sha256 = images.sha256)"
+                    " ORDER BY m.sha256 IS NULL, m.imported DESC LIMIT 1)"
+                    " WHERE url IS NULL"
+                )
+                conn.commit()
+                self._dhashes = None
+                count = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        except (sqlite3.Error, OSError) as e:
+            logger.error("画像インデックス更新エラー: %s", e, exc_info=True)
+            return False
+        logger.info("画像インデックス: %d件 (追加 %d件)", count, added)
+        return True
+
+    def _add(self, conn, path, url):
+        stat_result = Path(path).stat()
+        value = dhash(path)
+        conn.execute(
+            "INSERT OR REPLACE INTO images"
+            " (name, sha256, dhash, url, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                Path(path).name,
+                file_sha256(path),
+                None if value is None else f"{value:016x}",
+                url,
+                stat_result.st_size,
+                stat_result.st_mtime_ns,
+            ),
+        )
+
+    def add(self, path, url):
+        """履歴フォルダに移動した画像をURLとともに登録する"""
+        try:
+            with database.lock:
+                conn = database.connect()
+                self._add(conn, path, url)
+                conn.commit()
+                self._dhashes = None
+        except (sqlite3.Error, OSError) as e:
+            logger.error("画像インデックス登録エラー: %s - %s", path, e)
+            return False
+        return True
+
+    def find_url(self, path):
+        """アップロード済みの同じ画像があれば、そのURLを返す（なければNone）"""
+        try:
+            sha256 = file_sha256(path)
+            with database.lock:
+                conn = database.connect()
+                row = conn.execute(
+                    "SELECT name, url FROM images WHERE sha256 = ? AND url IS NOT NULL",
+                    (sha256,),
+                ).fetchone()
+                if row:
+                    logger.debug("同一画像: %s = %s", Path(path).name, row[0])
+                    return row[1]
+                if max_distance <= 0:
+                    return None
+                if self._dhashes is None:
+                    self._dhashes = [
+                        (int(value, 16), name, url)
+                        for name, value, url in conn.execute(
+                            "SELECT name, dhash, url FROM images"
+                            " WHERE dhash IS NOT NULL AND url IS NOT NULL"
+                        )
+                    ]
+                dhashes = self._dhashes
+        except (sqlite3.Error, OSError) as e:
+            logger.error("画像インデックス検索エラー: %s - %s", path, e)
+            return None
+
+        value = dhash(path)
+        if value is None:
+            return None
+        best = None
+        for other, name, url in dhashes:
+            dist = distance(value, other)
+            if dist <= max_distance and (best is None or dist < best[0]):
+                best = (dist, name, url)
+        if best:
+            # 別の写真の可能性があるため、使ったことがわかるように残す
+            logger.warning(
+                "類似画像のURLを使います: %s ≒ %s (距離 %d)",
+                Path(path).name,
+                best[1],
+                best[0],
+            )
+            return best[2]
+        return None
+
+
+image_index_manager = ImageIndexManager()
@@ -12,8 +12,10 @@ from pathlib import Path
 from bs4 import BeautifulSoup
 from PIL import Image
 
-from file_class import SmartFile
+from dir_index import get_index
+from file_class import FileKind, SmartFile
 from parameter import config, to_bool
+from stage_journal import StageJournal, stage_control
 
 logger = logging.getLogger(__name__)
 
@@ -32,8 +34,20 @@ html_extensions = config["common"]["html_extensions"]
 def run(queue_obj):
     """input_dirからファイルを検証してoutput_dirに移動する。画像はPILで開いて検証、HTMLはBeautifulSoupで解析して検証"""
     logger.info("ファイル取り込み開始: %s -> %s", input_dir, output_dir)
-    # workフォルダをクリーンアップしてから処理を開始する
-    shutil.rmtree(output_dir, ignore_errors=True)
+    journal = StageJournal("check_files")
+    if journal.committed:
+        # 中断・中止した取り込みの続き。移動済みのファイルはworkフォルダにあるため残す
+        for path, entry in journal.committed.items():
+            if Path(path).exists():
+                moved_file = SmartFile(path)
+                moved_file.kind = FileKind(entry["info"]["kind"])
+                moved_file.disp_path = Path(entry["info"]["disp_path"])
+                moved_file.status = "✓"
+                queue_obj.put(moved_file)
+    else:
+        # workフォルダをクリーンアップしてから処理を開始する
+        shutil.rmtree(output_dir, ignore_errors=True)
+    get_index(output_dir).invalidate()
 
     input_path = Path(input_dir)
     if not input_path.exists():
@@ -45,13 +59,25 @@ def run(queue_obj):
 
     if not files_to_process:
         logger.info("取り込み対象のファイルが見つかりません。")
+        journal.finish()
         return True
 
     for in_file in files_to_process:
+        stage_control.checkpoint()
         logger.info("Importing: %s", in_file)
         imported_file = import_file(in_file)
+        if imported_file.status == "✓":
+            # 移動済み（再実行時にworkフォルダから消さない）
+            journal.commit(
+                imported_file,
+                info={
+                    "kind": imported_file.kind.value,
+                    "disp_path": str(imported_file.disp_path),
+                },
+            )
         queue_obj.put(imported_file)
 
+    journal.finish()
     return True
 
 
@@ -71,14 +97,14 @@ def import_file(in_file_path: Path):
             try:
                 with Image.open(in_file_path) as img:
                     img.verify()
-                smart_file.extensions = "image"
+                smart_file.kind = FileKind.IMAGE
                 smart_file.status = "✓"
             except (IOError, OSError) as e:
                 logger.warning(
                     "警告: 画像ファイルとして開けません: %s - %s", in_file_path, e
                 )
                 smart_file.status = "✘"
-                smart_file.extensions = "other"
+                smart_file.kind = FileKind.OTHER
                 return smart_file
         elif smart_file.suffix.lower() in html_extensions:
             try:
@@ -92,18 +118,18 @@ def import_file(in_file_path: Path):
                 if content is None:
                     raise ValueError("適切なエンコーディングが見つかりません。")
                 BeautifulSoup(content, "html.parser")
-                smart_file.extensions = "html"
+                smart_file.kind = FileKind.HTML
                 smart_file.status = "✓"
             except (IOError, OSError, ValueError) as e:
                 logger.warning(
                     "警告: HTMLファイルとして解析できません: %s - %s", in_file_path, e
                 )
                 smart_file.status = "✘"
-                smart_file.extensions = "other"
+                smart_file.kind = FileKind.OTHER
                 return smart_file
         else:
             smart_file.status = "✘"
-            smart_file.extensions = "other"
+            smart_file.kind = FileKind.OTHER
             logger.warning(
                 "警告: 対応していない拡張子のため取り込みスキップ: %s",
                 smart_file.disp_path,
@@ -147,7 +173,7 @@ def import_file(in_file_path: Path):
         # 4. 移動後のパスで新しいSmartFileオブジェクトを作成して返す
         final_smart_file = SmartFile(moved_path)
         final_smart_file.status = smart_file.status
-        final_smart_file.extensions = smart_file.extensions
+        final_smart_file.kind = smart_file.kind
         final_smart_file.disp_path = smart_file.disp_path
         return final_smart_file
 
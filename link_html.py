@@ -7,13 +7,18 @@ import logging
 import queue
 import re
 import shutil
+from html.parser import HTMLParser
 from pathlib import Path
 from urllib.parse import unquote
 
-from bs4 import BeautifulSoup
+from bs4.builder import HTMLTreeBuilder
 
-from file_class import SmartFile
+from dir_index import get_index
+from file_class import FileKind, SmartFile, write_text_atomic
+from image_index import image_index_manager, media_url_registry
+from mhtml_reader import iter_matches
 from parameter import config
+from stage_journal import StageJournal, stage_control
 
 logger = logging.getLogger(__name__)
 # --- 設定 ---
@@ -30,10 +35,20 @@ media_manager_dir = config["link_html"]["media_manager_dir"].lstrip("./")
 image_extensions = config["common"]["image_extensions"]
 # html拡張子
 html_extensions = config["common"]["html_extensions"]
-# イメージリストファイル
-link_list_file = config["link_html"]["link_list_file"]
+# イメージリストファイル（確認用）
 link_list_file_html = config["link_html"]["link_list_file_html"]
 
+# ローカル画像（http(s)://で始まらないsrc）の画像タグがありそうかを調べる事前チェック
+# 引用符の後（引用符なしの値はその先頭）でURLかどうかを判定する
+LOCAL_IMG_SRC = re.compile(
+    r"""<img\b[^>]*?\ssrc\s*=\s*"""
+    r"""(?:"(?!\s*https?://)|'(?!\s*https?://)|(?!["'\s>]|https?://))""",
+    re.IGNORECASE,
+)
+# 画像タグ内のsrc属性
+SRC_ATTR = re.compile(r"""(\ssrc\s*=\s*)(?:"[^"]*"|'[^']*'|[^\s"'>]+)""", re.IGNORECASE)
+VOID_TAGS = HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS
+
 
 class ImageLinkManager:
     """HTMLファイル内の画像リンクを管理するクラス"""
@@ -41,6 +56,7 @@ class ImageLinkManager:
     def __init__(self):
         self.unlink_image_list = []
         self.link_image_list = []
+        self.url_list = {}  # リンクした画像の {ファイル名: URL}
 
 
 image_link_manager = ImageLinkManager()
@@ -53,143 +69,153 @@ def run(queue_obj):
     if not import_media_manager():
         return False
     logger.info("HTMLファイル内の画像リンクをアップロード先に書き換える")
+    journal = StageJournal("link_html")
     unlink_image_list, link_image_list = link_html(
         queue_obj,
         image_link_manager.unlink_image_list,
         image_link_manager.link_image_list,
+        journal,
     )
     if not (isinstance(unlink_image_list, list) and isinstance(link_image_list, list)):
         return False
     logger.info("HTML内の画像リンクを履歴フォルダに移動する")
     if not history(queue_obj, unlink_image_list, link_image_list):
         return False
+    # 画像の履歴移動まで終わってからジャーナルを閉じる
+    journal.finish()
     if len(unlink_image_list) > 0:
         return unlink_image_list
     return True
 
 
 def import_media_manager():
-    """メディアマネージャーファイルを読み込む"""
+    """メディアマネージャーファイルの画像URLを画像URL台帳に取り込む"""
 
-    media_manager_files = list(Path(media_manager_dir).glob("*.*"))
-    if len(media_manager_files) > 1:
-        logger.error("エラー: %s に複数のファイルが見つかりました", media_manager_dir)
-        return False
-    elif len(media_manager_files) == 0:
+    media_manager_files = sorted(Path(media_manager_dir).glob("*.*"))
+    if not media_manager_files:
+        if media_url_registry.count():
+            logger.info(
+                "新しいメディアマネージャーファイルはありません。取り込み済みの画像URLを使用します。"
+            )
+            return True
         logger.error(
             "メディアマネージャーファイルが見つかりません (検索対象: %s/*.*)",
             media_manager_dir,
         )
         return False
 
-    media_manager_filename = media_manager_files[0]
-    try:
-        with open(
-            media_manager_filename, "rb"
-        ) as file:  # Read as binary for MHTML parsing
-            content_bytes = file.read()
-    except IOError as e:
-        logger.error(
-            "メディアマネージャーファイルの読み込みに失敗: %s", e, exc_info=True
+    # 複数のファイルはまとめて取り込む（取り込み済みのファイルは読み直さない）
+    for media_manager_filename in media_manager_files:
+        logger.info(
+            "メディアマネージャーファイルからBloggerの画像URLを抽出する: %s",
+            media_manager_filename.name,
         )
-        return False
-
-    logger.info("メディアマネージャーファイルからBloggerの画像URLを抽出する")
-    image_url_list = {}
-    pattern = re.compile(r'(https?://blogger\.googleusercontent\.com/[^"\'\s<>]+)')
-    # テキストとして読み込んで正規表現で抽出 (MHTMLもテキストとして処理)
-    try:
-        content_str = content_bytes.decode("utf-8", errors="ignore")
+        added = media_url_registry.import_urls(
+            media_manager_filename, extract_media_urls(media_manager_filename)
+        )
+        if added is None:
+            return False
 
-        # MHTML等のQuoted-Printable対策: ソフト改行(=改行)を除去
-        content_unfolded = content_str.replace("=\n", "").replace("=\r\n", "")
+    write_link_list_html()
+    logger.info("画像URL台帳: %d件", media_url_registry.count())
+    return True
 
-        # HTMLエンティティをデコード
-        content_unfolded = html.unescape(content_unfolded)
 
-        for match in pattern.finditer(content_unfolded):
+def extract_media_urls(media_manager_filename):
+    """メディアマネージャーファイルから (ファイル名, URL) を順に返す
+    MHTMLのQuoted-Printable・HTMLエンティティを戻しながら1回の走査で抽出する
+    読み込みエラーは取り込み側（media_url_registry.import_urls）で扱う
+    """
+    pattern = re.compile(r'(https?://blogger\.googleusercontent\.com/[^"\'\s<>]+)')
+    with open(media_manager_filename, "rb") as file:
+        for match in iter_matches(file, pattern):
             url = match.group(1)
             filename = unquote(url.split("/")[-1].split("?")[0])
-            if filename not in image_url_list and filename.lower().endswith(
-                tuple(image_extensions)
-            ):
-                image_url_list[filename] = url
-    except (UnicodeDecodeError, AttributeError, ValueError) as e:
-        logger.error("テキスト解析中にエラーが発生しました: %s", e, exc_info=True)
-
-    # フォルダがなければ作成
-    link_list_file_path = Path(link_list_file)
-    link_list_file_path.parent.mkdir(parents=True, exist_ok=True)
-    link_list_file_html_path = Path(link_list_file_html)
-    link_list_file_html_path.parent.mkdir(parents=True, exist_ok=True)
+            if filename.lower().endswith(tuple(image_extensions)):
+                yield filename, url
 
-    with open(link_list_file, "w", encoding="utf-8") as file, open(
-        link_list_file_html,
-        "w",
-        encoding="utf-8",  # link_list_file_htmlは確認用（なくても問題ない）
-    ) as fh:
-        fh.write("<html><body><h2>画像アップロードリスト</h2><ul>\n")
-        for filename, url in image_url_list.items():
-            file.write(f"{filename} : {url}\n")
-            fh.write(
-                f'<li>{filename} : <a href="{url}" target="_blank">{url}</a></li>\n'
-            )
-        fh.write("</ul></body></html>\n")
 
-    logger.info("イメージリストを %s 完了", link_list_file)
-    return True
+def write_link_list_html():
+    """確認用に画像URL台帳をHTMLに書き出す（なくても問題ない）"""
+    link_list_file_html_path = Path(link_list_file_html)
+    link_list_file_html_path.parent.mkdir(parents=True, exist_ok=True)
+    lines = ["<html><body><h2>画像アップロードリスト</h2><ul>\n"]
+    for filename, url in media_url_registry.items():
+        lines.append(
+            f'<li>{html.escape(filename)} : <a href="{html.escape(url)}" target="_blank">'
+            f"{html.escape(url)}</a></li>\n"
+        )
+    lines.append("</ul></body></html>\n")
+    try:
+        write_text_atomic(link_list_file_html_path, "".join(lines), encoding="utf-8")
+    except OSError as e:
+        logger.warning("画像アップロードリストの書き出しに失敗: %s", e)
 
 
-def link_html(queue_object, unlink_image_list, link_image_list):
+def link_html(queue_object, unlink_image_list, link_image_list, journal):
     """HTMLファイル内の画像リンクをアップロード先に書き換える"""
 
-    media_manager_link_list = {}
-    with open(link_list_file, "r", encoding="utf-8") as file:
-        for line in file:
-            filename, url = line.strip().split(" : ", 1)
-            media_manager_link_list[filename] = url
-            logger.debug("読み込み: %s -> %s", filename, url)
-
-    for file_path in Path(input_dir).rglob("*"):
-        # ファイルであり、かつ拡張子が指定のものに含まれるかチェック
-        if file_path.is_file() and file_path.suffix.lower() in html_extensions:
-
-            in_html_unlink_image_list = []
-            in_html_link_image_list = []
-            with open(file_path, "r", encoding="utf-8") as file:
-                html_content = file.read()
-
-            soup = BeautifulSoup(html_content, "html.parser")
-            # この記事に含まれるローカル画像タグをすべて見つける
-            local_img_tags = [
-                img
-                for img in soup.find_all("img")
-                if img.get("src")
-                and not img.get("src").startswith(("http://", "https://"))
+    # 以前アップロードした画像のURLを使い回すためのインデックス
+    use_index = image_index_manager.load_index()
+
+    work_index = get_index(input_dir)
+    for file_path in work_index.files(FileKind.HTML):
+        stage_control.checkpoint()
+        if journal.is_committed(file_path):
+            # 前回中断前に書き換え済み。リンク結果はジャーナルから復元する
+            linked = journal.info(file_path)
+            in_html_link_image_list = [
+                _image_smart_file(name, "✔") for name in linked["link"]
             ]
-
-            # html内の画像パスを置換
-            for img_tag in local_img_tags:
-                img_filename = Path(img_tag.get("src")).name
-                # blogger_url = unlink_list[img_filename]
-                blogger_url = media_manager_link_list.get(img_filename)
-                sf = SmartFile(img_filename)
-                sf.disp_path = img_filename
-                sf.extensions = "image"
+            in_html_unlink_image_list = [
+                _image_smart_file(name, "✖") for name in linked["unlink"]
+            ]
+            _put_html_status(queue_object, file_path, in_html_unlink_image_list)
+            unlink_image_list.extend(in_html_unlink_image_list)
+            link_image_list.extend(in_html_link_image_list)
+            continue
+
+        in_html_unlink_image_list = []
+        in_html_link_image_list = []
+        with open(file_path, "r", encoding="utf-8") as file:
+            html_content = file.read()
+
+        patches = []
+        # ローカル画像がない（リンク済みの）記事は解析しない
+        if LOCAL_IMG_SRC.search(html_content):
+            # この記事に含まれるローカル画像タグをすべて見つける
+            for start, tag_text, src, in_link in _scan_images(html_content):
+                if src.startswith(("http://", "https://")):
+                    continue
+                img_filename = Path(src).name
+                local_path = Path(input_dir) / img_filename
+                # 同じファイル名のURLが複数あれば、画像の内容で区別する
+                blogger_url = media_url_registry.lookup(img_filename, local_path)
+                if not blogger_url and use_index and local_path.exists():
+                    # upload_imageでアップロード済みとしてスキップした画像
+                    blogger_url = image_index_manager.find_url(local_path)
+                    if blogger_url:
+                        logger.info(
+                            "  -> アップロード済みの画像を使用: %s", img_filename
+                        )
                 if blogger_url:
-                    sf.status = "✔"
-                    in_html_link_image_list.append(sf)
+                    image_link_manager.url_list[img_filename] = blogger_url
+                    in_html_link_image_list.append(_image_smart_file(img_filename, "✔"))
                 else:
-                    sf.status = "✖"
-                    in_html_unlink_image_list.append(sf)
+                    in_html_unlink_image_list.append(
+                        _image_smart_file(img_filename, "✖")
+                    )
                 if not blogger_url:
                     continue
-                img_tag["src"] = blogger_url
+                # html内の画像パスを置換（タグの範囲だけを書き換える）
+                quoted_url = html.escape(blogger_url)
+                new_tag = SRC_ATTR.sub(
+                    lambda m, u=quoted_url: f'{m.group(1)}"{u}"', tag_text, count=1
+                )
                 # 画像をリンクで囲む (Lightbox用)
-                parent = img_tag.parent
-                if parent.name != "a":
-                    new_a = soup.new_tag("a", href=blogger_url)
-                    img_tag.wrap(new_a)
+                if not in_link:
+                    new_tag = f'<a href="{quoted_url}">{new_tag}</a>'
+                patches.append((start, start + len(tag_text), new_tag))
 
                 logger.debug(
                     '  -> 画像リンク生成: <a href="%s"><img src="%s"></a>',
@@ -197,36 +223,126 @@ def link_html(queue_object, unlink_image_list, link_image_list):
                     blogger_url,
                 )
                 logger.info("  -> 画像パス置換: %s", img_filename)
-            # 変更を保存
-            with open(file_path, "w", encoding="utf-8") as file:
-                file.write(str(soup))
-            sf = SmartFile(file_path.name)
-            sf.disp_path = file_path.name
-            if in_html_unlink_image_list:
-                sf.status = "✖"
-            else:
-                sf.status = "✔"
-            sf.extensions = "html"
-            queue_object.put(sf)
+
+        # 変更があった場合だけ保存
+        if patches:
+            write_text_atomic(
+                file_path, _apply_patches(html_content, patches), encoding="utf-8"
+            )
+            work_index.update(file_path)
             logger.info("HTMLファイルを更新しました: %s", file_path.name)
-            if in_html_unlink_image_list:
-                unlink_image_list.extend(in_html_unlink_image_list)
-            if in_html_link_image_list:
-                link_image_list.extend(in_html_link_image_list)
+        journal.commit(
+            file_path,
+            info={
+                "link": [sf.name for sf in in_html_link_image_list],
+                "unlink": [sf.name for sf in in_html_unlink_image_list],
+            },
+        )
+        _put_html_status(queue_object, file_path, in_html_unlink_image_list)
+        if in_html_unlink_image_list:
+            unlink_image_list.extend(in_html_unlink_image_list)
+        if in_html_link_image_list:
+            link_image_list.extend(in_html_link_image_list)
     return unlink_image_list, link_image_list
 
 
+class _ImageTagScanner(HTMLParser):
+    """画像タグの位置・タグ文字列・src、リンクの中にあるかを集める"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.images = []
+        self._open_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "img":
+            self._add_image(attrs)
+        elif tag not in VOID_TAGS:
+            self._open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "img":
+            self._add_image(attrs)
+
+    def handle_endtag(self, tag):
+        if tag in self._open_tags:
+            while self._open_tags.pop() != tag:
+                pass
+
+    def _add_image(self, attrs):
+        src = dict(attrs).get("src")
+        if src:
+            in_link = bool(self._open_tags) and self._open_tags[-1] == "a"
+            self.images.append((self.getpos(), self.get_starttag_text(), src, in_link))
+
+
+def _scan_images(html_content):
+    """記事内の画像タグを (開始位置, タグ文字列, src, リンクの中か) で返す"""
+    scanner = _ImageTagScanner()
+    scanner.feed(html_content)
+    scanner.close()
+    # 行・列の位置を文字列の位置に変換する
+    line_starts = [0]
+    for match in re.finditer("\n", html_content):
+        line_starts.append(match.end())
+    images = []
+    for (lineno, offset), tag_text, src, in_link in scanner.images:
+        start = line_starts[lineno - 1] + offset
+        if html_content.startswith(tag_text, start):
+            images.append((start, tag_text, src, in_link))
+        else:
+            logger.warning("画像タグの位置を特定できません: %s", tag_text)
+    return images
+
+
+def _apply_patches(html_content, patches):
+    """(開始, 終了, 置換文字列) の順に並んだ範囲を置き換える"""
+    pieces = []
+    position = 0
+    for start, end, text in patches:
+        pieces.append(html_content[position:start])
+        pieces.append(text)
+        position = end
+    pieces.append(html_content[position:])
+    return "".join(pieces)
+
+
+def _image_smart_file(img_filename, status):
+    """記事内の画像のリンク状態を表すSmartFileを作成する"""
+    sf = SmartFile(img_filename)
+    sf.disp_path = img_filename
+    sf.kind = FileKind.IMAGE
+    sf.status = status
+    return sf
+
+
+def _put_html_status(queue_object, file_path, in_html_unlink_image_list):
+    """記事のリンク結果をGUIに通知する"""
+    sf = SmartFile(file_path.name)
+    sf.disp_path = file_path.name
+    if in_html_unlink_image_list:
+        sf.status = "✖"
+    else:
+        sf.status = "✔"
+    sf.kind = FileKind.HTML
+    queue_object.put(sf)
+
+
 def history(queue_object, unlink_image_list, link_image_list):
     """手動アップロード用に画像を準備する"""
-    # 重複排除とソート
-    unlink_image_list = list(set(unlink_image_list))
-    link_image_list = list(set(link_image_list))
+    # 重複排除とソート（SmartFileは同じパスでも別のオブジェクトのため、パスで重複を除く）
+    unlink_image_list = sorted(
+        {str(sf): sf for sf in unlink_image_list}.values(), key=str
+    )
+    link_image_list = sorted({str(sf): sf for sf in link_image_list}.values(), key=str)
+    link_image_names = {sf.name for sf in link_image_list}
 
     if upload_dir == history_dir:
         logger.error(
             "エラー: UPLOAD_DIR と HISTORY_DIR が同じフォルダに設定されています。異なるフォルダを指定してください。"
         )
         return False
+    Path(history_dir).mkdir(parents=True, exist_ok=True)
     # メディアマネージャー内の画像アンリンクを収集
     for sf in unlink_image_list:
         file_path = Path(input_dir) / sf.name  # GUIに表示はinput(work)ココ
@@ -234,10 +350,10 @@ def history(queue_object, unlink_image_list, link_image_list):
             file_path
         )  # Link画像は履歴移動後にアップロードされるため、ここではSmartFileを作成しない
         smart_file.status = "✖"
-        smart_file.extensions = "image"
+        smart_file.kind = FileKind.IMAGE
         smart_file.disp_path = smart_file.name
         queue_object.put(smart_file)
-        if sf.name in link_image_list:
+        if sf.name in link_image_names:
             logger.error(
                 "画像リンクの状態が矛盾しています: %s はリンクありとなし両方に存在します。",
                 sf.name,
@@ -256,17 +372,21 @@ def history(queue_object, unlink_image_list, link_image_list):
             file_path.exists()
         ):  # アップロード前にファイルが存在する場合は移動する（もう履歴済みはない）
             shutil.move(file_path, dest_path)
+            get_index(upload_dir).remove(file_path)
+            get_index(history_dir).update(dest_path)
         # GUI用
         file_path = Path(input_dir) / sf.name  # GUIに表示はinput(work)ココ
         smart_file = SmartFile(
             file_path
         )  # Link画像は履歴移動後にアップロードされるため、ここではSmartFileを作成しない
         smart_file.status = "✔"
-        smart_file.extensions = "image"
+        smart_file.kind = FileKind.IMAGE
         smart_file.disp_path = smart_file.name
         queue_object.put(smart_file)
         count += 1
     logger.info("%d 枚の画像を %s に移動しました。", count, history_dir)
+    # 履歴に移動した画像をURLとともにインデックスに登録する
+    image_index_manager.load_index(image_link_manager.url_list)
     # unlink_image_list link_image_list両方にないものはどうでも良いファイルと判断して無視する
     return True
 
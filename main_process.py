@@ -2,6 +2,7 @@
 """main_process.py
 メインプロセスの管理モジュール
 """
+import importlib
 import logging
 import logging.config
 import queue
@@ -10,25 +11,218 @@ from logging import getLogger
 
 from json5 import load
 
-import clean_html
-import find_date
-import find_keyword
-import find_location
+import image_host
+import parameter
+import stage_journal
+from file_class import SmartFile
+from stage_journal import StageCancelled, stage_control
 
-# 既存モジュールのインポート
-import import_file
-import import_media_manager
-import link_html
-import mod_image
-import serial_file
-import upload_art
-import upload_image
+
+class LazyModule:
+    """最初に属性を使うときに読み込むモジュール
+    各処理のモジュールはBeautifulSoup・geopy・janome・Google APIなどを読み込むため、
+    起動時にはまとめて読み込まず、その処理を初めて実行するときに読み込む
+    各処理は読み込み時に設定をモジュールの変数に写すため、設定（parameter.config）が
+    置き換わっていれば読み込み直す（コマンドラインで上書きした値は引き継ぐ）
+    """
+
+    def __init__(self, name):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+        object.__setattr__(self, "_config", None)
+        object.__setattr__(self, "_overrides", {})
+
+    def _load(self):
+        if self._module is None:
+            # 読み込み済みならimportlibはsys.modulesのものを返す
+            object.__setattr__(self, "_module", importlib.import_module(self._name))
+        elif self._config is not parameter.config:
+            logger.info("新しい設定で読み込み直します: %s", self._name)
+            importlib.reload(self._module)
+            for attr, value in self._overrides.items():
+                setattr(self._module, attr, value)
+        object.__setattr__(self, "_config", parameter.config)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        self._overrides[attr] = value
+        setattr(self._load(), attr, value)
+
+
+def refresh_config():
+    """config.json5 が更新されていれば読み直し、設定のスナップショットを返す
+    各処理のモジュールは次に使うときに新しい設定で読み込み直される（アプリの再起動は不要）
+    ただし認証・台帳・画像のアップロード先などの共通モジュールの設定は再起動まで変わらない
+    """
+    try:
+        snapshot = parameter.config_loader.load()
+    except (OSError, ValueError) as e:
+        logger.error("設定ファイルの読み込みに失敗しました。前の設定で続けます: %s", e)
+        return parameter.config
+    if snapshot is not parameter.config:
+        logger.info("設定ファイルの変更を反映します")
+        parameter.config = snapshot
+    return snapshot
+
+
+# 各処理のモジュール（最初に使うときに読み込む）
+clean_html = LazyModule("clean_html")
+find_date = LazyModule("find_date")
+find_duplicate = LazyModule("find_duplicate")
+find_keyword = LazyModule("find_keyword")
+find_location = LazyModule("find_location")
+import_file = LazyModule("import_file")
+import_media_manager = LazyModule("import_media_manager")
+link_html = LazyModule("link_html")
+mod_image = LazyModule("mod_image")
+serial_file = LazyModule("serial_file")
+upload_art = LazyModule("upload_art")
+upload_image = LazyModule("upload_image")
 
 # logging設定
 with open("./data/log_config.json5", "r", encoding="utf-8") as f:
     logging.config.dictConfig(load(f))
 logger = getLogger(__name__)
 
+# 並行実行中の処理の状態（GUIの表示用。処理の完了とはみなさない）
+RUNNING = "▶"
+# 中止した処理の状態（確定済みのファイルはジャーナルに残り、次回は続きから実行する）
+CANCELLED = "⏹"
+
+
+class _StageQueue:
+    """処理ごとのエラーファイル数を数えながら、結果キューに中継する
+    並行して実行した処理の結果を区別できるよう、ファイルに処理の名前（stage）を付ける
+    """
+
+    def __init__(self, result_queue, key):
+        self.result_queue = result_queue
+        self.key = key
+        self.error_files = 0
+
+    def put(self, item, *args, **kwargs):
+        if isinstance(item, SmartFile):
+            item.stage = self.key
+            if item.iserror():
+                self.error_files += 1
+        self.result_queue.put(item, *args, **kwargs)
+
+
+class StageScheduler:
+    """process_defのinputs/outputsから処理の依存関係を作り、独立した処理を並行して実行する
+    コマンドを受けた処理から、自動で続けて実行される処理（autonext）のうち
+    inputs/outputsを宣言したものをまとめて実行する。先に終わった処理の結果は保持し、
+    GUI・コマンドラインからその処理のコマンドが届いたときにすぐ返す
+    エラーファイルが出た処理や失敗した処理の後続は実行せず、確認後のコマンドを待つ
+    """
+
+    def __init__(self, runners):
+        self.runners = runners
+        self._results = {}  # 先に実行した処理の結果 {処理: 結果}
+
+    def clear(self):
+        """保持している結果を捨てる（処理の流れが変わったとき）"""
+        self._results.clear()
+
+    def stages(self, first):
+        """firstとまとめて実行する処理（parallel_stagesがfalseならfirstだけ）"""
+        keys = [first]
+        if not parameter.to_bool(
+            parameter.config["common"].get("parallel_stages", "true")
+        ):
+            return keys
+        key = first
+        while process_def[key]["autonext"]:
+            key = process_def[key]["nextprocess"]
+            if key not in self.runners or "inputs" not in process_def[key]:
+                break
+            if key in keys:
+                break
+            if key not in self._results:
+                keys.append(key)
+        return keys
+
+    @staticmethod
+    def depends(earlier, later):
+        """laterがearlierの完了を待つ必要があるか
+        earlierが書き込むものをlaterが読み書きする、またはearlierが読むものをlaterが書き込む場合
+        """
+        before, after = process_def[earlier], process_def[later]
+        return bool(
+            set(before["outputs"]) & set(after["inputs"] + after["outputs"])
+            or set(before["inputs"]) & set(after["outputs"])
+        )
+
+    def _execute(self, key, result_queue):
+        """1つの処理を実行し、(結果, 後続を実行してよいか) を返す"""
+        logger.info(process_def[key]["name"])
+        stage_queue = _StageQueue(result_queue, key)
+        try:
+            self.runners[key].run(stage_queue)
+        except StageCancelled:
+            logger.warning("中止しました: %s", process_def[key]["name"])
+            process_def[key]["status"] = CANCELLED
+            return process_def[key], False
+        except (ValueError, TypeError, AttributeError, KeyError) as e:
+            logger.error("エラー: プロセスエラー: %s", e, exc_info=True)
+            return f"Error processing data: {e}", False
+        process_def[key]["status"] = "✔"
+        return process_def[key], not stage_queue.error_files
+
+    def run(self, command, result_queue):
+        """処理を実行し、結果キューにcommandの結果を送る"""
+        if command in self._results:
+            logger.info("%s (並行して実行済み)", process_def[command]["name"])
+            result_queue.put(self._results.pop(command))
+            return
+        keys = self.stages(command)
+        if len(keys) == 1:
+            result_queue.put(self._execute(command, result_queue)[0])
+            return
+        deps = {
+            key: [earlier for earlier in keys[:i] if self.depends(earlier, key)]
+            for i, key in enumerate(keys)
+        }
+        logger.info("並行して実行します: %s", ", ".join(keys))
+        finished = {key: threading.Event() for key in keys}
+        can_continue = {}
+        unexpected = []
+
+        def worker(key):
+            try:
+                for earlier in deps[key]:
+                    finished[earlier].wait()
+                if not all(can_continue.get(earlier) for earlier in deps[key]):
+                    logger.info("前の処理の確認が必要なため保留します: %s", key)
+                    can_continue[key] = False
+                    return
+                if key != command:
+                    result_queue.put(dict(process_def[key], status=RUNNING))
+                result, can_continue[key] = self._execute(key, result_queue)
+                if key == command:
+                    result_queue.put(result)
+                elif result is not process_def[key] or result["status"] != CANCELLED:
+                    # 中止した処理は保持せず、次のコマンドで続きから実行する
+                    self._results[key] = result
+            except Exception as e:  # pylint: disable=broad-except
+                # 順に実行した場合と同じく、main_processのスレッドに例外を返す
+                unexpected.append(e)
+            finally:
+                finished[key].set()
+
+        threads = [
+            threading.Thread(target=worker, args=(key,), daemon=True) for key in keys
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if unexpected:
+            raise unexpected[0]
+
 
 def main_process(command_queue, result_queue):
     """コマンドキューから処理コマンドを受け取り、対応する処理を実行して結果キューにステータスを送る"""
@@ -37,6 +231,13 @@ def main_process(command_queue, result_queue):
             command = command_queue.get(timeout=1)  # Wait for data
             if command is None:  # Exit signal
                 break
+            # 設定ファイルが編集されていれば、この処理から新しい設定を使う
+            refresh_config()
+            # 前の処理への中止の要求は、これから実行する処理には使わない
+            stage_control.reset()
+            if command not in scheduler.runners:
+                # 処理の流れが変わったため、先に実行した処理の結果は使わない
+                scheduler.clear()
             # Process the data (example: square the number)
             if command == "initial_process":
                 # ここで初期処理を行う（処理一覧送信など）
@@ -65,38 +266,12 @@ def main_process(command_queue, result_queue):
                 logger.info(process_def[command]["name"])
                 import_file.run(result_queue)
                 upload_image.rm()  # アップロード用一時フォルダをクリーンアップ
+                stage_journal.reset_all()  # 前回バッチのジャーナルを破棄
                 process_def[command]["status"] = "✔"
                 result_queue.put(process_def[command])
-            if command == "serialize_files":
-                logger.info(process_def[command]["name"])
-                serial_file.run(result_queue)
-                process_def[command]["status"] = "✔"
-                result_queue.put(process_def[command])
-            if command == "clean_html":
-                logger.info(process_def[command]["name"])
-                clean_html.run(result_queue)
-                process_def[command]["status"] = "✔"
-                result_queue.put(process_def[command])
-            if command == "find_keyword":
-                logger.info(process_def[command]["name"])
-                find_keyword.run(result_queue)
-                process_def[command]["status"] = "✔"
-                result_queue.put(process_def[command])
-            if command == "find_location":
-                logger.info(process_def[command]["name"])
-                find_location.run(result_queue)
-                process_def[command]["status"] = "✔"
-                result_queue.put(process_def[command])
-            if command == "find_date":
-                logger.info(process_def[command]["name"])
-                find_date.run(result_queue)
-                process_def[command]["status"] = "✔"
-                result_queue.put(process_def[command])
-            if command == "mod_image":
-                logger.info(process_def[command]["name"])
-                mod_image.run(result_queue)
-                process_def[command]["status"] = "✔"
-                result_queue.put(process_def[command])
+            if command in scheduler.runners:
+                # 入出力が重ならない処理は並行して実行する（StageScheduler）
+                scheduler.run(command, result_queue)
             if command == "upload_image":
                 logger.info(process_def[command]["name"])
                 upload_image.run(result_queue)
@@ -149,6 +324,10 @@ def main_process(command_queue, result_queue):
             # result_queue.put(result)
         except queue.Empty:
             continue
+        except StageCancelled:
+            logger.warning("中止しました: %s", process_def[command]["name"])
+            process_def[command]["status"] = CANCELLED
+            result_queue.put(process_def[command])
         except (ValueError, TypeError, AttributeError, KeyError) as e:
             result_queue.put(f"Error processing data: {e}")
             logger.error("エラー: プロセスエラー: %s", e, exc_info=True)
@@ -162,6 +341,11 @@ def check_resume():
     if "upload_art" in process_def and upload_art.is_resume():
         process_def["upload_art"]["status"] = "🔁"
         return process_def["upload_art"]
+    # 途中で中断されたステージ（ジャーナルが残っている）
+    for key, value in process_def.items():
+        if stage_journal.is_pending(key):
+            value["status"] = "🔁"
+            return value
     return None
 
 
@@ -173,6 +357,11 @@ def start_thread():
     return q, thread
 
 
+# 処理の定義
+# inputs/outputs: 処理が読む・書き込むファイルの種類（html: 記事 / image: 画像）
+# 宣言した処理は、入出力が重ならなければStageSchedulerが並行して実行する
+# 記事を加工する処理は、前の処理が付けたタグを読むため（地点は<search>の語から探し、
+# 日付は地点の後の本文から探す）、互いに並行させず順に実行する
 process_def = {
     "initial_process": {
         "key": "initial_process",
@@ -210,13 +399,26 @@ process_def = {
         "status": "⌛",
         "nextprocess": "clean_html",
         "autonext": True,
+        "inputs": ("html", "image"),
+        "outputs": ("html", "image"),
     },
     "clean_html": {
         "key": "clean_html",
         "name": "タグ除去・メタデータ抽出",
         "status": "⌛",
+        "nextprocess": "find_duplicate",
+        "autonext": True,
+        "inputs": ("html",),
+        "outputs": ("html",),
+    },
+    "find_duplicate": {
+        "key": "find_duplicate",
+        "name": "重複記事チェック",
+        "status": "⌛",
         "nextprocess": "find_keyword",
         "autonext": True,
+        "inputs": ("html",),
+        "outputs": ("html",),
     },
     "find_keyword": {
         "key": "find_keyword",
@@ -224,6 +426,8 @@ process_def = {
         "status": "⌛",
         "nextprocess": "find_location",
         "autonext": True,
+        "inputs": ("html",),
+        "outputs": ("html",),
     },
     "find_location": {
         "key": "find_location",
@@ -231,6 +435,8 @@ process_def = {
         "status": "⌛",
         "nextprocess": "find_date",
         "autonext": True,
+        "inputs": ("html",),
+        "outputs": ("html",),
     },
     "find_date": {
         "key": "find_date",
@@ -238,6 +444,8 @@ process_def = {
         "status": "⌛",
         "nextprocess": "mod_image",
         "autonext": True,
+        "inputs": ("html",),
+        "outputs": ("html",),
     },
     "mod_image": {
         "key": "mod_image",
@@ -245,6 +453,8 @@ process_def = {
         "status": "⌛",
         "nextprocess": "upload_image",
         "autonext": True,
+        "inputs": ("image",),
+        "outputs": ("image",),
     },
     "upload_image": {
         "key": "upload_image",
@@ -286,3 +496,19 @@ process_def = {
         "autonext": True,
     },
 }
+
+scheduler = StageScheduler(
+    {
+        "serialize_files": serial_file,
+        "clean_html": clean_html,
+        "find_duplicate": find_duplicate,
+        "find_keyword": find_keyword,
+        "find_location": find_location,
+        "find_date": find_date,
+        "mod_image": mod_image,
+    }
+)
+
+# 画像を直接アップロードする場合は、メディアマネージャーの手動操作を飛ばして続ける
+if image_host.direct_upload():
+    process_def["upload_image"].update(nextprocess="link_html", autonext=True)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""mhtml_reader.py
+メディアマネージャーの保存ファイル（MHTML / HTML）を少しずつ読み、
+デコードしたテキストを順に返すストリーミングリーダー
+ファイル全体をメモリに読み込まず、1回の走査で処理する
+"""
+import binascii
+import codecs
+import html
+import itertools
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# 1行として読み込む最大バイト数（改行のない巨大な行でもメモリを抑える）
+READ_LIMIT = 64 * 1024
+# まとめてURLを抽出するテキストの文字数
+CHUNK_SIZE = 256 * 1024
+
+HEADER_LINE = re.compile(rb"^([!-9;-~]+):[ \t]*(.*)$")
+PARAM = re.compile(r';\s*([\w-]+)\s*=\s*(?:"([^"]*)"|([^;\s]*))')
+# URLの一部にならない文字（ここで区切ればURLもHTMLエンティティも分断しない）
+URL_TERMINATORS = ("\n", " ", '"', "'", "<", ">", "\t", "\r")
+
+
+def _parse_header_value(value):
+    """ヘッダー値を (値, {パラメータ: 値}) に分ける"""
+    main = value.split(";", 1)[0].strip().lower()
+    params = {
+        m.group(1).lower(): m.group(2) if m.group(2) is not None else m.group(3)
+        for m in PARAM.finditer(value)
+    }
+    return main, params
+
+
+def _read_headers(file):
+    """空行までのヘッダーを {小文字の名前: 値} で読む（継続行に対応）
+    ヘッダーでない行があればそこで止め、読んだ行もあわせて返す
+    """
+    headers = {}
+    lines = []
+    name = None
+    while True:
+        line = file.readline(READ_LIMIT)
+        lines.append(line)
+        if not line.strip():
+            return headers, lines
+        if line[:1] in (b" ", b"\t") and name:
+            headers[name] += " " + line.strip().decode("ascii", errors="ignore")
+            continue
+        match = HEADER_LINE.match(line.rstrip(b"\r\n"))
+        if not match:
+            return headers, lines  # MIMEではないファイル
+        name = match.group(1).decode("ascii").lower()
+        headers[name] = match.group(2).decode("ascii", errors="ignore").strip()
+
+
+class _PartDecoder:
+    """MIMEパートの転送エンコーディングと文字コードを行単位で戻す"""
+
+    def __init__(self, encoding, charset):
+        self.encoding = encoding
+        try:
+            self.text = codecs.getincrementaldecoder(charset or "utf-8")(
+                errors="ignore"
+            )
+        except LookupError:
+            self.text = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.pending = b""
+
+    def feed(self, line):
+        if self.encoding == "quoted-printable":
+            # 行末の"="はソフト改行としてa2b_qpが取り除く
+            data = binascii.a2b_qp(line)
+        elif self.encoding == "base64":
+            chunk = self.pending + b"".join(line.split())
+            cut = len(chunk) - len(chunk) % 4
+            self.pending = chunk[cut:]
+            try:
+                data = binascii.a2b_base64(chunk[:cut])
+            except binascii.Error:
+                data = b""
+        else:
+            data = line
+        return self.text.decode(data)
+
+    def close(self):
+        return self.text.decode(b"", final=True)
+
+
+def iter_text(file):
+    """バイナリファイルから、デコードしたテキストを順に返す
+    MHTMLの場合はtext/*のパートだけを、MIMEでなければファイル全体を返す
+    """
+    headers, head_lines = _read_headers(file)
+    content_type, params = _parse_header_value(headers.get("content-type", ""))
+    if not content_type.startswith("multipart/") or not params.get("boundary"):
+        # 通常のHTML（またはテキストとして保存したもの）は先頭から全体を返す
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        for line in itertools.chain(
+            head_lines, iter(lambda: file.readline(READ_LIMIT), b"")
+        ):
+            # Quoted-Printableのソフト改行(=改行)を除去
+            if line.endswith(b"=\r\n"):
+                line = line[:-3]
+            elif line.endswith(b"=\n"):
+                line = line[:-2]
+            yield decoder.decode(line)
+        yield decoder.decode(b"", final=True)
+        return
+
+    boundaries = {params["boundary"].encode("ascii", errors="ignore")}
+    decoder = None  # 処理中のtext/*パート（それ以外のパートは読み飛ばす）
+    while True:
+        line = file.readline(READ_LIMIT)
+        if not line:
+            break
+        stripped = line.rstrip()
+        if stripped.startswith(b"--") and (
+            stripped[2:] in boundaries
+            or (stripped.endswith(b"--") and stripped[2:-2] in boundaries)
+        ):
+            if decoder:
+                yield decoder.close()
+                decoder = None
+            if stripped.endswith(b"--") and stripped[2:] not in boundaries:
+                continue  # 終端
+            part_headers, _ = _read_headers(file)
+            part_type, part_params = _parse_header_value(
+                part_headers.get("content-type", "text/plain")
+            )
+            if part_type.startswith("multipart/") and part_params.get("boundary"):
+                boundaries.add(part_params["boundary"].encode("ascii", errors="ignore"))
+            elif part_type.startswith("text/"):
+                decoder = _PartDecoder(
+                    part_headers.get("content-transfer-encoding", "7bit").lower(),
+                    part_params.get("charset"),
+                )
+                logger.debug(
+                    "パート: %s (%s)",
+                    part_headers.get("content-location", ""),
+                    part_type,
+                )
+            continue
+        if decoder:
+            yield decoder.feed(line)
+    if decoder:
+        yield decoder.close()
+
+
+def iter_matches(file, pattern):
+    """デコードしたテキストのHTMLエンティティを戻し、patternに一致したものを順に返す
+    CHUNK_SIZE程度にまとめ、最後のURL区切り文字までを処理単位として残りは次につなげる
+    """
+    pending = []
+    size = 0
+    carry = ""
+    for text in itertools.chain(iter_text(file), [None]):
+        if text:
+            pending.append(text)
+            size += len(text)
+            if size < CHUNK_SIZE:
+                continue
+        elif text is not None:
+            continue
+        buffer = carry + "".join(pending)
+        pending = []
+        size = 0
+        cut = len(buffer) if text is None else max(map(buffer.rfind, URL_TERMINATORS))
+        if cut < 0:
+            carry = buffer  # 区切りがなければ次のテキストとつなげる
+            continue
+        yield from pattern.finditer(html.unescape(buffer[:cut]))
+        carry = buffer[cut:]
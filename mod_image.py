@@ -10,8 +10,10 @@ from pathlib import Path
 
 from PIL import Image, ImageDraw, ImageFont
 
-from file_class import SmartFile
+from dir_index import get_index
+from file_class import FileKind
 from parameter import config
+from stage_journal import StageJournal, stage_control
 
 logger = logging.getLogger(__name__)
 # --- 設定 ---
@@ -21,25 +23,27 @@ logger = logging.getLogger(__name__)
 input_dir = config["mod_image"]["input_dir"]
 # 出力先フォルダ
 output_dir = config["mod_image"]["output_dir"]
-image_extensions = config["common"]["image_extensions"]
 
 
 def run(queue_obj):
     """画像編集開始: 入力フォルダ: %s", input_dir"""
     logger.info("画像編集開始: 入力フォルダ: %s", input_dir)
-    all_files = list(Path(input_dir).rglob("*"))
     count = 0
 
-    for path in all_files:
-        src_file = SmartFile(path)
-        if src_file.is_file():
-            if src_file.suffix.lower() in image_extensions:
-                src_file = image_edit(src_file)
-                src_file.status = "✔"
-                src_file.extensions = "image"
-                src_file.disp_path = src_file.name
-                queue_obj.put(src_file)
-                count += 1
+    work_index = get_index(input_dir)
+    # 透かしを二重に入れないよう、中断後は編集済みの画像を飛ばす
+    journal = StageJournal("mod_image")
+    for src_file in work_index.files(FileKind.IMAGE):
+        stage_control.checkpoint()
+        if not journal.is_committed(src_file):
+            src_file = image_edit(src_file)
+            journal.commit(src_file)
+            work_index.update(src_file)
+        src_file.status = "✔"
+        src_file.disp_path = src_file.name
+        queue_obj.put(src_file)
+        count += 1
+    journal.finish()
     logger.info("画像編集完了: %d件", count)
 
 
@@ -91,6 +95,7 @@ def image_edit(files):
             if files.suffix.lower() in (".jpg", ".jpeg"):
                 image = image.convert("RGB")
             image.save(Path(files), quality=90)
+    files.refresh()
     logger.info("画像処理完了: %s", files.name)
     return files
 
@@ -2,22 +2,128 @@
 """parameter.py
 共通の定数や関数を定義するモジュール
 """
+import json
 import os
 import subprocess
 import sys
+import tempfile
+import threading
+from collections.abc import Mapping
 from datetime import datetime
 from logging import getLogger
 from pathlib import Path
+from types import MappingProxyType
 
 import json5
 
+logger = getLogger(__name__)
+
 # 初期設定ファイル読み込み
 # 使い方　config['SECTION']['KEY']
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_JSON_PATH = os.path.join(SCRIPT_DIR, "./data/config.json5")
-with open(CONFIG_JSON_PATH, "r", encoding="utf-8") as f:
-    # JSON5ファイルを読み込んで辞書に変換
-    config = json5.load(f)
+# 解析済みの設定（JSON）。config.json5 の更新時刻とサイズが同じなら、JSON5の解析を省く
+CONFIG_CACHE_PATH = os.path.join(SCRIPT_DIR, "./data/config.cache.json")
+
+
+def _freeze(value):
+    """辞書は読み取り専用に、リストはタプルにする"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    """_freezeの逆（保存用に辞書・リストに戻す）"""
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+class ConfigSnapshot(Mapping):
+    """config.json5 のある時点の内容（読み取り専用）
+    config['SECTION']['KEY'] の形で辞書と同じように読める。変更はできない
+    """
+
+    def __init__(self, data, mtime_ns=None):
+        self._data = _freeze(data)
+        self.mtime_ns = mtime_ns
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def to_dict(self):
+        """変更できる辞書のコピーを返す"""
+        return _thaw(self._data)
+
+
+class ConfigLoader:
+    """config.json5 を読み込み、更新時刻が変わるまで同じスナップショットを返す"""
+
+    def __init__(self, path, cache_path):
+        self.path = path
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._source = None  # (更新時刻, サイズ)
+
+    def _read_cache(self, source):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(cache, dict) or cache.get("source") != list(source):
+            return None
+        return cache.get("config")
+
+    def _write_cache(self, source, data):
+        # 一時ファイルに書いてから置き換える（file_classはこのモジュールを読み込むため使えない）
+        try:
+            fd, tmp_name = tempfile.mkstemp(
+                prefix=".config.cache.",
+                suffix=".tmp",
+                dir=os.path.dirname(self.cache_path),
+            )
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(
+                    {"source": list(source), "config": data}, file, ensure_ascii=False
+                )
+            os.replace(tmp_name, self.cache_path)
+        except OSError as e:
+            logger.debug("設定のキャッシュを保存できませんでした: %s", e)
+
+    def load(self):
+        """現在の設定のスナップショットを返す（ファイルが変わっていなければ前回と同じもの）"""
+        with self._lock:
+            stat_result = os.stat(self.path)
+            source = (stat_result.st_mtime_ns, stat_result.st_size)
+            if self._snapshot is not None and source == self._source:
+                return self._snapshot
+            data = self._read_cache(source)
+            if data is None:
+                with open(self.path, "r", encoding="utf-8") as file:
+                    # JSON5ファイルを読み込んで辞書に変換
+                    data = json5.load(file)
+                self._write_cache(source, data)
+            self._snapshot = ConfigSnapshot(data, stat_result.st_mtime_ns)
+            self._source = source
+            return self._snapshot
+
+
+config_loader = ConfigLoader(CONFIG_JSON_PATH, CONFIG_CACHE_PATH)
+# 起動時の設定。main_processは処理の実行前にconfig_loader.load()で更新を確認し、置き換える
+config = config_loader.load()
 
 
 # 初期設定ファイル書き込み
@@ -25,11 +131,10 @@ def save_config():
     """現在のconfigオブジェクトをファイルに保存する"""
     with open(CONFIG_JSON_PATH, "w", encoding="utf-8") as file:
         # JSON5ファイルを書き込んで辞書に変換
-        json5.dump(config, file, indent=4, quote_keys=True)
+        json5.dump(config.to_dict(), file, indent=4, quote_keys=True)
 
 
 # 共通関数
-logger = getLogger(__name__)
 
 
 def open_file_with_default_app(filepath):
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""post_ledger.py
+投稿した記事の台帳（記事内容のハッシュ → Bloggerの投稿IDと状態）
+送信結果がわからないまま失敗した投稿（タイムアウト等）を再送せずに確認するために使う
+状態:
+  pending   送信中（または送信したが結果がわからない）
+  sent      APIから投稿IDを受け取った
+  confirmed 投稿後の処理（履歴への移動）まで完了した
+記事のファイル名からも投稿IDを引けるため、修正した記事を同じ投稿の更新として送れる
+"""
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+from file_class import write_text_atomic
+from parameter import config
+
+logger = logging.getLogger(__name__)
+
+# --- 設定 ---
+
+# 台帳ファイル
+ledger_file = config["upload_art"].get("post_ledger_file", "./data/post_ledger.json")
+
+PENDING = "pending"
+SENT = "sent"
+CONFIRMED = "confirmed"
+
+
+def post_key(body):
+    """投稿内容のハッシュ（タイトルと本文から。公開日やラベルの変更では変わらない）"""
+    digest = hashlib.sha256()
+    digest.update(body.get("title", "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(body.get("content", "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def post_fields(body):
+    """更新時に変更を判定する項目（本文はハッシュ）"""
+    return {
+        "title": body.get("title", ""),
+        "content": hashlib.sha256(body.get("content", "").encode("utf-8")).hexdigest(),
+        "labels": body.get("labels", ""),
+        "location": body.get("location"),
+        "published": body.get("published"),
+    }
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class PostLedger:
+    """記事内容のハッシュごとの投稿IDと状態"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None  # {ハッシュ: {name, title, post_id, state, updated}}
+        self._mtime_ns = None
+
+    def _load(self):
+        # 別のプロセス（GUIと予約実行など）が更新した場合は読み直す
+        path = Path(ledger_file)
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if self._entries is not None and mtime_ns == self._mtime_ns:
+            return self._entries
+        self._entries = {}
+        self._mtime_ns = mtime_ns
+        if mtime_ns is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.warning("投稿台帳の読み込みに失敗しました: %s", e)
+        return self._entries
+
+    def _save(self):
+        try:
+            Path(ledger_file).parent.mkdir(parents=True, exist_ok=True)
+            write_text_atomic(
+                ledger_file, json.dumps(self._entries, ensure_ascii=False, indent=1)
+            )
+            self._mtime_ns = Path(ledger_file).stat().st_mtime_ns
+        except OSError as e:
+            logger.error("投稿台帳の保存に失敗しました: %s", e)
+
+    def get(self, key):
+        """台帳の記録を返す（なければNone）"""
+        with self._lock:
+            entry = self._load().get(key)
+            return dict(entry) if entry else None
+
+    def pending(self):
+        """結果がわからない投稿を {ハッシュ: 記録} で返す"""
+        with self._lock:
+            return {
+                key: dict(entry)
+                for key, entry in self._load().items()
+                if entry["state"] == PENDING
+            }
+
+    def find_by_name(self, name):
+        """記事のファイル名から投稿済みの記録を探す
+        戻り値: (ハッシュ, 記録) 最後に更新したもの（なければ (None, None)）
+        """
+        with self._lock:
+            found = [
+                (key, entry)
+                for key, entry in self._load().items()
+                if entry["name"] == name
+                and entry["post_id"]
+                and entry["state"] in (SENT, CONFIRMED)
+            ]
+            if not found:
+                return None, None
+            key, entry = max(found, key=lambda item: item[1]["updated"])
+            return key, dict(entry)
+
+    def mark_pending(self, key, name, title, body=None):
+        """送信前に記録する（送信時刻より後に作られた投稿を照合に使う）"""
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry and entry["state"] == PENDING:
+                return  # 再試行では最初の送信時刻を残す
+            entries[key] = {
+                "name": name,
+                "title": title,
+                "post_id": None,
+                "state": PENDING,
+                "updated": _now(),
+                "fields": post_fields(body) if body else None,
+            }
+            self._save()
+
+    def mark_sent(self, key, post_id):
+        """投稿IDを記録する"""
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None:
+                return
+            entry.update(post_id=post_id, state=SENT, updated=_now())
+            self._save()
+
+    def mark_confirmed(self, key):
+        """投稿後の処理が完了したことを記録する"""
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None or entry["state"] != SENT:
+                return
+            entry.update(state=CONFIRMED, updated=_now())
+            self._save()
+
+    def mark_updated(self, old_key, key, name, body, post_id):
+        """更新した投稿の記録を、新しい内容のハッシュに付け替える"""
+        with self._lock:
+            entries = self._load()
+            old = entries.pop(old_key, None) or {}
+            fields = post_fields(body)
+            # 記事にない項目は更新していないため、前回送信した値を残す
+            for field, value in (old.get("fields") or {}).items():
+                if fields.get(field) is None:
+                    fields[field] = value
+            entries[key] = {
+                "name": name,
+                "title": body.get("title", ""),
+                "post_id": post_id,
+                "state": CONFIRMED,
+                "updated": _now(),
+                "fields": fields,
+            }
+            self._save()
+
+    def discard(self, key):
+        """投稿されなかった記事の記録を削除する（次回は新規に投稿する）"""
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+
+
+post_ledger = PostLedger()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""quota_ledger.py
+Blogger APIの1日あたりの投稿数をブログごとに記録する台帳と、
+残りの記事をどの日（クォータの期間）に投稿するかの計画
+クォータは太平洋時間の0時（日本時間の16時または17時）にリセットされる
+"""
+import json
+import logging
+import threading
+from datetime import datetime, time, timedelta, timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from file_class import write_text_atomic
+from parameter import config
+
+logger = logging.getLogger(__name__)
+
+# --- 設定 ---
+
+# 投稿数の台帳ファイル
+ledger_file = config["upload_art"].get("quota_file", "./data/quota.json")
+# 1日に投稿できる記事数（APIの制限）
+daily_post_limit = int(config["upload_art"].get("daily_post_limit", 45))
+# クォータがリセットされるタイムゾーン
+quota_timezone = config["upload_art"].get("quota_timezone", "America/Los_Angeles")
+# 台帳に残す日数
+KEEP_DAYS = 30
+
+# 日本時間 (JST)
+JST = timezone(timedelta(hours=9))
+
+try:
+    QUOTA_TZ = ZoneInfo(quota_timezone)
+except ZoneInfoNotFoundError:
+    # tzdataがない環境（Windows等）では太平洋標準時で代用する
+    logger.warning(
+        "タイムゾーン %s が見つかりません。UTC-8で代用します（pip install tzdata）",
+        quota_timezone,
+    )
+    QUOTA_TZ = timezone(timedelta(hours=-8))
+
+
+def quota_day(now=None):
+    """クォータの日付（リセット時刻のタイムゾーンでの日付）"""
+    now = now or datetime.now(timezone.utc)
+    return now.astimezone(QUOTA_TZ).date()
+
+
+def next_reset(now=None):
+    """次にクォータがリセットされる時刻（日本時間）"""
+    day = quota_day(now) + timedelta(days=1)
+    return datetime.combine(day, time(0), tzinfo=QUOTA_TZ).astimezone(JST)
+
+
+class QuotaLedger:
+    """ブログIDとクォータの日付ごとの投稿数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None  # {ブログID: {日付: 投稿数}}
+        self._mtime_ns = None
+
+    def _load(self):
+        # 別のプロセス（GUIと予約実行など）が更新した場合は読み直す
+        path = Path(ledger_file)
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if self._entries is not None and mtime_ns == self._mtime_ns:
+            return self._entries
+        self._entries = {}
+        self._mtime_ns = mtime_ns
+        if mtime_ns is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.warning("投稿数の台帳の読み込みに失敗しました: %s", e)
+        return self._entries
+
+    def _save(self):
+        # 古い日付は削除する
+        oldest = (quota_day() - timedelta(days=KEEP_DAYS)).isoformat()
+        for days in self._entries.values():
+            for day in [day for day in days if day < oldest]:
+                del days[day]
+        try:
+            Path(ledger_file).parent.mkdir(parents=True, exist_ok=True)
+            write_text_atomic(ledger_file, json.dumps(self._entries, indent=1))
+            self._mtime_ns = Path(ledger_file).stat().st_mtime_ns
+        except OSError as e:
+            logger.error("投稿数の台帳の保存に失敗しました: %s", e)
+
+    def used(self, blog_id, now=None):
+        """今日（クォータの日付）の投稿数"""
+        with self._lock:
+            days = self._load().get(str(blog_id), {})
+            return days.get(quota_day(now).isoformat(), 0)
+
+    def remaining(self, blog_id, now=None):
+        """今日あと何件投稿できるか"""
+        return max(0, daily_post_limit - self.used(blog_id, now))
+
+    def record(self, blog_id, count=1, now=None):
+        """投稿した件数を記録する"""
+        with self._lock:
+            days = self._load().setdefault(str(blog_id), {})
+            day = quota_day(now).isoformat()
+            days[day] = days.get(day, 0) + count
+            self._save()
+
+
+quota_ledger = QuotaLedger()
+
+
+def plan(files, blog_id, max_posts=None, now=None):
+    """記事をクォータの期間ごとに割り当てる
+    戻り値: [(期間の開始時刻(日本時間), [記事])] 最初の期間は今回の実行分
+    """
+    now = now or datetime.now(timezone.utc)
+    # 1回の実行で投稿する上限（次の期間以降も1回ずつ実行する前提）
+    per_window = daily_post_limit
+    if max_posts is not None:
+        per_window = min(per_window, max_posts)
+    budget = min(quota_ledger.remaining(blog_id, now), per_window)
+    windows = [(now.astimezone(JST), list(files[:budget]))]
+    rest = list(files[budget:])
+    start = now
+    while rest and per_window > 0:
+        start = next_reset(start)
+        windows.append((start, rest[:per_window]))
+        rest = rest[per_window:]
+    return windows
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""rate_limiter.py
+API呼び出しの間隔を制御するトークンバケット
+AdaptiveRateLimiterはAPIの応答（429/503、Retry-After）に合わせて速度を調整し、
+最後に安全だった速度をファイルに保存して次回の実行に引き継ぐ
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+from file_class import write_text_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """1秒あたりrate回まで（burst回までは連続で）呼び出しを許可するトークンバケット"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, count=1):
+        """count回分のトークンを予約し、呼び出しまでに待つ秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # 足りない分は前借りし、次の呼び出しはその分だけ後ろにずれる
+            self._tokens -= count
+            blocked = max(0.0, self._blocked_until - now)
+            if self._tokens >= 0 or self.rate <= 0:
+                return blocked
+            return max(blocked, -self._tokens / self.rate)
+
+    def acquire(self, count=1):
+        """count回分のトークンが貯まるまで待つ"""
+        wait_time = self.reserve(count)
+        if wait_time > 0:
+            logger.info("待機中... (%.1f秒)", wait_time)
+            time.sleep(wait_time)
+
+
+def retry_after_seconds(value):
+    """Retry-Afterヘッダー（秒数またはHTTP日付）を秒数にする。解釈できなければNone"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """APIの応答に合わせて速度を変えるトークンバケット
+    制限(429/503)を受けたら速度を下げ、成功が続けば上限まで少しずつ戻す
+    """
+
+    # 制限を受けたときの速度の倍率
+    BACKOFF_FACTOR = 0.5
+    # 成功したときの速度の倍率
+    RAMP_FACTOR = 1.1
+
+    def __init__(self, rate, min_rate, max_rate, state_file=None):
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.state_file = state_file
+        super().__init__(self._clamp(self._load_rate(rate)))
+
+    def _clamp(self, rate):
+        if self.max_rate > 0:
+            rate = min(rate, self.max_rate)
+        return max(rate, self.min_rate)
+
+    def _load_rate(self, default_rate):
+        """前回保存した速度を読み込む（なければdefault_rate）"""
+        if not self.state_file or not Path(self.state_file).exists():
+            return float(default_rate)
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as file:
+                rate = float(json.load(file)["rate"])
+            logger.info("前回の投稿速度を引き継ぎます: %.3f件/秒", rate)
+            return rate
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("投稿速度ファイルの読み込みに失敗しました: %s", e)
+            return float(default_rate)
+
+    def save(self):
+        """現在の速度を保存する"""
+        if not self.state_file:
+            return
+        with self._lock:
+            state = {
+                "rate": self.rate,
+                "updated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+        try:
+            Path(self.state_file).parent.mkdir(parents=True, exist_ok=True)
+            write_text_atomic(self.state_file, json.dumps(state))
+        except OSError as e:
+            logger.warning("投稿速度ファイルの保存に失敗しました: %s", e)
+
+    def on_success(self):
+        """呼び出しが成功したら速度を少し上げる"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = self._clamp(self.rate * self.RAMP_FACTOR)
+
+    def on_throttle(self, retry_after=None):
+        """制限を受けたら速度を下げ、Retry-Afterの間は呼び出しを止める"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            old_rate = self.rate
+            self.rate = self._clamp(self.rate * self.BACKOFF_FACTOR)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+        logger.warning(
+            "APIの制限を受けたため投稿速度を下げます: %.3f -> %.3f件/秒%s",
+            old_rate,
+            self.rate,
+            f" ({retry_after:.1f}秒待機)" if retry_after else "",
+        )
+        self.save()
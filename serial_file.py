@@ -14,8 +14,10 @@ import re
 import shutil
 from pathlib import Path
 
-from file_class import SmartFile
+from dir_index import get_index
+from file_class import FileKind, SmartFile
 from parameter import config, get_serial, update_serial
+from stage_journal import StageJournal, stage_control
 
 logger = logging.getLogger(__name__)
 # --- 設定 ---
@@ -34,27 +36,50 @@ html_extensions = config["common"]["html_extensions"]
 def run(queue_obj):
     """INPUT_DIR内のファイルをシリアライズしてSERIALIZATION_DIRに保存する"""
     logger.info("シリアライズ処理開始: %s", input_dir)
-    update_serial()  # シリアル番号更新
-
-    # 1. 作業用ディレクトリ(SERIALIZATION_DIR)の初期化
-    if serialization_dir.exists():
-        shutil.rmtree(serialization_dir)
-    serialization_dir.mkdir(exist_ok=True)
+    journal = StageJournal("serialize_files")
+    if journal.committed:
+        # 中断・中止した処理の続き。移動済みの画像はシリアライズフォルダにあるため、
+        # フォルダを初期化せず、前回と同じシリアル番号を使う
+        serial_prefix = next(iter(journal.committed.values()))["info"]["serial"]
+        for path, entry in journal.committed.items():
+            if Path(path).exists():
+                queue_obj.put(_committed_file(path, entry["info"]))
+    else:
+        update_serial()  # シリアル番号更新
+
+        # 1. 作業用ディレクトリ(SERIALIZATION_DIR)の初期化
+        if serialization_dir.exists():
+            shutil.rmtree(serialization_dir)
+        serialization_dir.mkdir(exist_ok=True)
+
+        # シリアル番号プレフィックスを取得（全ファイルで共通）
+        serial_prefix = get_serial()
 
     # 2. ファイル処理
     all_files = sorted(input_dir.rglob("*"))
 
-    # シリアル番号プレフィックスを取得（全ファイルで共通）
-    serial_prefix = get_serial()
-
     for path in all_files:
         if not path.is_file():
             continue
+        stage_control.checkpoint()
+        if journal.is_committed(
+            serialization_dir / get_serialized_name(path, serial_prefix)
+        ):
+            continue  # 前回の実行でシリアライズ済み
 
         src_file = SmartFile(path)
         try:
             processed_file = process_file(src_file, serial_prefix)
             if processed_file:
+                if processed_file.status == "✓":
+                    journal.commit(
+                        processed_file,
+                        info={
+                            "serial": serial_prefix,
+                            "kind": processed_file.kind.value,
+                            "old_name": processed_file.old_name,
+                        },
+                    )
                 queue_obj.put(processed_file)
         except (IOError, OSError) as e:
             logger.error("ファイル処理エラー: %s - %s", path, e, exc_info=True)
@@ -63,9 +88,20 @@ def run(queue_obj):
 
     # 3. 出力ディレクトリへの反映
     finalize_output(serialization_dir, output_dir)
+    journal.finish()
     logger.info("シリアライズ完了")
 
 
+def _committed_file(path, info):
+    """前回の実行でシリアライズ済みのファイル（GUI表示用）"""
+    smart_file = SmartFile(path)
+    smart_file.kind = FileKind(info["kind"])
+    smart_file.disp_path = smart_file.name
+    smart_file.old_name = info["old_name"]
+    smart_file.status = "✓"
+    return smart_file
+
+
 def get_serialized_name(path, serial_prefix):
     """パスをフラットなシリアル名に変換する"""
     try:
@@ -131,7 +167,7 @@ def process_html(src_file, dest_smart_file, serial_prefix):
     new_content = re.sub(r'src="([^"]+)"', replace_link, content)
 
     dest_smart_file.write_text(new_content, encoding="utf-8")
-    dest_smart_file.extensions = "html"
+    dest_smart_file.kind = FileKind.HTML
     dest_smart_file.disp_path = dest_smart_file.name
     dest_smart_file.status = "✓"
     logger.info("[HTML] %s -> %s (リンク更新済)", src_file.name, dest_smart_file.name)
@@ -143,7 +179,7 @@ def process_image(src_file, dest_smart_file):
     """画像ファイルを移動"""
     shutil.move(src_file, dest_smart_file)
 
-    dest_smart_file.extensions = "image"
+    dest_smart_file.kind = FileKind.IMAGE
     dest_smart_file.disp_path = dest_smart_file.name
     dest_smart_file.status = "✓"
     logger.info("[FILE] %s -> %s", src_file.name, dest_smart_file.name)
@@ -155,6 +191,7 @@ def finalize_output(src_dir, dest_dir):
     if os.path.exists(dest_dir):
         shutil.rmtree(dest_dir)
 
+    get_index(dest_dir).invalidate()
     try:
         shutil.copytree(src_dir, dest_dir)
         logger.info("コピー: %s -> %s", src_dir, dest_dir)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""stage_journal.py
+ステージごとに書き込みが完了したファイルを記録し、
+中断したステージを最後に確定したファイルの次から再開するためのジャーナル
+実行中のステージの一時停止・中止（StageControl）もここで扱う
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from file_class import fsync_enabled
+from parameter import config
+
+logger = logging.getLogger(__name__)
+
+# --- 設定 ---
+
+# ジャーナルフォルダ
+journal_dir = config["common"].get("journal_dir", "./data/journal").lstrip("./")
+
+
+class StageJournal:
+    """ステージ内で確定したファイルを1行ずつ追記するジャーナル"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.path = Path(journal_dir) / f"{stage}.jsonl"
+        self.committed = self._load()
+        if self.committed:
+            logger.info(
+                "中断したステージを再開します: %s (%d件処理済み)",
+                stage,
+                len(self.committed),
+            )
+
+    def _load(self):
+        """既存のジャーナルを読み込む"""
+        committed = {}
+        if not self.path.exists():
+            return committed
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    committed[entry["path"]] = entry
+                except (ValueError, KeyError):
+                    # 書き込み途中で中断された最終行は無視する
+                    logger.debug("ジャーナルの不正な行を無視: %s", self.path)
+        return committed
+
+    def is_committed(self, path):
+        """前回の実行で確定済みで、その後変更されていないファイルか判定する"""
+        entry = self.committed.get(str(path))
+        if entry is None:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime_ns"]
+
+    def info(self, path):
+        """確定時に保存した付加情報を返す"""
+        entry = self.committed.get(str(path))
+        return entry.get("info") if entry else None
+
+    def commit(self, path, info=None):
+        """ファイルの書き込み完了をジャーナルに記録する"""
+        st = os.stat(path)
+        entry = {
+            "path": str(path),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        if info is not None:
+            entry["info"] = info
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if fsync_enabled:
+                file.flush()
+                os.fsync(file.fileno())
+        self.committed[str(path)] = entry
+
+    def finish(self):
+        """ステージ完了時にジャーナルを削除する"""
+        self.path.unlink(missing_ok=True)
+        self.committed = {}
+
+
+class StageCancelled(Exception):
+    """ステージの中止を要求された（確定済みのファイルはジャーナルに残る）"""
+
+
+class StageControl:
+    """実行中のステージの一時停止・中止の要求
+    各ステージはファイルごとにcheckpoint()を呼び、一時停止中はそこで待ち、
+    中止を要求されていればStageCancelledを送出する。処理中のファイルは最後まで処理する
+    """
+
+    # 一時停止中に中止の要求を確認する間隔（秒）
+    POLL_SECONDS = 0.5
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    def cancel(self):
+        """中止を要求する（一時停止中でも止まる）"""
+        self._cancelled.set()
+
+    def pause(self):
+        """一時停止を要求する"""
+        self._running.clear()
+
+    def resume(self):
+        """一時停止を解除する"""
+        self._running.set()
+
+    def is_paused(self):
+        return not self._running.is_set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def reset(self):
+        """新しいステージの開始前に中止の要求を取り消す（一時停止はそのまま）"""
+        self._cancelled.clear()
+
+    def checkpoint(self):
+        """ファイルの処理前に呼ぶ。一時停止中は待ち、中止ならStageCancelledを送出する"""
+        if self.is_paused() and not self.is_cancelled():
+            logger.info("一時停止中です")
+            while not self._running.wait(self.POLL_SECONDS):
+                if self.is_cancelled():
+                    break
+        if self.is_cancelled():
+            raise StageCancelled("中止が要求されました")
+
+
+stage_control = StageControl()
+
+
+def is_pending(stage):
+    """中断されたままのジャーナルがあるか判定する"""
+    return (Path(journal_dir) / f"{stage}.jsonl").exists()
+
+
+def reset_all():
+    """新しい取り込みの前にすべてのジャーナルを削除する"""
+    shutil.rmtree(journal_dir, ignore_errors=True)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""upload_imageを代用のアップロード先（local / http）に対して実行するテスト"""
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bench"))
+
+from workspace import (  # noqa: E402
+    RESULT_PREFIX,
+    make_workspace,
+    remove_workspace,
+    run_in_workspace,
+)
+
+IMAGES = 4
+
+# 作業フォルダに画像を作り、upload_image.runを2回実行して台帳のURLを返す
+DRIVER = f"""
+import json, os, queue, random
+from PIL import Image
+os.makedirs("data/work", exist_ok=True)
+for i in range({IMAGES}):
+    data = bytes(random.randrange(256) for _ in range(16 * 16 * 3))
+    Image.frombytes("RGB", (16, 16), data).save(f"data/work/img{{i}}.png")
+import upload_image
+from image_index import media_url_registry
+first = upload_image.run(queue.Queue())
+second = upload_image.run(queue.Queue())
+urls = {{
+    name: media_url_registry.lookup(name, os.path.join(upload_image.upload_dir, name))
+    for name in sorted(os.listdir(upload_image.upload_dir))
+}}
+print({RESULT_PREFIX!r} + json.dumps({{"first": first, "second": second, "urls": urls}}))
+"""
+
+
+@pytest.fixture
+def workspace():
+    created = []
+
+    def make(overrides):
+        work_dir = make_workspace({"common": {"test_mode": "false"}, **overrides})
+        created.append(work_dir)
+        return work_dir
+
+    yield make
+    for work_dir in created:
+        remove_workspace(work_dir)
+
+
+def test_local_host_uploads_and_registers_urls(workspace):
+    work_dir = workspace(
+        {
+            "upload_image": {
+                "host": "local",
+                "host_dir": "./data/image_host",
+                "host_base_url": "https://img.example/",
+            }
+        }
+    )
+    result = run_in_workspace(work_dir, DRIVER)
+    assert result["first"] is True and result["second"] is True
+    assert len(result["urls"]) == IMAGES
+    for name, url in result["urls"].items():
+        assert url.startswith("https://img.example/") and url.endswith("/" + name)
+        relative = url[len("https://img.example/") :]
+        assert (work_dir / "data" / "image_host" / relative).is_file()
+
+
+class _ImageServer:
+    """画像を受け取り{"url": ...}を返すHTTPのアップロード先（fail件目で500を返す）"""
+
+    def __init__(self, fail=0):
+        self.received = []
+        self.fail = fail
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                server.received.append(self.headers["Slug"])
+                if len(server.received) == server.fail:
+                    self.send_response(500)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                payload = json.dumps(
+                    {"url": "https://img.example/" + self.headers["Slug"]}
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/upload"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.mark.parametrize("fail", [0, 2])
+def test_http_host_resumes_after_failure(workspace, fail):
+    server = _ImageServer(fail=fail)
+    try:
+        work_dir = workspace(
+            {"upload_image": {"host": "http", "host_endpoint": server.url}}
+        )
+        result = run_in_workspace(work_dir, DRIVER)
+    finally:
+        server.stop()
+    # 失敗した画像は2回目に送り、アップロード済みの画像は送り直さない
+    assert result["first"] is (fail == 0)
+    assert result["second"] is True
+    assert len(server.received) == IMAGES + (1 if fail else 0)
+    assert result["urls"] == {
+        name: "https://img.example/" + name for name in result["urls"]
+    }
+    assert len(result["urls"]) == IMAGES
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""upload_artの投稿方式を代用サーバー（bench/fake_blogger.py）に対して実行するテスト"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bench"))
+
+from upload_engines import ENGINES, run_upload  # noqa: E402
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_posts_every_article(engine):
+    result = run_upload(engine, posts=6)
+    assert result["ok"]
+    assert result["inserts"] == 6
+    assert result["posts"] == 6
+    assert result["history"] == 6
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_retries_rate_limited_posts(engine):
+    # 4件目ごとに429を返しても、重複せずにすべて投稿する
+    result = run_upload(engine, posts=6, fail_every=4)
+    assert result["ok"]
+    assert result["posts"] == 6
+    assert result["history"] == 6
+
+
+def test_async_halves_wall_time_on_slow_links():
+    sequential = run_upload("sequential", posts=8, latency=0.3)
+    concurrent = run_upload("async", posts=8, latency=0.3)
+    assert concurrent["posts"] == sequential["posts"] == 8
+    assert concurrent["seconds"] < sequential["seconds"] / 2
+
+
+def test_batch_sends_fewer_requests_and_is_faster():
+    sequential = run_upload("sequential", posts=8, latency=0.3)
+    batch = run_upload("batch", posts=8, latency=0.3)
+    assert batch["posts"] == sequential["posts"] == 8
+    # 8件の投稿を1回のバッチで送る（確認の一覧取得を含めても件数より少ない）
+    assert batch["http"] < 8 <= sequential["http"]
+    assert batch["seconds"] < sequential["seconds"]
@@ -2,21 +2,35 @@
 """upload_art.py
 アップロード用のHTMLファイルを管理し、Bloggerに投稿するモジュール
 """
+import argparse
+import asyncio
+import json
 import logging
 import queue
-import random
 import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-from bs4 import BeautifulSoup
+from google.auth.exceptions import RefreshError
 from googleapiclient.errors import HttpError
 
-from auth_google import BloggerService, RefreshError
 from cons_progressber import ProgressBar
-from file_class import SmartFile
+from dir_index import get_index
+from file_class import FileKind, SmartFile, write_text_atomic
 from parameter import config, to_bool
+from post_ledger import (
+    CONFIRMED,
+    PENDING,
+    SENT,
+    post_fields,
+    post_key,
+    post_ledger,
+)
+from quota_ledger import next_reset, plan, quota_ledger
+from rate_limiter import AdaptiveRateLimiter, retry_after_seconds
+from stage_journal import StageCancelled, stage_control
 
 logger = logging.getLogger(__name__)
 
@@ -29,16 +43,37 @@ input_dir = config["upload_art"]["input_dir"].lstrip("./")
 upload_dir = config["upload_art"]["upload_dir"].lstrip("./")
 # 履歴フォルダ
 history_dir = config["upload_art"]["history_dir"].lstrip("./")
-# html拡張子
-html_extensions = config["common"]["html_extensions"]
+# 重複のため投稿しなかった記事の退避フォルダ
+duplicate_dir = (
+    config["upload_art"].get("duplicate_dir", "./data/duplicate").lstrip("./")
+)
+
+# 投稿内容（HTMLから抽出したもの）の保存フォルダ
+payload_dir = config["upload_art"].get("payload_dir", "./data/payload").lstrip("./")
 
 blog_id = config["upload_art"]["blog_id"]
 delay_seconds = float(config["upload_art"]["delay_seconds"])
+# 投稿間隔の調整範囲（APIの制限を受けると間隔を広げ、成功が続くと狭める）
+min_delay_seconds = float(config["upload_art"].get("min_delay_seconds", 0.5))
+max_delay_seconds = float(config["upload_art"].get("max_delay_seconds", 60))
+# 最後に安全だった投稿速度の保存先
+rate_state_file = config["upload_art"].get("rate_state_file", "./data/rate_limit.json")
 max_posts_per_run = int(config["upload_art"]["max_posts_per_run"])
 max_retries = int(config["upload_art"]["max_retries"])
+# 投稿方式 (sequential: 1件ずつ / batch: HTTPバッチでまとめて送信 / async: 並行して送信)
+engine = config["upload_art"].get("engine", "sequential")
+# バッチ1回で送る記事数
+batch_size = max(1, int(config["upload_art"].get("batch_size", 10)))
+# 並行して送信中にする記事数（asyncのみ）
+concurrency = max(1, int(config["upload_art"].get("concurrency", 4)))
+# 投稿済みの記事（同じファイル名）は新規投稿せず、変更した項目だけ更新する
+update_mode = to_bool(config["upload_art"].get("update_mode", "false"))
 
 test_mode = to_bool(config["common"]["test_mode"])
 
+# 投稿速度を下げるべきAPIの応答
+THROTTLE_STATUSES = (429, 503)
+
 # 日本時間 (JST) の設定
 JST = timezone(timedelta(hours=9))
 
@@ -48,13 +83,15 @@ class BloggerServiceManager:
 
     def __init__(self):
         self._service = None
-        self.last_execution_time = 0
 
     def get_service(self):
         """サービスオブジェクトを取得する。未初期化の場合は初期化する。"""
         if self._service is None:
+            # 認証・APIクライアントのライブラリは重いため、投稿するときに読み込む
+            from auth_google import service_factory
+
             try:
-                self._service = BloggerService()
+                self._service = service_factory.get_service()
                 logger.info("Blogger APIサービスを初期化しました。")
             except (FileNotFoundError, RefreshError) as e:
                 logger.error(
@@ -78,19 +115,29 @@ def move_upload_file(queue_obj):
         )
         return False
 
-    for file_path in Path(input_dir).rglob("*"):
-        # ファイルであり、かつ拡張子が指定のものに含まれるかチェック
-        if file_path.is_file() and file_path.suffix.lower() in html_extensions:
-            dest_path = Path(upload_dir) / file_path.name
-            # 3. コピー実行（メタデータも保持するcopy2を推奨）
-            shutil.copy2(file_path, dest_path)
-            count += 1
-
-            smart_file = SmartFile(dest_path)
-            smart_file.status = "⌛"
-            smart_file.extensions = "html"
-            smart_file.disp_path = dest_path.name
-            queue_obj.put(smart_file)
+    upload_index = get_index(upload_dir)
+    for file_path in get_index(input_dir).files(FileKind.HTML):
+        dest_path = Path(upload_dir) / file_path.name
+        # 3. コピー実行（メタデータも保持するcopy2を推奨）
+        shutil.copy2(file_path, dest_path)
+        upload_index.update(dest_path)
+        count += 1
+
+        smart_file = SmartFile(dest_path)
+        smart_file.status = "⌛"
+        # 投稿前に投稿内容を作成して検証する（クォータを使う前に問題がわかる）
+        try:
+            payload = prepare_payload(dest_path)
+            if payload["errors"]:
+                smart_file.status = "✘"
+            elif payload["warnings"]:
+                smart_file.status = "⚠"
+        except (IOError, OSError, UnicodeDecodeError, ValueError) as e:
+            logger.error("投稿内容の作成失敗: %s - %s", dest_path.name, e)
+            smart_file.status = "✘"
+        smart_file.kind = FileKind.HTML
+        smart_file.disp_path = dest_path.name
+        queue_obj.put(smart_file)
     logger.info("%d 枚のhtmlを %s にアップロードしました。", count, upload_dir)
     return True
 
@@ -103,6 +150,9 @@ def move_history_file(src_path):
         dest_path = Path(history_dir) / src_path.name
         # 3. コピー実行（メタデータも保持するcopy2を推奨）
         shutil.move(src_path, dest_path)
+        get_index(upload_dir).remove(src_path)
+        get_index(history_dir).update(dest_path)
+        remove_payload(src_path)
         logger.info("履歴移動: %s", src_path.name)
         return True
     except (IOError, OSError) as e:
@@ -110,7 +160,31 @@ def move_history_file(src_path):
         return False
 
 
+def move_duplicate_file(src_path):
+    """重複記事を投稿せずに退避する"""
+    Path(duplicate_dir).mkdir(parents=True, exist_ok=True)
+
+    try:
+        dest_path = Path(duplicate_dir) / src_path.name
+        shutil.move(src_path, dest_path)
+        get_index(upload_dir).remove(src_path)
+        get_index(duplicate_dir).update(dest_path)
+        remove_payload(src_path)
+        logger.info("重複記事退避: %s", src_path.name)
+        return True
+    except (IOError, OSError) as e:
+        logger.error("重複記事退避失敗: %s - %s", src_path.name, e, exc_info=True)
+        return False
+
+
 service_manager = BloggerServiceManager()
+# 投稿の間隔はdelay_secondsから始めて応答に合わせて調整する（バッチ内の記事も1件ずつ数える）
+rate_limiter = AdaptiveRateLimiter(
+    1 / delay_seconds if delay_seconds > 0 else 0,
+    min_rate=1 / max_delay_seconds if max_delay_seconds > 0 else 0,
+    max_rate=1 / min_delay_seconds if min_delay_seconds > 0 else 0,
+    state_file=rate_state_file,
+)
 
 
 def ready_upload():
@@ -133,182 +207,792 @@ def ready_upload():
     return True
 
 
-def upload_art(art_html):
-    """Blogger にアップロード"""
+def build_post(art_html):
+    """記事のHTMLから投稿内容を作成する
+    戻り値: (タイトル, 投稿内容, 警告のリスト, エラーのリスト)
+    公開日のない記事は、投稿時に当日の日付を入れる（_published_today）
+    """
+    from bs4 import BeautifulSoup  # 再開チェックだけの起動では読み込まない
+
+    warnings = []
+    errors = []
+    # タイトルは<title>タグから抽出
+    soup = BeautifulSoup(art_html, "html.parser")
+    title_tag = soup.find("title")
+    title = (
+        title_tag.get_text(strip=True)
+        if title_tag and title_tag.get_text(strip=True)
+        else ""
+    )
+    if not title:
+        warnings.append("タイトルがありません")
+
+    # 公開日時を<time>タグから抽出
+    time_tag = soup.find("time")
+    published = (
+        f"{time_tag.get('datetime')[:10]}T00:00:00+09:00"
+        if (time_tag and time_tag.get("datetime"))
+        else None
+    )
+
+    # ラベルを<category>タグから抽出
+    labels_tags = soup.find_all("search")
+    labels = ",".join([tag.get_text(strip=True) for tag in labels_tags])
+
+    # 位置情報を<blogger:location>から抽出
+    location_name_tag = soup.find("location_name")
+    latitude_tag = soup.find("latitude")
+    longitude_tag = soup.find("longitude")
+
+    location_data = None
+    if (
+        location_name_tag is not None
+        and latitude_tag is not None
+        and longitude_tag is not None
+    ):
+        try:
+            location_data = {
+                "name": (
+                    location_name_tag.text.strip() if location_name_tag.text else ""
+                ),
+                "lat": float(latitude_tag.text),
+                "lng": float(longitude_tag.text),
+            }
+        except ValueError:
+            warnings.append(
+                "位置情報の座標変換に失敗しました。位置情報はスキップされます。"
+            )
+        if location_data and not (
+            -90 <= location_data["lat"] <= 90 and -180 <= location_data["lng"] <= 180
+        ):
+            warnings.append("位置情報の座標が範囲外です。位置情報はスキップされます。")
+            location_data = None
+    # 本文は<body>タグの中身
+    body_tag = soup.find("body")
+    content = (
+        "".join(str(child) for child in body_tag.children).strip()
+        if body_tag
+        else str(soup)
+    )
+    if not content:
+        errors.append("本文がありません")
+
+    body = {
+        "kind": "blogger#post",
+        "title": title,
+        "content": content,
+        "labels": labels,
+        "blog": {"id": blog_id},
+    }
+
+    # 公開日時があれば追加
+    if published:
+        body["published"] = published
+
+    # 位置情報があれば追加
+    if location_data:
+        body["location"] = location_data
+    return title, body, warnings, errors
+
+
+def _published_today(body):
+    """公開日のない投稿内容に当日の日付を入れる"""
+    if "published" in body:
+        return body
+    return dict(body, published=f"{datetime.now(JST):%Y-%m-%d}T00:00:00+09:00")
+
+
+def _payload_path(src_path):
+    return Path(payload_dir) / f"{Path(src_path).name}.json"
+
+
+def prepare_payload(src_path):
+    """記事のHTMLから投稿内容を作成し、JSONファイルとして保存する"""
+    # BeautifulSoupを読み込むため使うときに読み込む
+    from find_duplicate import duplicate_of
+
+    stat_result = Path(src_path).stat()
+    art_html = Path(src_path).read_text(encoding="utf-8")
+    title, body, warnings, errors = build_post(art_html)
+    payload = {
+        "source": {"size": stat_result.st_size, "mtime_ns": stat_result.st_mtime_ns},
+        "title": title,
+        "body": body,
+        "duplicate_of": duplicate_of(art_html),
+        "warnings": warnings,
+        "errors": errors,
+    }
+    for message in warnings:
+        logger.warning("%s: %s", Path(src_path).name, message)
+    for message in errors:
+        logger.error("%s: %s", Path(src_path).name, message)
+    Path(payload_dir).mkdir(parents=True, exist_ok=True)
+    write_text_atomic(_payload_path(src_path), json.dumps(payload, ensure_ascii=False))
+    return payload
+
+
+def load_payload(src_path):
+    """保存した投稿内容を読み込む（HTMLが変更されていれば作り直す）"""
     try:
-        # htnlファイル（ready_upload フォルダ内）
-        if not art_html:
-            logger.info("アップロードする記事が見つかりません。")
-            return True
+        with open(_payload_path(src_path), "r", encoding="utf-8") as file:
+            payload = json.load(file)
+        stat_result = Path(src_path).stat()
+        if payload["source"] == {
+            "size": stat_result.st_size,
+            "mtime_ns": stat_result.st_mtime_ns,
+        }:
+            return payload
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return prepare_payload(src_path)
 
-        # pbar = ProgressBar(count, prefix='Upload art')
 
-        elapsed_time = time.time() - service_manager.last_execution_time
+def remove_payload(src_path):
+    """投稿内容のファイルを削除する"""
+    try:
+        _payload_path(src_path).unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("投稿内容ファイルの削除失敗: %s - %s", src_path.name, e)
 
-        # ゆらぎを追加 (0.5秒〜3.0秒)
-        jitter = random.uniform(0.5, 3.0)
 
-        if elapsed_time < delay_seconds:
-            wait_time = delay_seconds - elapsed_time + jitter
-            logger.info("待機中... (%.1f秒)", wait_time)
-            time.sleep(wait_time)
-        elif service_manager.last_execution_time > 0:
-            # 規定時間を経過していても、機械的な動作を避けるためランダムに待機
-            logger.info("待機中... (%.1f秒)", jitter)
-            time.sleep(jitter)
-
-        # タイトルは<title>タグから抽出
-        soup = BeautifulSoup(art_html, "html.parser")
-        title_tag = soup.find("title")
-        title = (
-            title_tag.get_text(strip=True)
-            if title_tag and title_tag.get_text(strip=True)
-            else ""
-        )
+def _log_post(title, body):
+    logger.info("=" * 50)
+    logger.info("アップロード開始: %s", title)
+    logger.info("公開日: %s", body["published"])
+    logger.info("BLOG_ID: %s", blog_id)
+    logger.info("ラベル: %s", body["labels"])
 
-        # 公開日時を<time>タグから抽出
-        # published_date の取得
-        # time_tagがない場合は、現在時刻をタイムゾーン付きで取得
-        # 公開日時を<time>タグから抽出
-        time_tag = soup.find("time")
-        date_part = (
-            time_tag.get("datetime")[:10]
-            if (time_tag and time_tag.get("datetime"))
-            else datetime.now(JST).strftime("%Y-%m-%d")
-        )
-        published = f"{date_part}T00:00:00+09:00"
 
-        # ラベルを<category>タグから抽出
-        labels_tags = soup.find_all("search")
-        labels = ",".join([tag.get_text(strip=True) for tag in labels_tags])
+def _is_retryable(error):
+    """再試行して良いエラーか"""
+    # 400番台（クライアントエラー）は429（Too Many Requests）以外リトライしない
+    if isinstance(error, HttpError):
+        return not (400 <= error.resp.status < 500 and error.resp.status != 429)
+    return True
 
-        # 位置情報を<blogger:location>から抽出
-        location_name_tag = soup.find("location_name")
-        latitude_tag = soup.find("latitude")
-        longitude_tag = soup.find("longitude")
 
-        if (
-            location_name_tag is not None
-            and latitude_tag is not None
-            and longitude_tag is not None
-        ):
-            try:
-                location_data = {
-                    "name": (
-                        location_name_tag.text.strip() if location_name_tag.text else ""
-                    ),
-                    "lat": float(latitude_tag.text),
-                    "lng": float(longitude_tag.text),
-                }
-            except ValueError:
-                logger.warning(
-                    "位置情報の座標変換に失敗しました。位置情報はスキップされます。 (タイトル: %s)",
-                    title,
+def _is_ambiguous(error):
+    """送信されたかどうかわからないエラーか（タイムアウト・接続切れ・サーバーエラー）"""
+    if isinstance(error, HttpError):
+        return error.resp.status >= 500 and error.resp.status not in THROTTLE_STATUSES
+    return True
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _execute_in_thread(request):
+    """呼び出したスレッドのHTTP接続でAPIを呼び出す（ワーカースレッドで実行）"""
+    return request.execute(http=service_manager.get_service().thread_http())
+
+
+def find_sent_posts(entries):
+    """結果がわからない投稿を、最近更新された投稿の一覧（1回のAPI呼び出し）から探す
+    entries: {ハッシュ: 台帳の記録}
+    戻り値: {ハッシュ: 投稿ID}（見つからなかったものは含まない。候補を1件に絞れないものはNone）
+    一覧を取得できなければNone
+    """
+    if not entries:
+        return {}
+    # 一覧の取得は何度送っても結果が変わらないため、失敗したら再試行する
+    for attempt in range(max_retries):
+        rate_limiter.acquire()
+        try:
+            response = _execute_in_thread(
+                service_manager.get_service()
+                .posts()
+                .list(
+                    blogId=blog_id,
+                    status=["DRAFT", "LIVE", "SCHEDULED"],
+                    orderBy="UPDATED",
+                    fetchBodies=True,
+                    maxResults=max(20, len(entries) * 2),
+                    fields="items(id,title,updated,content)",
                 )
-                location_data = None
+            )
+            break
+        except (HttpError, OSError, IOError, TimeoutError) as e:
+            if not _is_retryable(e) or attempt == max_retries - 1:
+                logger.error("投稿一覧の取得に失敗しました: %s", e)
+                return None
+            wait_time = _throttle_wait(e, attempt)
+            if wait_time:
+                time.sleep(wait_time)
+    items = response.get("items", [])
+    found = {}
+    used = set()
+    # 送信が早い順に、送信時刻（時計のずれを見込む）より後に更新された同じタイトルの投稿を候補にする
+    for key, entry in sorted(entries.items(), key=lambda item: item[1]["updated"]):
+        sent_at = _parse_time(entry["updated"])
+        candidates = []
+        for item in items:
+            updated = _parse_time(item.get("updated"))
+            if (
+                item["id"] not in used
+                and item.get("title", "") == entry["title"]
+                and (
+                    sent_at is None
+                    or updated is None
+                    or updated >= sent_at - timedelta(minutes=5)
+                )
+            ):
+                candidates.append(item)
+        if not candidates:
+            continue  # 投稿されていない
+        # 本文まで同じ投稿（台帳のハッシュが一致するもの）を優先する
+        matched = [
+            item
+            for item in candidates
+            if post_key(
+                {"title": item.get("title", ""), "content": item.get("content", "")}
+            )
+            == key
+        ]
+        if len(matched) == 1:
+            found[key] = matched[0]["id"]
+        elif not matched and len(candidates) == 1 and entry["title"]:
+            # Bloggerが本文を整形した場合はハッシュが変わるため、タイトルが1件だけ一致すれば使う
+            logger.warning(
+                "本文が一致しないため、タイトルで投稿を照合しました: %s (投稿ID: %s)",
+                entry["title"],
+                candidates[0]["id"],
+            )
+            found[key] = candidates[0]["id"]
         else:
-            location_data = None
-        # 本文は<body>タグの中身
-        body_tag = soup.find("body")
-        content = (
-            "".join(str(child) for child in body_tag.children).strip()
-            if body_tag
-            else str(soup)
+            # タイトルなし・同じタイトルの投稿が複数あるなど、どの投稿か決められない
+            logger.warning(
+                "投稿の候補が%d件あり、どの投稿か確認できません: %s",
+                len(matched) or len(candidates),
+                entry["title"] or "(タイトルなし)",
+            )
+            found[key] = None
+            continue
+        used.add(found[key])
+    return found
+
+
+def _recover_posts(failures):
+    """送信結果がわからない失敗は、投稿されていないか一覧で確認する（再送による重複を防ぐ）
+    failures: {ハッシュ: エラー}
+    戻り値: {ハッシュ: 投稿ID}（投稿されていたもの）。確認できなければNone
+    """
+    if test_mode:
+        return {}
+    entries = {}
+    for key, error in failures.items():
+        entry = post_ledger.get(key)
+        if entry and _is_ambiguous(error):
+            entries[key] = entry
+    found = find_sent_posts(entries)
+    if found is None or None in found.values():
+        return None
+    for key, post_id in found.items():
+        logger.info(
+            "送信済みの投稿を確認しました（再送しません）: %s (投稿ID: %s)",
+            entries[key]["title"],
+            post_id,
         )
+        post_ledger.mark_sent(key, post_id)
+    return found
+
+
+def _unverified(title):
+    """投稿されたか確認できない記事は再送しない（台帳に残し、次回の実行で確認する）"""
+    logger.error(
+        "投稿されたか確認できないため再送しません（次回の実行で確認します）: %s", title
+    )
+
+
+def _give_up(key, error):
+    """投稿を諦めた記事の台帳を整理する（結果がわからない場合は次回の確認のため残す）"""
+    if not test_mode and not _is_ambiguous(error):
+        post_ledger.discard(key)
+
+
+def _throttle_wait(error, attempt):
+    """再試行までの待ち時間を返す
+    API制限(429/503)は投稿速度を下げ、Retry-Afterの間はrate_limiterが止める
+    それ以外は指数的に待つ（Retry-Afterがあれば従う）
+    """
+    status = error.resp.status if isinstance(error, HttpError) else None
+    retry_after = retry_after_seconds(error.resp.get("retry-after")) if status else None
+    if status in THROTTLE_STATUSES:
+        rate_limiter.on_throttle(retry_after)
+        return 0
+    if retry_after is not None:
+        return retry_after
+    return min(2**attempt, max_delay_seconds)
+
+
+def _insert_request(body):
+    return (
+        service_manager.get_service()
+        .posts()
+        .insert(blogId=blog_id, body=body, isDraft=True)
+    )
+
+
+def insert_post(title, body, name=None):
+    """1件の記事を下書きとして投稿する（失敗時は再試行する）"""
+    _log_post(title, body)
+    key = post_key(body)
+    if not test_mode:
+        post_ledger.mark_pending(key, name or title, title, body)
+    # API呼び出しのリトライ処理
+    for attempt in range(max_retries):
+        rate_limiter.acquire()
+        try:
+            if not test_mode:
+                # 投稿
+                response = _insert_request(body).execute()
+                logger.info("投稿ID: %s", response.get("id"))
+                post_ledger.mark_sent(key, response.get("id"))
+            else:
+                logger.info("【テストモード】API呼び出しをスキップします")
+
+            logger.info(" 投稿完了 : %s", title if title else "(タイトルなし)")
+            rate_limiter.on_success()
+            return True
+        except (HttpError, OSError, IOError, TimeoutError) as e:
+            # 送信済みなら再送しない
+            recovered = _recover_posts({key: e})
+            if recovered:
+                return True
+            if recovered is None:
+                _unverified(title)
+                return False
+            if not _is_retryable(e):
+                logger.error(
+                    "APIクライアントエラー (ステータス: %s): %s - 再試行を中止します",
+                    e.resp.status,
+                    e,
+                )
+                _give_up(key, e)
+                return False
 
-        body = {
-            "kind": "blogger#post",
-            "title": title,
-            "content": content,
-            "labels": labels,
-            "blog": {"id": blog_id},
-            "published": published,
-        }
-
-        # 公開日時があれば追加
-        if published:
-            body["published"] = published
-
-        # 位置情報があれば追加
-        if location_data:
-            body["location"] = location_data
-
-        logger.info("=" * 50)
-        logger.info("アップロード開始: %s", title)
-        logger.info("公開日: %s", published)
-        logger.info("BLOG_ID: %s", blog_id)
-        logger.info("ラベル: %s", labels)
-
-        # API呼び出しのリトライ処理
-        success = False
+            if attempt < max_retries - 1:
+                wait_time = _throttle_wait(e, attempt)
+                logger.warning(
+                    "APIエラー (試行 %s/%s): %s - 再試行します",
+                    attempt + 1,
+                    max_retries,
+                    e,
+                )
+                if wait_time:
+                    logger.info("待機中... (%.1f秒)", wait_time)
+                    time.sleep(wait_time)
+            else:
+                logger.error(
+                    "アップロード失敗 (タイトル: %s): %s", title, e, exc_info=True
+                )
+                _give_up(key, e)
+    return False
+
+
+def insert_posts_batch(posts, on_done):
+    """複数の記事をHTTPバッチで投稿する
+    posts: [(記事ファイル, タイトル, 投稿内容)]
+    on_done: 記事ごとに on_done(記事ファイル, 成否) を呼ぶ
+    """
+    pending = list(posts)
+    for attempt in range(max_retries):
+        retry = []
+        wait_time = 0
+        for start in range(0, len(pending), batch_size):
+            group = pending[start : start + batch_size]
+            stage_control.checkpoint()
+            for file, title, body in group:
+                _log_post(title, body)
+                if not test_mode:
+                    post_ledger.mark_pending(post_key(body), file.name, title, body)
+            rate_limiter.acquire(len(group))
+            if test_mode:
+                logger.info("【テストモード】API呼び出しをスキップします")
+                for file, _, _ in group:
+                    on_done(file, True)
+                continue
+
+            results = {}
+
+            def callback(request_id, response, exception, results=results):
+                results[request_id] = (response, exception)
+
+            batch = service_manager.get_service().new_batch_http_request(
+                callback=callback
+            )
+            for index, (_, _, body) in enumerate(group):
+                batch.add(_insert_request(body), request_id=str(index))
+            batch_error = None
+            try:
+                batch.execute()
+            except (HttpError, OSError, IOError, TimeoutError) as e:
+                # バッチ全体の失敗は、まとめて再試行する
+                batch_error = e
+
+            # 結果がわからない失敗は、バッチごとに1回の一覧取得でまとめて確認する
+            failures = {}
+            for index, (_, _, body) in enumerate(group):
+                response, error = results.get(str(index), (None, batch_error))
+                if error is not None or response is None:
+                    failures[post_key(body)] = error
+            recovered = _recover_posts(failures) if failures else {}
+            unverified = recovered is None
+            recovered = recovered or {}
+
+            throttle_error = None
+            for index, (file, title, body) in enumerate(group):
+                key = post_key(body)
+                response, error = results.get(str(index), (None, batch_error))
+                if error is None and response is not None:
+                    logger.info("投稿ID: %s", response.get("id"))
+                    logger.info(" 投稿完了 : %s", title if title else "(タイトルなし)")
+                    post_ledger.mark_sent(key, response.get("id"))
+                    rate_limiter.on_success()
+                    on_done(file, True)
+                elif key in recovered:
+                    on_done(file, True)
+                elif unverified and _is_ambiguous(error):
+                    _unverified(title)
+                    on_done(file, False)
+                elif _is_retryable(error) and attempt < max_retries - 1:
+                    if (
+                        isinstance(error, HttpError)
+                        and error.resp.status in THROTTLE_STATUSES
+                    ):
+                        # 同じバッチ内の制限は1回として速度を下げる
+                        throttle_error = throttle_error or error
+                    else:
+                        wait_time = max(wait_time, _throttle_wait(error, attempt))
+                    logger.warning(
+                        "APIエラー (試行 %s/%s): %s - %s",
+                        attempt + 1,
+                        max_retries,
+                        title,
+                        error,
+                    )
+                    retry.append((file, title, body))
+                else:
+                    logger.error("アップロード失敗 (タイトル: %s): %s", title, error)
+                    _give_up(key, error)
+                    on_done(file, False)
+            if throttle_error:
+                _throttle_wait(throttle_error, attempt)
+        pending = retry
+        if not pending:
+            break
+        logger.warning("%d 件を再試行します", len(pending))
+        if wait_time:
+            logger.info("待機中... (%.1f秒)", wait_time)
+            time.sleep(wait_time)
+
+
+async def _insert_post_async(file, title, body, semaphore, executor, on_done):
+    """1件の記事を投稿する（他の記事とは別に再試行する）
+    中止された場合は送信せずにStageCancelledを返す
+    """
+    loop = asyncio.get_running_loop()
+    async with semaphore:
+        # 一時停止中も送信中の記事の完了処理を進めるよう、イベントループの外で待つ
+        try:
+            await loop.run_in_executor(None, stage_control.checkpoint)
+        except StageCancelled as e:
+            return e
+        _log_post(title, body)
+        key = post_key(body)
+        if not test_mode:
+            post_ledger.mark_pending(key, file.name, title, body)
         for attempt in range(max_retries):
+            # 全体の投稿速度はrate_limiterで守る（制限中はRetry-Afterまで待つ）
+            wait_time = rate_limiter.reserve()
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
             try:
                 if not test_mode:
-                    # 投稿
-                    response = (
-                        service_manager.get_service()
-                        .posts()
-                        .insert(blogId=blog_id, body=body, isDraft=True)
-                        .execute()
+                    response = await loop.run_in_executor(
+                        executor, _execute_in_thread, _insert_request(body)
                     )
                     logger.info("投稿ID: %s", response.get("id"))
+                    post_ledger.mark_sent(key, response.get("id"))
                 else:
                     logger.info("【テストモード】API呼び出しをスキップします")
-
                 logger.info(" 投稿完了 : %s", title if title else "(タイトルなし)")
-                success = True
-                break
+                rate_limiter.on_success()
+                on_done(file, True)
+                return
             except (HttpError, OSError, IOError, TimeoutError) as e:
-                # HttpErrorの場合、ステータスコードを確認
-                if isinstance(e, HttpError):
-                    # 400番台（クライアントエラー）は429（Too Many Requests）以外リトライしない
-                    if 400 <= e.resp.status < 500 and e.resp.status != 429:
-                        logger.error(
-                            "APIクライアントエラー (ステータス: %s): %s - 再試行を中止します",
-                            e.resp.status,
-                            e,
-                        )
-                        break
-
+                # 送信済みなら再送しない（一覧の取得はワーカースレッドで行う）
+                recovered = await loop.run_in_executor(
+                    executor, _recover_posts, {key: e}
+                )
+                if recovered:
+                    on_done(file, True)
+                    return
+                if recovered is None:
+                    _unverified(title)
+                    break
+                if not _is_retryable(e):
+                    logger.error(
+                        "APIクライアントエラー (ステータス: %s): %s - 再試行を中止します",
+                        e.resp.status,
+                        e,
+                    )
+                    _give_up(key, e)
+                    break
                 if attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 2
+                    wait_time = _throttle_wait(e, attempt)
                     logger.warning(
-                        "APIエラー (試行 %s/%s): %s - %s秒後に再試行します",
+                        "APIエラー (試行 %s/%s): %s - %s",
                         attempt + 1,
                         max_retries,
+                        title,
                         e,
-                        wait_time,
                     )
-                    time.sleep(wait_time)
+                    if wait_time:
+                        logger.info("待機中... (%.1f秒)", wait_time)
+                        await asyncio.sleep(wait_time)
                 else:
-                    logger.error(
-                        "アップロード失敗 (タイトル: %s): %s", title, e, exc_info=True
-                    )
-            finally:
-                service_manager.last_execution_time = time.time()
-        return success
+                    logger.error("アップロード失敗 (タイトル: %s): %s", title, e)
+                    _give_up(key, e)
+        on_done(file, False)
+
+
+async def _insert_posts_async(posts, on_done):
+    semaphore = asyncio.Semaphore(concurrency)
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="upload_art"
+    ) as executor:
+        results = await asyncio.gather(
+            *(
+                _insert_post_async(file, title, body, semaphore, executor, on_done)
+                for file, title, body in posts
+            )
+        )
+    # 中止後も送信中だった記事は完了まで待ってから（台帳を確定してから）中止する
+    for result in results:
+        if isinstance(result, StageCancelled):
+            raise result
+
+
+def insert_posts_async(posts, on_done):
+    """複数の記事を、concurrency件まで同時に送信中にして投稿する
+    posts: [(記事ファイル, タイトル, 投稿内容)]
+    on_done: 記事ごとに on_done(記事ファイル, 成否) を呼ぶ（イベントループのスレッドから）
+    postsの件数は呼び出し側で1日の上限内に収めておく
+    """
+    # 認証（ブラウザでの初回認証を含む）はワーカースレッドを使う前に済ませる
+    if not test_mode:
+        service_manager.get_service()
+    asyncio.run(_insert_posts_async(posts, on_done))
+
+
+def changed_fields(entry, body):
+    """前回送信した内容から変わった項目だけの投稿内容を返す
+    公開日・位置情報は記事にない場合は変更しない（前回の値を残す）
+    """
+    old = entry.get("fields") or {}
+    new = post_fields(body)
+    changes = {}
+    for field in ("title", "content", "labels", "location", "published"):
+        if new[field] is None or (field in old and old[field] == new[field]):
+            continue
+        changes[field] = body[field]
+    return changes
+
+
+def patch_post(post_id, title, changes):
+    """投稿済みの記事の変更した項目だけを送る（失敗時は再試行する）"""
+    logger.info("=" * 50)
+    logger.info("更新開始: %s (投稿ID: %s)", title, post_id)
+    logger.info("更新項目: %s", ", ".join(changes))
+    for attempt in range(max_retries):
+        rate_limiter.acquire()
+        try:
+            if not test_mode:
+                service_manager.get_service().posts().patch(
+                    blogId=blog_id, postId=post_id, body=changes, fetchBody=False
+                ).execute()
+            else:
+                logger.info("【テストモード】API呼び出しをスキップします")
+            logger.info(" 更新完了 : %s", title if title else "(タイトルなし)")
+            rate_limiter.on_success()
+            return True
+        except (HttpError, OSError, IOError, TimeoutError) as e:
+            if not _is_retryable(e):
+                logger.error(
+                    "APIクライアントエラー (ステータス: %s): %s - 再試行を中止します",
+                    e.resp.status,
+                    e,
+                )
+                return False
+            # 更新は同じ内容を送り直しても結果が変わらないため、そのまま再試行する
+            if attempt < max_retries - 1:
+                wait_time = _throttle_wait(e, attempt)
+                logger.warning(
+                    "APIエラー (試行 %s/%s): %s - 再試行します",
+                    attempt + 1,
+                    max_retries,
+                    e,
+                )
+                if wait_time:
+                    logger.info("待機中... (%.1f秒)", wait_time)
+                    time.sleep(wait_time)
+            else:
+                logger.error("更新失敗 (タイトル: %s): %s", title, e, exc_info=True)
+    return False
+
+
+def update_articles(updates, queue_obj, pbar):
+    """投稿済みの記事を更新する（新規投稿ではないため1日の投稿数には数えない）
+    updates: [(記事ファイル, 投稿内容, (ハッシュ, 台帳の記録))]
+    """
+    for file, payload, (old_key, entry) in updates:
+        stage_control.checkpoint()
+        file.status = "▶"
+        queue_obj.put(file)
+        body = payload["body"]
+        changes = changed_fields(entry, body)
+        if not changes:
+            logger.info("変更がないため更新しません: %s", file.name)
+            success = True
+        else:
+            success = patch_post(entry["post_id"], payload["title"], changes)
+        if success:
+            if not test_mode:
+                post_ledger.mark_updated(
+                    old_key, post_key(body), file.name, body, entry["post_id"]
+                )
+            file.status = "✔" if move_history_file(file) else "⚠️"
+        else:
+            file.status = "✘"
+        queue_obj.put(file)
+        pbar.update()
+    rate_limiter.save()
+
+
+def upload_art(art_html):
+    """Blogger にアップロード"""
+    try:
+        # htnlファイル（ready_upload フォルダ内）
+        if not art_html:
+            logger.info("アップロードする記事が見つかりません。")
+            return True
+        title, body, _, errors = build_post(art_html)
     except (ValueError, AttributeError, TypeError) as e:
         logger.error("記事処理中に予期せぬエラーが発生しました: %s", e, exc_info=True)
         return False
+    if errors:
+        logger.error("記事を投稿できません: %s", ", ".join(errors))
+        return False
+    return insert_post(title, _published_today(body))
+
+
+def post_articles(articles, queue_obj, pbar):
+    """記事をまとめて投稿し、成功した件数を返す
+    articles: [(記事ファイル, 投稿内容)]
+    """
+    success_count = 0
+    keys = {}
+
+    def on_done(file, success, new_post=True):
+        nonlocal success_count
+        if success:
+            if not test_mode and new_post:
+                # 履歴移動の成否に関わらず、投稿した分はクォータを使っている
+                quota_ledger.record(blog_id)
+            if move_history_file(file):
+                if not test_mode:
+                    post_ledger.mark_confirmed(keys[file.name])
+                file.status = "✔"
+                if new_post:
+                    success_count += 1
+            else:
+                file.status = "⚠️"
+                logger.error(
+                    "履歴保存失敗のため、元ファイルを残します: %s",
+                    file.name,
+                    exc_info=True,
+                )
+        else:
+            file.status = "✘"
+            logger.error(
+                "記事のアップロードに失敗しました: %s", file.name, exc_info=True
+            )
+        queue_obj.put(file)
+        pbar.update()
+
+    posts = []
+    # 前回の実行で送信中だった記事は、再送する前に投稿されたかを一覧で確認する
+    uncertain = {}
+    for file, payload in articles:
+        keys[file.name] = post_key(payload["body"])
+        entry = None if test_mode else post_ledger.get(keys[file.name])
+        if entry and entry["state"] == PENDING:
+            uncertain[keys[file.name]] = entry
+    found = find_sent_posts(uncertain) if uncertain else {}
+    for key, post_id in (found or {}).items():
+        if post_id:
+            post_ledger.mark_sent(key, post_id)
+
+    for file, payload in articles:
+        key = keys[file.name]
+        entry = None if test_mode else post_ledger.get(key)
+        if entry and entry["state"] in (SENT, CONFIRMED):
+            # 投稿済み（前回の実行で履歴への移動前に中断した等）は再送しない
+            logger.info(
+                "投稿済みのため送信しません: %s (投稿ID: %s)",
+                file.name,
+                entry["post_id"],
+            )
+            on_done(file, True, new_post=False)
+            continue
+        if entry and entry["state"] == PENDING:
+            if found is None or key in found:
+                # 確認できないまま送ると重複する可能性があるため、次回に回す
+                logger.warning("投稿済みか確認できないため保留します: %s", file.name)
+                file.status = "⏸️"
+                queue_obj.put(file)
+                pbar.update()
+                continue
+            post_ledger.discard(key)  # 投稿されていなかった
+        file.status = "▶"  # 処理中ステータスをGUIに通知
+        queue_obj.put(file)
+        posts.append((file, payload["title"], _published_today(payload["body"])))
+
+    if engine == "batch":
+        insert_posts_batch(posts, on_done)
+    elif engine == "async":
+        insert_posts_async(posts, on_done)
+    else:
+        for file, title, body in posts:
+            stage_control.checkpoint()
+            on_done(file, insert_post(title, body, file.name))
+    # 今回安全だった投稿速度を次回に引き継ぐ
+    rate_limiter.save()
+    return success_count
 
 
 def is_resume():
     """upload_dir (投稿用一時フォルダ) にファイルがあれば、再起動（再開）と判定する"""
-    if Path(upload_dir).exists():
-        has_html = any(
-            p.is_file() and p.suffix.lower() in html_extensions
-            for p in Path(upload_dir).rglob("*")
-        )
-        if has_html:
-            logger.info("再起動からの処理を開始します。(ファイルコピーをスキップ)")
-            return True
+    if get_index(upload_dir).has(FileKind.HTML):
+        logger.info("再起動からの処理を開始します。(ファイルコピーをスキップ)")
+        return True
     logger.debug("新規処理を開始します。ファイルを準備します。")
     return False
 
 
-def run(queue_obj):
-    """input_dir フォルダからアップロードを実行"""
+def run(queue_obj, update=None):
+    """input_dir フォルダからアップロードを実行
+    update: 投稿済みの記事を更新する（Noneなら設定のupdate_mode）
+    """
     logger.info("サービス開始")
+    if update is None:
+        update = update_mode
     if not ready_upload():
         logger.error("アップロード準備に失敗しました。処理を中断します。")
         return False
@@ -320,13 +1004,7 @@ def run(queue_obj):
             return False
 
     # 処理対象のファイルを upload_dir から取得し、名前順でソート
-    files_to_process = sorted(
-        [
-            p
-            for p in Path(upload_dir).rglob("*")
-            if p.is_file() and p.suffix.lower() in html_extensions
-        ]
-    )
+    files_to_process = get_index(upload_dir).files(FileKind.HTML)
     if not files_to_process:
         logger.info("アップロード対象のHTMLファイルが見つかりません。")
         return True
@@ -335,78 +1013,137 @@ def run(queue_obj):
     for src_path in files_to_process:
         file = SmartFile(src_path)
         file.status = "⏳"
-        file.extensions = "html"
+        file.kind = FileKind.HTML
         file.disp_path = file.name
         queue_obj.put(file)
 
     pbar = ProgressBar(len(files_to_process), prefix="Art HTML")
-    processed_count = 0
-    wait_posts_list = []
+    articles = []
+    updates = []
     for src_path in files_to_process:
-
-        if processed_count >= max_posts_per_run:
-            file = SmartFile(src_path)
-            file.status = "⏸️"
-            file.extensions = "html"
-            file.disp_path = file.name
-            queue_obj.put(file)
-            pbar.update()
-            wait_posts_list.append(file)
-            logger.info("実行上限に達しました: %s", file.name)
-            continue  # 以降のファイルはスキップして処理を続行する場合は continue を使用
-
         file = SmartFile(src_path)
-        file.status = "▶"  # 処理中ステータスをGUIに通知
-        file.extensions = "html"
+        file.kind = FileKind.HTML
         file.disp_path = file.name
-        queue_obj.put(file)
 
+        # 投稿内容は準備時に作成済み（HTMLが変更されていれば作り直す）
         try:
-            art_html = src_path.read_text(encoding="utf-8")
-        except (IOError, OSError, UnicodeDecodeError) as e:
+            payload = load_payload(src_path)
+        except (IOError, OSError, UnicodeDecodeError, ValueError) as e:
             logger.error(
                 "ファイル読み込み失敗: %s - %s", src_path.name, e, exc_info=True
             )
             file.status = "✘"
             queue_obj.put(file)
+            pbar.update()
             continue
 
-        if upload_art(art_html):
-            if move_history_file(src_path):
-                file.status = "✔"
-                processed_count += 1
-            else:
-                file.status = "⚠️"
-                logger.error(
-                    "履歴保存失敗のため、元ファイルを残します: %s",
-                    src_path.name,
-                    exc_info=True,
-                )
-            queue_obj.put(file)
-        else:
+        # 本文がないなど投稿できない記事は、クォータを使わずに残す
+        if payload["errors"]:
+            logger.error(
+                "記事を投稿できません: %s (%s)",
+                src_path.name,
+                ", ".join(payload["errors"]),
+            )
             file.status = "✘"
             queue_obj.put(file)
-            logger.error(
-                "記事のアップロードに失敗しました: %s", src_path.name, exc_info=True
+            pbar.update()
+            continue
+        # 更新モードでは、投稿済みの記事（同じファイル名）を更新として送る
+        if update:
+            key, entry = post_ledger.find_by_name(src_path.name)
+            if entry:
+                updates.append((file, payload, (key, entry)))
+                continue
+        # 重複チェックで印が付いた記事は投稿しない（投稿数の上限にも数えない）
+        original = payload["duplicate_of"]
+        if original:
+            logger.warning(
+                "重複記事のため投稿しません: %s (%s と重複)", src_path.name, original
             )
-            # 失敗しても次のファイルの処理を継続する場合はここでのreturnは不要
+            file.status = "🚫" if move_duplicate_file(src_path) else "⚠️"
+            queue_obj.put(file)
+            pbar.update()
+            continue
+        articles.append((file, payload))
+
+    if updates:
+        update_articles(updates, queue_obj, pbar)
+
+    # 今日のクォータの残りと1回の上限から、今回投稿する件数を決める
+    windows = plan(articles, blog_id, max_posts=max_posts_per_run)
+    budget = len(windows[0][1])
+    logger.info(
+        "今日の投稿数: %d件 (今回の上限 %d件)", quota_ledger.used(blog_id), budget
+    )
+    for start, window in windows[1:]:
+        logger.info(
+            "投稿予定: %s 以降に %d件", start.strftime("%Y-%m-%d %H:%M"), len(window)
+        )
+
+    # 成功した件数が上限に達するまで投稿する（失敗した分は次の記事で埋める）
+    processed_count = 0
+    while articles and processed_count < budget:
+        group = articles[: budget - processed_count]
+        articles = articles[len(group) :]
+        processed_count += post_articles(group, queue_obj, pbar)
+
+    wait_posts_list = []
+    for file, _ in articles:
+        file.status = "⏸️"
+        queue_obj.put(file)
         pbar.update()
+        wait_posts_list.append(file)
+        logger.info("実行上限に達しました: %s", file.name)
     if wait_posts_list:
         logger.info(
-            "%s 件の記事が上限に達したため、翌日以降の実行で処理されます。",
+            "%s 件の記事が上限に達したため、%s 以降の実行で処理されます。",
             len(wait_posts_list),
+            next_reset().strftime("%Y-%m-%d %H:%M"),
         )
         return wait_posts_list
     # 全て成功
     return True
 
 
+def run_scheduled(queue_obj, margin_seconds=60, update=None):
+    """クォータのリセットを待ちながら、残りの記事がなくなるまで投稿を繰り返す"""
+    while True:
+        result = run(queue_obj, update)
+        if not isinstance(result, list):
+            return result
+        reset_at = next_reset()
+        wait_time = (reset_at - datetime.now(JST)).total_seconds() + margin_seconds
+        logger.info(
+            "クォータのリセット (%s) まで待機します: 残り %d件",
+            reset_at.strftime("%Y-%m-%d %H:%M"),
+            len(result),
+        )
+        time.sleep(max(0.0, wait_time))
+
+
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Bloggerに記事を投稿する")
+    parser.add_argument(
+        "--schedule",
+        action="store_true",
+        help="投稿上限に達したらクォータのリセットを待って続きを投稿する",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        default=None,
+        help="投稿済みの記事（同じファイル名）は新規投稿せず、変更した項目だけ更新する",
+    )
+    args = parser.parse_args()
+
     result_queue = queue.Queue()
     move_upload_file(result_queue)
     try:
-        run(result_queue)
+        if args.schedule:
+            run_scheduled(result_queue, update=args.update)
+        else:
+            run(result_queue, args.update)
     except KeyboardInterrupt:
         logger.info("処理が中断されました。")
     except (IOError, OSError) as e:
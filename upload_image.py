@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 """upload_image.py
 画像アップロード用モジュール
+アップロード先（image_host）が手動の場合は画像を準備するだけで、
+それ以外は並行してアップロードし、URLを画像URL台帳に登録する
 """
 import logging
 import queue
 import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-from file_class import SmartFile
+from dir_index import get_index
+from file_class import FileKind, SmartFile
+from image_host import ImageHostError, direct_upload, get_host
+from image_index import file_sha256, image_index_manager, media_url_registry
 from parameter import config
+from stage_journal import stage_control
 
 logger = logging.getLogger(__name__)
 
@@ -18,8 +25,8 @@ logger = logging.getLogger(__name__)
 input_dir = config["upload_image"]["input_dir"].lstrip("./")
 # アップロード先フォルダ
 upload_dir = config["upload_image"]["upload_dir"].lstrip("./")
-# 画像拡張子
-image_extensions = config["common"]["image_extensions"]
+# 同時にアップロードする画像の数
+workers = max(1, int(config["upload_image"].get("workers", 4)))
 
 
 def move_upload_file(queue_obj):
@@ -34,39 +41,93 @@ def move_upload_file(queue_obj):
         )
         return False
 
-    for file_path in Path(input_dir).rglob("*"):
-        # ファイルであり、かつ拡張子が指定のものに含まれるかチェック
-        if file_path.is_file() and file_path.suffix.lower() in image_extensions:
-            dest_path = Path(upload_dir) / file_path.name
-            # 3. コピー実行（メタデータも保持するcopy2を推奨）
-            shutil.copy2(file_path, dest_path)
-            count += 1
-
-            smart_file = SmartFile(dest_path)
-            smart_file.status = "⌛"
-            smart_file.extensions = "image"
-            smart_file.disp_path = dest_path.name
-            queue_obj.put(smart_file)
+    # 以前アップロードした画像と同じものは、link_htmlで既存のURLを使うためコピーしない
+    if not image_index_manager.load_index():
+        logger.warning("画像インデックスが使えないため、すべての画像を準備します。")
+        use_index = False
+    else:
+        use_index = True
+
+    upload_index = get_index(upload_dir)
+    skipped = 0
+    for file_path in get_index(input_dir).files(FileKind.IMAGE):
+        if use_index and image_index_manager.find_url(file_path):
+            logger.info("アップロード済みの画像のためスキップ: %s", file_path.name)
+            skipped += 1
+            file_path.status = "✔"
+            file_path.disp_path = file_path.name
+            queue_obj.put(file_path)
+            continue
+        dest_path = Path(upload_dir) / file_path.name
+        # 3. コピー実行（メタデータも保持するcopy2を推奨）
+        shutil.copy2(file_path, dest_path)
+        upload_index.update(dest_path)
+        count += 1
+
+        smart_file = SmartFile(dest_path)
+        smart_file.status = "⌛"
+        smart_file.kind = FileKind.IMAGE
+        smart_file.disp_path = dest_path.name
+        queue_obj.put(smart_file)
     logger.info("%d 枚の画像を %s にアップロードしました。", count, upload_dir)
+    if skipped:
+        logger.info("%d 枚の画像はアップロード済みのためスキップしました。", skipped)
     return True
 
 
 def is_resume():
     """upload_dir (投稿用一時フォルダ) にファイルがあれば、再起動（再開）と判定する"""
-    if Path(upload_dir).exists():
-        has_image = any(
-            p.is_file() and p.suffix.lower() in image_extensions
-            for p in Path(upload_dir).rglob("*")
-        )
-        if has_image:
-            logger.info("再起動からの処理を開始します。(ファイルコピーをスキップ)")
-            return True
+    if get_index(upload_dir).has(FileKind.IMAGE):
+        logger.info("再起動からの処理を開始します。(ファイルコピーをスキップ)")
+        return True
     logger.debug("新規処理を開始します。ファイルを準備します。")
     return False
 
 
+def _upload_one(host, smart_file):
+    """1枚の画像をアップロードしてURLを台帳に登録する（アップロード済みなら送らない）"""
+    stage_control.checkpoint()
+    sha256 = file_sha256(smart_file)
+    url = media_url_registry.find(smart_file.name, sha256)
+    if url:
+        logger.info("アップロード済みのためスキップ: %s", smart_file.name)
+        return url
+    url = host.upload(smart_file, sha256)
+    if not media_url_registry.add(smart_file.name, url, sha256):
+        raise ImageHostError(f"URLを登録できません: {smart_file.name}")
+    logger.info("アップロード完了: %s -> %s", smart_file.name, url)
+    return url
+
+
+def upload_files(host, files, queue_obj):
+    """画像を並行してアップロードする
+    アップロードした画像は1枚ごとに台帳に登録するため、中断しても続きから再開できる
+    戻り値: 失敗した画像のリスト
+    """
+    failed = []
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="upload_image"
+    ) as executor:
+        futures = {
+            executor.submit(_upload_one, host, smart_file): smart_file
+            for smart_file in files
+        }
+        for future in as_completed(futures):
+            smart_file = futures[future]
+            try:
+                future.result()
+                smart_file.status = "✔"
+            except (ImageHostError, OSError) as e:
+                logger.error("画像アップロード失敗: %s - %s", smart_file.name, e)
+                smart_file.status = "✘"
+                failed.append(smart_file)
+            smart_file.disp_path = smart_file.name
+            queue_obj.put(smart_file)
+    return failed
+
+
 def run(queue_obj):
-    """手動アップロード用に画像を準備する"""
+    """画像をアップロードする（手動の場合はアップロード用に準備する）"""
     logger.info("画像アップロード準備開始: %s -> %s", input_dir, upload_dir)
     Path(upload_dir).mkdir(parents=True, exist_ok=True)
 
@@ -83,18 +144,29 @@ def run(queue_obj):
             return False
 
     # upload_dir 内のファイルを処理対象とする
-    files_to_process = sorted(
-        [
-            p
-            for p in Path(upload_dir).rglob("*")
-            if p.is_file() and p.suffix.lower() in image_extensions
-        ]
-    )
+    files_to_process = get_index(upload_dir).files(FileKind.IMAGE)
+    if direct_upload():
+        host = get_host()
+        if host is None:
+            return False
+        logger.info(
+            "画像アップロード開始: %d 枚 (%s)", len(files_to_process), host.name
+        )
+        failed = upload_files(host, files_to_process, queue_obj)
+        logger.info(
+            "%d 枚の画像をアップロードしました。", len(files_to_process) - len(failed)
+        )
+        if failed:
+            logger.error(
+                "%d 枚の画像のアップロードに失敗しました。再実行すると続きから送ります。",
+                len(failed),
+            )
+            return False
+        return True
+
     count = 0
-    for src_path in files_to_process:
-        smart_file = SmartFile(src_path)
+    for smart_file in files_to_process:
         smart_file.status = "✓"  # ここではアップロード準備完了として✓を付ける
-        smart_file.extensions = "image"
         smart_file.disp_path = smart_file.name
         queue_obj.put(smart_file)
         count += 1
@@ -106,6 +178,7 @@ def run(queue_obj):
 def rm():
     """アップロード用一時フォルダを削除する"""
     shutil.rmtree(upload_dir, ignore_errors=True)
+    get_index(upload_dir).invalidate()
 
 
 # --- メイン処理 ---